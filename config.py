@@ -36,4 +36,36 @@ CUT_OFF_PATTERNS = [
 HISTORY_PATTERNS = [
     r"-{5,}", r"_{5,}", r"---------- Odpovězená zpráva ----------", 
     r"Dne .* odesílatel .* napsal\(a\):", r"Od: .* Posláno: .*", r"---------- Původní e-mail ----------"
-]
\ No newline at end of file
+]
+
+# --- SYNCHRONIZACE DAKTELA ---
+SYNC_MAX_WORKERS = 8    # Max. počet souběžně stahovaných ticketů (aktivity)
+SYNC_MAX_RPS = 10       # Max. počet API požadavků za sekundu
+SYNC_BULK_TICKETS = 50  # Počet ticketů v jednom hromadném dotazu na aktivity (0 = po jednom ticketu)
+SYNC_WRITE_BATCH = 1000 # Počet řádků v jedné dávce zápisu (executemany) do SQLite
+SYNC_LOOKUP_BATCH = 200     # Počet ticketů, jejichž číselníky (uživatelé, kontakty, ...) se připraví jedním dotazem
+SYNC_LOOKUP_CACHE = 50000   # Max. počet záznamů jednoho číselníku drženého v paměti během synchronizace (LRU)
+
+# --- ANALÝZA TICKETŮ (PIPELINE) ---
+HARVEST_FETCH_WORKERS = 4   # Souběžná stahování aktivit z Daktely
+HARVEST_AI_WORKERS = 4      # Souběžné dotazy na OpenAI
+HARVEST_QUEUE_SIZE = 16     # Max. počet ticketů čekajících mezi fázemi pipeline
+
+# --- STRÁNKOVÁNÍ API ---
+API_PAGE_WORKERS = 4        # Max. počet souběžně stahovaných stránek (take=1000) jednoho výpisu
+API_SHARD_MIN_DAYS = 31     # Delší rozsahy se automaticky dělí na časová okna (dny/týdny)
+
+# --- ČÍSELNÍKY (kategorie, statusy, fronty, uživatelé) ---
+CODEBOOK_TTL = 6 * 3600     # Platnost sdílené cache číselníků v sekundách
+
+# --- LOKÁLNÍ DATABÁZE (SQLite) ---
+DB_MMAP_SIZE = 256 * 1024 * 1024    # Paměťově mapovaná část souboru DB (bajty)
+DB_CACHE_SIZE_KB = 64 * 1024        # Cache stránek na jedno spojení (KiB)
+DB_BUSY_TIMEOUT = 30                # Max. čekání na zámek souboru DB (s), např. při souběhu s CLI synchronizací
+DB_WRITE_LOCK_TIMEOUT = 10          # Max. čekání stránky na zapisovací spojení, než ohlásí "probíhá synchronizace" (s)
+SNAPSHOT_AFTER_SYNC = True          # Po synchronizaci přestavět sloupcové snapshoty (data/snapshots) pro statistiky a prohlížeč
+STATS_TABLE_ROWS = 5000             # Max. řádků detailní tabulky a exportu statistik při výpočtech v DuckDB
+CONTENT_BLOCK_MIN_CHARS = 200       # Citovaná historie e-mailu od této délky se ukládá jednou jako sdílený blok (content_blocks)
+CONTENT_DICT_SIZE = 32 * 1024       # Velikost sdíleného slovníku komprese obsahu aktivit (bajty, zlib využije max. 32 KiB)
+CONTENT_DICT_MIN_ROWS = 500         # Slovník se natrénuje, až je v DB aspoň tolik aktivit
+CONTENT_CACHE_CHARS = 16 * 1024 * 1024  # Rozbalené bloky obsahu v paměti na jedno spojení (znaky; vlákna se stejnou historií)
@@ -2,6 +2,8 @@ import streamlit as st
 # Import všech modulů
 # ZMĚNA: Přidán import page_todo
 from modules import page_harvester, page_mainmenu, page_downloader, page_statistics, page_dbupdate, page_dbview, page_todo
+from utils.storage import db_exists
+from utils.db_sync import init_db
 
 # --- KONFIGURACE STRÁNKY ---
 st.set_page_config(page_title="Datio", layout="wide", initial_sidebar_state="expanded")
@@ -62,6 +64,19 @@ if not st.session_state.authenticated:
                     st.error("❌ Špatné heslo.")
     st.stop()
 
+# --- SCHÉMA DATABÁZE ---
+# ZMĚNA: Čekající migrace se provedou jednou za proces hned po startu, ne až při první
+# synchronizaci (statistiky a prohlížeč DB počítají s aktuálním schématem)
+@st.cache_resource(show_spinner="Aktualizuji schéma lokální databáze...")
+def prepare_database():
+    if db_exists(): init_db()
+    return True
+
+try:
+    prepare_database()
+except Exception as e:
+    st.error(f"❌ Aktualizace schématu databáze selhala: {e}")
+
 # ==============================================================================
 # --- DEFINICE STRÁNEK A NAVIGACE ---
 # ==============================================================================
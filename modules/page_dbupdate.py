@@ -1,11 +1,20 @@
 import streamlit as st
-import requests
-import sqlite3
 import pandas as pd
-from datetime import datetime, timedelta, date
+from datetime import timedelta, date
 import time
-from bs4 import BeautifulSoup
 import os
+from config import SYNC_MAX_WORKERS, SYNC_MAX_RPS, SYNC_BULK_TICKETS, API_PAGE_WORKERS, DB_WRITE_LOCK_TIMEOUT
+from utils.codebooks import codebook_map, refresh_codebooks
+from utils.daktela_client import get_client
+# ZMĚNA: Logika synchronizace je v utils.db_sync, běží na pozadí přes registr úloh
+from utils.db_sync import get_resumable_run, finish_sync_run, get_watermark, get_last_ticket_date
+# ZMĚNA: Čtení přes sdílená čtecí spojení, zápisy přes jediné zapisovací spojení (utils.storage)
+from utils.storage import get_read_connection, writer
+from utils.migrations import get_schema_version, LATEST_VERSION
+from utils import fulltext, snapshots
+from utils.rollups import rebuild_rollups
+from utils.content_store import prune_blocks
+from utils.sync_jobs import start_sync_job, get_active_job, get_last_job, ACTIVE_STATES
 
 # --- KONFIGURACE ---
 try:
@@ -15,58 +24,8 @@ except:
     INSTANCE_URL = "" 
     ACCESS_TOKEN = ""
 
-DATA_DIR = "data"
-DB_FILE = os.path.join(DATA_DIR, "daktela_data.db")
-
-# --- IN-MEMORY CACHE PRO EXTRÉMNÍ ZRYCHLENÍ ---
-class DBLookup:
-    def __init__(self, conn):
-        self.conn = conn
-        self.c = conn.cursor()
-        self.cache = {
-            'users': {row[0]: row[1] for row in self.c.execute("SELECT daktela_id, user_id FROM users").fetchall()},
-            'categories': {row[0]: row[1] for row in self.c.execute("SELECT daktela_id, category_id FROM categories").fetchall()},
-            'statuses': {row[0]: row[1] for row in self.c.execute("SELECT daktela_id, status_id FROM statuses").fetchall()},
-            'queues': {row[0]: row[1] for row in self.c.execute("SELECT daktela_id, queue_id FROM queues").fetchall()},
-            'clients': {row[0]: row[1] for row in self.c.execute("SELECT daktela_id, client_id FROM clients").fetchall()},
-            'contacts': {row[0]: row[1] for row in self.c.execute("SELECT daktela_id, contact_id FROM contacts").fetchall()}
-        }
-        
-    def get_or_create(self, table, dak_id, **kwargs):
-        if not dak_id: return None
-        dak_id = str(dak_id)
-        if dak_id in self.cache[table]:
-            return self.cache[table][dak_id]
-        
-        keys = ['daktela_id'] + list(kwargs.keys())
-        vals = [dak_id] + list(kwargs.values())
-        placeholders = ",".join(["?"] * len(keys))
-        cols = ",".join(keys)
-        
-        self.c.execute(f"INSERT INTO {table} ({cols}) VALUES ({placeholders})", vals)
-        new_id = self.c.lastrowid
-        self.cache[table][dak_id] = new_id
-        return new_id
-
-# --- POMOCNÉ FUNKCE ---
-
-def ensure_data_dir():
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-
-def get_db_connection():
-    ensure_data_dir()
-    return sqlite3.connect(DB_FILE)
-
-def clean_daktela_html(html_content):
-    if not html_content or not isinstance(html_content, str): return ""
-    try:
-        soup = BeautifulSoup(html_content, "html.parser")
-        for s in soup(['script', 'style', 'head', 'title', 'meta']): s.decompose()
-        for br in soup.find_all("br"): br.replace_with("\n")
-        return "\n".join(line.strip() for line in soup.get_text(separator="\n").splitlines() if line.strip())
-    except:
-        return str(html_content)
+def get_api():
+    return get_client(INSTANCE_URL, ACCESS_TOKEN)
 
 def format_duration(seconds):
     seconds = int(seconds)
@@ -76,178 +35,19 @@ def format_duration(seconds):
     elif m > 0: return f"{m}m {s}s"
     else: return f"{s}s"
 
-def parse_iso_datetime(iso_string):
-    if not iso_string or iso_string == "null":
-        return None, None
-    try:
-        dt = datetime.strptime(iso_string, "%Y-%m-%d %H:%M:%S")
-        return dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M:%S")
-    except ValueError:
-        return None, None
-
-def get_cf_value(cf_data, key):
-    val = cf_data.get(key)
-    if isinstance(val, list):
-        return str(val[0]) if val else ""
-    return str(val) if val else ""
-
-def find_crm_id(cf_data):
-    priority_keys = ['organization_id', 'shipper_id', 'dealer_id', 'Dealer ID', 'id_dopravce']
-    for key in priority_keys:
-        val = get_cf_value(cf_data, key)
-        if val: return val
-    return ""
+def format_bytes(num):
+    for unit in ["B", "KB", "MB"]:
+        if num < 1024: return f"{num:.0f} {unit}" if unit == "B" else f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.2f} GB"
 
-def extract_email_address(data):
-    if not data: return ""
-    if isinstance(data, list) and len(data) > 0:
-        first = data[0]
-        if isinstance(first, dict): return first.get('address', '')
-        elif isinstance(first, str): return first
-    elif isinstance(data, str): return data
-    return ""
-
-def get_activity_details(act, operator_title):
-    act_type = act.get('type')
-    
-    if not act_type and act.get('description'):
-        act_type = 'COMMENT'
-
-    item = act.get('item') or {}
-    sender = ""
-    recipient = ""
-    direction = str(item.get('direction', '')).upper()
-    
-    if act_type == 'EMAIL':
-        options = item.get('options') or {}
-        headers = options.get('headers') or {}
-        sender = extract_email_address(headers.get('from'))
-        recipient = extract_email_address(headers.get('to'))
-        
-        if not sender and direction == 'OUT': sender = operator_title
-        if not direction:
-            direction = "OUT" if sender == operator_title else "IN"
-
-    elif act_type == 'CALL':
-        if direction == 'IN':
-            sender = item.get('clid', 'Unknown')
-            recipient = item.get('did', 'System')
-        else:
-            sender = operator_title
-            recipient = item.get('clid', '')
-
-    elif act_type == 'COMMENT':
-        sender = (act.get('user') or {}).get('title', 'System')
-        recipient = "Internal"
-        direction = "INTERNAL"
-        
-    else:
-        sender = (act.get('user') or {}).get('title', 'Unknown')
-        recipient = (item.get('queue') or {}).get('title', '')
-        
-    return sender, recipient, direction, act_type
-
-def is_auto_reply(act, raw_desc):
-    item = act.get('item') or {}
-    
-    options = item.get('options') or act.get('options') or {}
-    headers = options.get('headers') or {}
-    
-    headers_lower = {str(k).lower(): str(v).lower() for k, v in headers.items()}
-    if headers_lower.get('auto-submitted') == 'auto-generated':
-        return 1
-    if headers_lower.get('x-auto-response-suppress') == 'all':
-        return 1
-        
-    text_to_check = str(raw_desc).lower()
-    
-    split_markers = [
-        "---------- odpovězená zpráva ----------", 
-        "---------- replied message ----------",
-        "napsal(a):", 
-        "wrote:",
-        "<blockquote"
-    ]
-    
-    for marker in split_markers:
-        if marker in text_to_check:
-            text_to_check = text_to_check.split(marker)[0]
-            
-    auto_phrases = [
-        "potvrzujeme, že vaše zpráva byla úspěšně doručena",
-        "we are confirming that your message has been successfully delivered",
-        "upozornění na napojení dopravců",
-        "automaticky generovaná zpráva",
-        "toto je automatická odpověď"
-    ]
-    
-    for phrase in auto_phrases:
-        if phrase in text_to_check:
-            return 1
-            
-    return 0
-
-# --- DATABÁZE INIT ---
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS categories (category_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS statuses (status_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS queues (queue_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS clients (client_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT, crm_id TEXT, client_type TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS contacts (contact_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT, client_id INTEGER, FOREIGN KEY (client_id) REFERENCES clients(client_id))''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS tickets (
-        ticket_id INTEGER PRIMARY KEY, title TEXT, category_id INTEGER, user_id INTEGER, status_id INTEGER, client_id INTEGER, contact_id INTEGER, 
-        priority TEXT, stage TEXT, created_date TEXT, created_time TEXT, edited_date TEXT, edited_time TEXT, first_answer_date TEXT, first_answer_time TEXT, 
-        last_activity_op_date TEXT, last_activity_op_time TEXT, last_activity_cl_date TEXT, last_activity_cl_time TEXT, reopen_date TEXT, reopen_time TEXT, 
-        activity_count INTEGER, followers TEXT, account_title TEXT, vip INTEGER, dev_task1 TEXT, dev_task2 TEXT, last_synced_date TEXT, last_synced_time TEXT,
-        FOREIGN KEY (category_id) REFERENCES categories(category_id), FOREIGN KEY (user_id) REFERENCES users(user_id), FOREIGN KEY (status_id) REFERENCES statuses(status_id),
-        FOREIGN KEY (client_id) REFERENCES clients(client_id), FOREIGN KEY (contact_id) REFERENCES contacts(contact_id)
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS activities (
-        activity_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, ticket_id INTEGER, created_date TEXT, created_time TEXT, 
-        type TEXT, direction TEXT, sender TEXT, recipient TEXT, queue_id INTEGER, category_id INTEGER, has_attachment INTEGER, 
-        activity_order INTEGER, automatic_reply INTEGER, content TEXT,
-        FOREIGN KEY (ticket_id) REFERENCES tickets(ticket_id), FOREIGN KEY (queue_id) REFERENCES queues(queue_id), FOREIGN KEY (category_id) REFERENCES categories(category_id)
-    )''')
-    
-    # ZMĚNA: Nová spojovací tabulka pro ukládání VŠECH statusů u ticketů
-    c.execute('''CREATE TABLE IF NOT EXISTS ticket_statuses (
-        ticket_id INTEGER, 
-        status_id INTEGER,
-        PRIMARY KEY (ticket_id, status_id),
-        FOREIGN KEY (ticket_id) REFERENCES tickets(ticket_id),
-        FOREIGN KEY (status_id) REFERENCES statuses(status_id)
-    )''')
-    
-    conn.commit()
-    return conn
-
-def get_db_ticket_map():
-    conn = init_db()
-    try:
-        df = pd.read_sql("SELECT ticket_id, edited_date || ' ' || edited_time as edited_at FROM tickets", conn)
-        return dict(zip(df.ticket_id, df.edited_at)) if not df.empty else {}
-    except: return {}
-    finally: conn.close()
-
-def get_last_ticket_date():
-    conn = init_db()
-    try:
-        res = pd.read_sql("SELECT MAX(edited_date) as last_edit FROM tickets", conn)
-        if not res.empty and res.iloc[0]['last_edit']:
-            return pd.to_datetime(res.iloc[0]['last_edit']).date()
-    except: pass
-    finally: conn.close()
-    return None
+def transfer_summary(snap):
+    """Kolik dat stáhla úloha (rozdíl počítadel sdíleného klienta)."""
+    return f"📦 Staženo **{format_bytes(snap['wire_bytes'])}** (rozbaleno {format_bytes(snap['json_bytes'])}, {snap['requests']} požadavků)"
 
 def get_table_stats():
-    conn = get_db_connection()
+    conn = get_read_connection()
+    if conn is None: return pd.DataFrame()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = [row[0] for row in cursor.fetchall()]
@@ -258,7 +58,6 @@ def get_table_stats():
             count = cursor.fetchone()[0]
             stats.append({"Table": t, "Rows": count})
         except: pass
-    conn.close()
     return pd.DataFrame(stats)
 
 # --- CALLBACKY ---
@@ -273,6 +72,56 @@ def cb_incremental():
     else:
         st.toast("Databáze je prázdná, nelze navázat. Vyberte datum ručně.", icon="⚠️")
 
+# --- PRŮBĚH ÚLOHY NA POZADÍ ---
+PHASE_LABELS = {"queued": "Čekám na spuštění", "listing": "Krok 1/3: Stahuji seznam ticketů z API",
+                "compare": "Krok 2/3: Porovnávám data s lokální databází", "processing": "Krok 3/3: Stahuji a ukládám detailní data",
+                "snapshot": "Dokončuji: ukládám snapshot pro statistiky", "snapshot_error": "Snapshot pro statistiky se nepodařilo uložit"}
+
+def render_sync_job_status():
+    """Stav poslední synchronizace (při běhu se obnovuje každou sekundu jako fragment)."""
+    job = get_active_job() or get_last_job()
+    if not job: return
+    snap = job.snapshot()
+    prog = snap["progress"]
+
+    if snap["state"] in ACTIVE_STATES:
+        st.session_state.db_job_seen_active = snap["job_id"]
+        with st.container(border=True):
+            st.info(f"⏳ **{PHASE_LABELS.get(snap['phase'], snap['phase'])}** · úloha #{snap['job_id']} spuštěna {snap['created_at']}"
+                    + (" · 🛑 ruším..." if snap["state"] == "cancelling" else ""))
+            if snap["phase"] == "listing":
+                days = prog.get("days")
+                st.markdown(f"Načteno **{prog.get('listed', 0)}**" + (f" / {prog['total']}" if prog.get("total") else "") + " záznamů"
+                            + (f" | 📅 den **{days[0]} / {days[1]}**" if days else ""))
+            elif snap["phase"] == "processing" and prog.get("total"):
+                done, total = prog.get("processed", 0), prog["total"]
+                rate = snap["tickets_per_sec"]
+                eta = format_duration((total - done) / rate) if rate > 0 else "?"
+                st.progress(min(done / total, 1.0))
+                st.markdown(f"**Ticket:** `{prog.get('ticket_id', '-')}` | Zpracováno: **{done} / {total}** | ⚡ {rate:.1f} ticketů/s | ⏱️ ETA: **{eta}**")
+            st.caption(transfer_summary(snap))
+            if st.button("🛑 ZASTAVIT PROCES", key="db_cancel_job", type="secondary", use_container_width=True, disabled=snap["state"] == "cancelling"):
+                job.cancel()
+        return
+
+    # Úloha právě doběhla -> jednorázově obnovíme celou stránku (tlačítka, nabídka navázání)
+    if st.session_state.get("db_job_seen_active") == snap["job_id"]:
+        st.session_state.db_job_seen_active = None
+        st.rerun(scope="app")
+
+    res = snap["result"] or {}
+    if snap["state"] == "done":
+        if res.get("tickets"):
+            st.success(f"🎉 **Proces úspěšně dokončen!**\n\nStahování a synchronizace {res['tickets']} ticketů proběhla v pořádku "
+                       f"(aktivity přírůstkově u {res['delta']}, celé u {res['tickets'] - res['delta']}) za {format_duration(snap['elapsed'])}.\n\n{transfer_summary(snap)}")
+        else:
+            st.success("✅ **Vše je aktuální.** Žádné nové tickety ke stažení.")
+    elif snap["state"] == "cancelled":
+        st.error("🛑 Zastaveno uživatelem. Část dat byla uložena, synchronizaci lze navázat.")
+    elif snap["state"] == "failed":
+        st.error(f"❌ Chyba synchronizace: {(snap['error'] or '').splitlines()[0] if snap['error'] else ''}")
+        with st.expander("Detail chyby"): st.code(snap["error"] or "")
+
 # --- RENDER ---
 def render_db_update():
     st.markdown("""<style>.block-container { max_width: 95% !important; padding-top: 2rem; padding-bottom: 2rem; } div.stButton > button { white-space: nowrap; }</style>""", unsafe_allow_html=True)
@@ -292,249 +141,63 @@ def render_db_update():
         if 'db_date_from' not in st.session_state: st.session_state.db_date_from = date.today()
         if 'db_date_to' not in st.session_state: st.session_state.db_date_to = date.today()
         
-        if 'categories' not in st.session_state:
-            try:
-                res = requests.get(f"{INSTANCE_URL}/api/v6/ticketsCategories.json", headers={'x-auth-token': ACCESS_TOKEN})
-                st.session_state['categories'] = sorted(res.json().get('result', {}).get('data', []), key=lambda x: x.get('title', '').lower())
-            except: pass
-        cat_map = {c['title']: c['name'] for c in st.session_state.get('categories', [])}
+        cat_map = codebook_map(get_api(), "categories")
 
         c1, c2 = st.columns(2)
         d_from = c1.date_input("Datum od (edited)", key="db_date_from")
         d_to = c2.date_input("Datum do (edited)", key="db_date_to")
-        selected_cat_titles = st.multiselect("Kategorie (nevybráno = VŠE)", options=list(cat_map.keys()), key="db_cat_select")
+        c_cat, c_refresh = st.columns([4, 1])
+        selected_cat_titles = c_cat.multiselect("Kategorie (nevybráno = VŠE)", options=list(cat_map.keys()), key="db_cat_select")
+        c_refresh.write("")
+        if c_refresh.button("🔄 Obnovit číselníky", use_container_width=True, key="db_refresh_codebooks"):
+            refresh_codebooks(); st.rerun()
         
+        with st.expander("⚙️ Pokročilé nastavení stahování"):
+            c_w, c_r = st.columns(2)
+            max_workers = c_w.number_input("Souběžná stahování (vlákna)", min_value=1, max_value=32, value=SYNC_MAX_WORKERS, key="db_max_workers")
+            max_rps = c_r.number_input("Max. požadavků za sekundu", min_value=1, max_value=100, value=SYNC_MAX_RPS, key="db_max_rps")
+            parallel_pages = st.checkbox("⚡ Stahovat stránky / časová okna seznamu ticketů souběžně", value=True, key="db_parallel_pages")
+            bulk_activities = st.checkbox(f"📦 Stahovat aktivity hromadně ({SYNC_BULK_TICKETS} ticketů na dotaz)", value=SYNC_BULK_TICKETS > 1, key="db_bulk_activities")
+
         st.write("")
-        
-        btn_placeholder = st.empty()
-        stop_placeholder = st.empty()
-        ui_status = st.empty()
-        prog_text = st.empty()
-        prog_bar = st.empty()
 
-        if btn_placeholder.button("🚀 Spustit synchronizaci", type="primary", use_container_width=True):
+        # ZMĚNA: Synchronizace běží na pozadí (utils.sync_jobs); stránka ji jen spouští, sleduje a ruší.
+        # Všichni uživatelé vidí tutéž běžící úlohu, druhá se souběžně nespustí.
+        active_job = get_active_job()
+
+        # Nabídka navázání na nedokončenou synchronizaci (kurzor v tabulce sync_runs)
+        resumable = get_resumable_run() if not active_job else None
+        resume_clicked = False
+        if resumable:
+            with st.container(border=True):
+                st.warning(f"⏸️ **Nedokončená synchronizace** ze dne {resumable['started_at']} "
+                           f"(období {resumable['date_from']} – {resumable['date_to']}): uloženo **{resumable['processed_count']} / {resumable['total_tickets']}** ticketů"
+                           + (f", poslední `{resumable['last_ticket_id']}`." if resumable['last_ticket_id'] else "."))
+                c_res, c_disc = st.columns(2)
+                resume_clicked = c_res.button("▶️ Pokračovat od místa přerušení", type="primary", use_container_width=True, key="db_resume_run")
+                if c_disc.button("🗑️ Zahodit rozpracovaný běh", use_container_width=True, key="db_discard_run"):
+                    finish_sync_run(resumable['run_id'], "discarded"); st.rerun()
+
+        # Režim "od posledního běhu" – jen tickety s 'edited' od uložené značky (bez ohledu na datum a kategorie)
+        watermark = get_watermark()
+        c_start, c_since = st.columns(2)
+        start_clicked = c_start.button("🚀 Spustit synchronizaci", type="primary", use_container_width=True, disabled=bool(active_job))
+        since_clicked = c_since.button(f"⏩ Synchronizovat od posledního běhu ({watermark['edited']})" if watermark else "⏩ Synchronizovat od posledního běhu",
+                                       disabled=not watermark or bool(active_job), use_container_width=True, key="db_since_last")
+
+        if start_clicked or resume_clicked or since_clicked:
             if not ACCESS_TOKEN: st.error("Chybí token!"); st.stop()
-            
-            btn_placeholder.empty()
-            ui_status.info("⏳ **Krok 1/3:** Zjišťuji počet záznamů přes API...")
-            
-            session = requests.Session()
-            session.headers.update({"X-AUTH-TOKEN": ACCESS_TOKEN})
-            
-            api_tickets = []
-            skip = 0
-            take = 1000 
-            
-            base_params = {
-                "filter[logic]": "and",
-                "filter[filters][0][field]": "edited", "filter[filters][0][operator]": "gte", "filter[filters][0][value]": f"{d_from} 00:00:00",
-                "filter[filters][1][field]": "edited", "filter[filters][1][operator]": "lte", "filter[filters][1][value]": f"{d_to} 23:59:59",
-                "fields[0]": "name", "fields[1]": "title", "fields[2]": "created", "fields[3]": "edited", 
-                "fields[4]": "category", "fields[5]": "user", "fields[6]": "statuses", "fields[7]": "customFields",
-                "fields[8]": "priority", "fields[9]": "stage", "fields[10]": "first_answer", 
-                "fields[11]": "last_activity_operator", "fields[12]": "last_activity_client",
-                "fields[13]": "contact", "fields[14]": "followers", "fields[15]": "reopen",
-                "take": take
-            }
-
-            if selected_cat_titles:
-                selected_ids = [cat_map[t] for t in selected_cat_titles]
-                base_params["filter[filters][2][field]"] = "category"
-                base_params["filter[filters][2][operator]"] = "in"
-                for idx, val in enumerate(selected_ids):
-                    base_params[f"filter[filters][2][value][{idx}]"] = val
-
-            try:
-                while True:
-                    if stop_placeholder.button("🛑 ZASTAVIT PROCES", key=f"stop_api_{skip}", type="secondary", use_container_width=True):
-                        ui_status.error("🛑 Zastaveno uživatelem."); st.stop()
-
-                    # ZMĚNA: Předání proměnné 'skip' do parametrů volání. 
-                    # Tím API ví, že má při dalším průchodu poslat dalších 1000 záznamů a nezacyklí se.
-                    base_params["skip"] = skip
-
-                    res = session.get(f"{INSTANCE_URL}/api/v6/tickets.json", params=base_params)
-                    if res.status_code != 200:
-                        ui_status.error(f"❌ Chyba API: {res.text}"); st.stop()
-                    
-                    batch = res.json().get("result", {}).get("data", [])
-                    if not batch: break
-                    api_tickets.extend(batch)
-                    if len(batch) < take: break
-                    skip += take
-            except Exception as e: 
-                ui_status.error(f"❌ Chyba: {e}"); st.stop()
-
-            ui_status.info(f"✅ **Krok 1/3:** Nalezeno {len(api_tickets)} záznamů v API.\n\n⏳ **Krok 2/3:** Porovnávám data s lokální databází...")
-            
-            db_map = get_db_ticket_map()
-            to_process = [t for t in api_tickets if t['name'] not in db_map or str(t['edited']) > str(db_map[t['name']])]
-
-            if not to_process:
-                stop_placeholder.empty()
-                ui_status.success("✅ **Vše je aktuální.** Žádné nové tickety ke stažení.")
-                st.stop()
-            
-            ui_status.info(f"✅ **Krok 2/3:** Identifikováno **{len(to_process)}** nových/změněných ticketů.\n\n⏳ **Krok 3/3:** Stahuji a ukládám detailní data...")
-            pb = prog_bar.progress(0)
-            
-            conn = init_db()
-            db = DBLookup(conn)
-            start = time.time()
-            total_tickets = len(to_process)
-
-            for i, t in enumerate(to_process, start=1):
-                if stop_placeholder.button("🛑 ZASTAVIT PROCES", key=f"stop_row_{i}", type="secondary", use_container_width=True):
-                    conn.commit(); conn.close()
-                    ui_status.error("🛑 Zastaveno uživatelem. Část dat byla uložena."); st.stop()
-
-                t_id = t['name']
-                
-                elapsed = time.time() - start
-                avg_time = elapsed / i
-                rem_time = int((total_tickets - i) * avg_time)
-                eta_str = format_duration(rem_time)
-                
-                prog_text.markdown(f"**Ticket:** `{t_id}` | Zpracováno: **{i} / {total_tickets}** | ⏱️ ETA: **{eta_str}**")
-                pb.progress(i / total_tickets)
-                
-                cat_dict = t.get('category') or {}
-                db_category_id = db.get_or_create('categories', cat_dict.get('name'), title=cat_dict.get('title'))
-                
-                user_dict = t.get('user') or {}
-                db_user_id = db.get_or_create('users', user_dict.get('name'), title=user_dict.get('title'))
-                
-                # ZMĚNA: Ukládání všech statusů ticketu do vazební tabulky
-                db_status_id = None
-                status_list = t.get('statuses') or []
-                
-                if len(status_list) > 0:
-                    s = status_list[0]
-                    db_status_id = db.get_or_create('statuses', s.get('name'), title=s.get('title'))
-
-                # Vymazání starých statusů pro tento ticket (pokud jde o update)
-                db.c.execute("DELETE FROM ticket_statuses WHERE ticket_id = ?", (t_id,))
-                # Zápis všech aktuálních statusů do nové tabulky
-                for s in status_list:
-                    s_id = db.get_or_create('statuses', s.get('name'), title=s.get('title'))
-                    db.c.execute("INSERT OR IGNORE INTO ticket_statuses (ticket_id, status_id) VALUES (?, ?)", (t_id, s_id))
-
-                # --- AKTIVITY ---
-                real_activity_count = 0
-                all_activities = []
-                act_skip = 0
-                act_take = 100
-                
-                try:
-                    while True:
-                        act_res = session.get(f"{INSTANCE_URL}/api/v6/tickets/{t_id}/activities.json?skip={act_skip}&take={act_take}")
-                        if act_res.status_code == 200:
-                            acts = act_res.json().get("result", {}).get("data", [])
-                            if not acts: break
-                            all_activities.extend(acts)
-                            if len(acts) < act_take: break
-                            act_skip += act_take
-                        else: break
-                except: pass
-
-                if all_activities:
-                    all_activities.sort(key=lambda x: x.get('time', ''))
-                    real_activity_count = len(all_activities)
-                    db.c.execute("DELETE FROM activities WHERE ticket_id = ?", (t_id,))
-                    
-                    for idx, act in enumerate(all_activities, start=1):
-                        dak_act_id = act['name']
-                        a_date, a_time = parse_iso_datetime(act.get('time'))
-                        
-                        item = act.get('item') or {}
-                        
-                        raw_desc = act.get('text') or act.get('description') or item.get('text') or item.get('description') or (item.get('mail') or {}).get('body') or ""
-                        
-                        queue_dict = item.get('queue') or {}
-                        db_queue_id = db.get_or_create('queues', queue_dict.get('name'), title=queue_dict.get('title'))
-                        
-                        op_title = (act.get('user') or {}).get('title', 'System')
-                        sender, recipient, direction, act_type_final = get_activity_details(act, op_title)
-                        
-                        has_att = 1 if len(item.get('attachments') or []) > 0 else 0
-                        auto_flag = is_auto_reply(act, raw_desc)
-                        
-                        db.c.execute('''INSERT OR REPLACE INTO activities 
-                                       (daktela_id, ticket_id, created_date, created_time, 
-                                        type, direction, sender, recipient, 
-                                        queue_id, category_id, has_attachment, activity_order, automatic_reply, content) 
-                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                                       (dak_act_id, t_id, a_date, a_time, 
-                                        act_type_final, direction, sender, recipient,
-                                        db_queue_id, db_category_id, has_att, idx, auto_flag, clean_daktela_html(raw_desc)))
-
-                # --- PARSING TICKETU ---
-                c_date, c_time = parse_iso_datetime(t.get('created'))
-                e_date, e_time = parse_iso_datetime(t.get('edited'))
-                fa_date, fa_time = parse_iso_datetime(t.get('first_answer'))
-                lao_date, lao_time = parse_iso_datetime(t.get('last_activity_operator'))
-                lac_date, lac_time = parse_iso_datetime(t.get('last_activity_client'))
-                reopen_date, reopen_time = parse_iso_datetime(t.get('reopen'))
-                
-                db_client_id = None
-                db_contact_id = None
-                contact_data = t.get('contact') or {}
-                if contact_data:
-                    client_type = (contact_data.get('database') or {}).get('title', '')
-                    acc_data = contact_data.get('account') or {}
-                    if acc_data:
-                        dak_acc_id = acc_data.get('name')
-                        acc_title = acc_data.get('title')
-                        crm_id = find_crm_id(acc_data.get('customFields') or {})
-                        db_client_id = db.get_or_create('clients', dak_acc_id, title=acc_title, crm_id=crm_id, client_type=client_type)
-
-                    dak_cont_id = contact_data.get('name')
-                    cont_title = contact_data.get('title')
-                    db_contact_id = db.get_or_create('contacts', dak_cont_id, title=cont_title, client_id=db_client_id)
-
-                followers_str = ""
-                raw_followers = t.get('followers')
-                if isinstance(raw_followers, list):
-                    followers_str = ",".join([f.get('name') for f in raw_followers if isinstance(f, dict) and f.get('name')])
-                
-                account_title_flat = ""
-                if contact_data and isinstance(contact_data.get('account'), dict):
-                     account_title_flat = contact_data['account'].get('title', '')
-
-                cf_raw = t.get('customFields')
-                cf = cf_raw if isinstance(cf_raw, dict) else {}
-                
-                vip_val = cf.get('vip')
-                is_vip = 1 if vip_val and isinstance(vip_val, list) and len(vip_val) > 0 else 0
-                dev_task1 = get_cf_value(cf, 'note')
-                dev_task2 = get_cf_value(cf, 'dev_task_2')
-
-                now = datetime.now()
-                s_date, s_time = now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")
-
-                db.c.execute('''INSERT OR REPLACE INTO tickets 
-                               (ticket_id, title, category_id, user_id, status_id, client_id, contact_id,
-                                priority, stage, created_date, created_time, edited_date, edited_time, 
-                                first_answer_date, first_answer_time, last_activity_op_date, last_activity_op_time,
-                                last_activity_cl_date, last_activity_cl_time, reopen_date, reopen_time,
-                                activity_count, followers, account_title, vip, dev_task1, dev_task2, last_synced_date, last_synced_time) 
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                               (t_id, t.get('title'), db_category_id, db_user_id, db_status_id, db_client_id, db_contact_id,
-                                t.get('priority'), t.get('stage'), c_date, c_time, e_date, e_time,
-                                fa_date, fa_time, lao_date, lao_time, lac_date, lac_time, reopen_date, reopen_time,
-                                real_activity_count, followers_str, account_title_flat, is_vip, dev_task1, dev_task2, s_date, s_time))
-                
-                if i % 50 == 0:
-                    conn.commit()
-
-            conn.commit()
-            conn.close()
-            session.close()
-            
-            stop_placeholder.empty()
-            prog_text.empty()
-            prog_bar.empty()
-            ui_status.success(f"🎉 **Proces úspěšně dokončen!**\n\nStahování a synchronizace {total_tickets} ticketů proběhla v pořádku.")
+            params = {"max_workers": int(max_workers), "max_rps": max_rps, "page_workers": API_PAGE_WORKERS if parallel_pages else 1,
+                      "bulk_size": SYNC_BULK_TICKETS if bulk_activities else 0}
+            if resume_clicked: params.update(mode="resume", resume_run_id=resumable['run_id'])
+            elif since_clicked: params.update(mode="since")
+            else: params.update(mode="range", d_from=d_from, d_to=d_to,
+                                category_ids=[cat_map[t] for t in selected_cat_titles], category_titles=list(selected_cat_titles))
+            job, created = start_sync_job(get_api(), **params)
+            if not created: st.toast("Synchronizace už běží – zobrazuji její průběh.", icon="ℹ️")
+            st.rerun()
+
+        st.fragment(render_sync_job_status, run_every=1.0 if active_job else None)()
 
     # --- TAB 2: IMPORT EXCELU ---
     with tab2:
@@ -549,9 +212,8 @@ def render_db_update():
                     if uploaded_file.name.endswith('.csv'): df = pd.read_csv(uploaded_file)
                     else: df = pd.read_excel(uploaded_file)
                     df.columns = [str(c).strip().replace(" ", "_").lower() for c in df.columns]
-                    conn = get_db_connection()
-                    df.to_sql(table_name, conn, if_exists='replace', index=False)
-                    conn.close()
+                    with writer(timeout=DB_WRITE_LOCK_TIMEOUT) as conn:
+                        df.to_sql(table_name, conn, if_exists='replace', index=False)
                     st.success(f"✅ Tabulka '{table_name}' vytvořena ({len(df)} řádků).")
                     time.sleep(1); st.rerun()
                 except Exception as e: st.error(f"Chyba při importu: {e}")
@@ -564,13 +226,34 @@ def render_db_update():
         if not stats_df.empty:
             st.markdown("#### 📊 Přehled tabulek")
             st.dataframe(stats_df, use_container_width=True, hide_index=True)
+            st.caption(f"Verze schématu: {get_schema_version(get_read_connection())} / {LATEST_VERSION} (migrace proběhnou při startu aplikace)")
+            if fulltext.is_available(get_read_connection()) and st.button("🔁 Přestavět fulltextový index aktivit", help="Po ručním mazání nebo úpravách aktivit (SQL, mazání záznamů, zásahy mimo aplikaci); synchronizace index udržuje sama."):
+                try:
+                    fulltext.rebuild_index(timeout=DB_WRITE_LOCK_TIMEOUT)
+                    st.toast("Fulltextový index přestavěn.")
+                except Exception as e: st.error(f"Chyba: {e}")
+            if st.button("🔁 Přepočítat souhrny pro statistiky", help="Jen po ručním mazání/úpravách ticketů; synchronizace souhrny udržuje sama."):
+                try:
+                    with writer(timeout=DB_WRITE_LOCK_TIMEOUT) as wconn: rebuild_rollups(wconn)
+                    st.toast("Souhrny přepočítány.")
+                except Exception as e: st.error(f"Chyba: {e}")
+            if snapshots.is_available() and st.button("🔁 Přestavět snapshot pro statistiky", help="Sloupcová kopie ticketů a aktivit pro rychlé načítání; synchronizace ji přestaví sama."):
+                try:
+                    rows = snapshots.build_snapshots()
+                    st.toast("Snapshot uložen: " + ", ".join(f"{k} {v}" for k, v in rows.items()))
+                except Exception as e: st.error(f"Chyba: {e}")
+            if "content_blocks" in stats_df["Table"].values and st.button("🧹 Uklidit nepoužívané bloky obsahu aktivit", help="Citovaná historie, na kterou po přepsání nebo smazání aktivit už nic neodkazuje."):
+                try:
+                    with writer(timeout=DB_WRITE_LOCK_TIMEOUT) as wconn: removed = prune_blocks(wconn)
+                    st.toast(f"Smazáno {removed} bloků. Místo v souboru uvolní až VACUUM.")
+                except Exception as e: st.error(f"Chyba: {e}")
             st.divider()
 
             st.markdown("#### ⚙️ Operace s tabulkou")
             target_table = st.selectbox("Vyberte tabulku k úpravám:", stats_df["Table"].tolist())
             
             if target_table:
-                conn = get_db_connection()
+                conn = get_read_connection()
                 schema_df = pd.read_sql(f"PRAGMA table_info({target_table})", conn)
                 cols = schema_df['name'].tolist()
                 
@@ -579,7 +262,9 @@ def render_db_update():
                 with sub_tab1:
                     st.markdown(f"**Náhled dat v tabulce `{target_table}` (max 1000 řádků):**")
                     try:
-                        df_preview = pd.read_sql(f"SELECT * FROM {target_table} LIMIT 1000", conn)
+                        # ZMĚNA: Aktivity s rozbaleným obsahem (content_z -> content, pohled activities_text)
+                        source = "activities_text" if target_table == "activities" and "content_z" in cols else target_table
+                        df_preview = pd.read_sql(f"SELECT * FROM {source} LIMIT 1000", conn)
                         st.dataframe(df_preview, use_container_width=True)
                         csv = df_preview.to_csv(index=False).encode('utf-8')
                         st.download_button(
@@ -601,10 +286,8 @@ def render_db_update():
                     if st.button("🗑️ Smazat odpovídající záznamy", type="primary"):
                         if del_val:
                             try:
-                                cur = conn.cursor()
-                                cur.execute(f"DELETE FROM {target_table} WHERE {del_col} = ?", (del_val,))
-                                rows_deleted = cur.rowcount
-                                conn.commit()
+                                with writer(timeout=DB_WRITE_LOCK_TIMEOUT) as wconn:
+                                    rows_deleted = wconn.execute(f"DELETE FROM {target_table} WHERE {del_col} = ?", (del_val,)).rowcount
                                 st.success(f"✅ Úspěšně smazáno {rows_deleted} záznamů.")
                                 time.sleep(1)
                                 st.rerun()
@@ -624,9 +307,10 @@ def render_db_update():
                                 st.dataframe(sql_df, use_container_width=True)
                                 st.success(f"Nalezeno {len(sql_df)} řádků.")
                             else:
-                                cur = conn.cursor()
-                                cur.execute(sql_query)
-                                conn.commit()
+                                with writer(timeout=DB_WRITE_LOCK_TIMEOUT) as wconn:
+                                    cur = wconn.execute(sql_query)
+                                # ZMĚNA: Ruční úpravu dat podpis snapshotu nemusí poznat
+                                snapshots.invalidate()
                                 st.success(f"✅ Dotaz úspěšně proveden. Ovlivněno řádků: {cur.rowcount}")
                                 time.sleep(1)
                                 st.rerun()
@@ -637,20 +321,17 @@ def render_db_update():
                     st.markdown("**Hromadné akce s tabulkou**")
                     danger_action = st.radio("Vyberte akci:", ["Vymazat všechna data (TRUNCATE)", "Smazat celou tabulku (DROP)"])
                     if st.button("⚠️ Provést nebezpečnou akci", type="primary"):
-                        cur = conn.cursor()
                         try:
-                            if "DROP" in danger_action:
-                                cur.execute(f"DROP TABLE IF EXISTS {target_table}")
-                                st.toast(f"Tabulka {target_table} byla smazána.")
-                            else:
-                                cur.execute(f"DELETE FROM {target_table}")
-                                st.toast(f"Data z tabulky {target_table} byla vymazána.")
-                            conn.commit()
+                            with writer(timeout=DB_WRITE_LOCK_TIMEOUT) as wconn:
+                                if "DROP" in danger_action:
+                                    wconn.execute(f"DROP TABLE IF EXISTS {target_table}")
+                                    st.toast(f"Tabulka {target_table} byla smazána.")
+                                else:
+                                    wconn.execute(f"DELETE FROM {target_table}")
+                                    st.toast(f"Data z tabulky {target_table} byla vymazána.")
                             time.sleep(1)
                             st.rerun()
                         except Exception as e:
                             st.error(f"Chyba: {e}")
-                            
-                conn.close()
         else:
             st.info("Databáze je prázdná.")
\ No newline at end of file
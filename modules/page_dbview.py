@@ -1,26 +1,32 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import os
 import io
 from datetime import datetime, time
 
 # Cesta k databázi
-DB_PATH = os.path.join('data', 'daktela_data.db')
+# ZMĚNA: Cesta a spojení z utils.storage (čtení nečeká na běžící synchronizaci)
+from utils.storage import DB_FILE as DB_PATH, get_read_connection
+from utils import fulltext, snapshots
+
+# Odkaz na ticket v Daktele (výsledky fulltextu)
+try:
+    DAKTELA_URL = st.secrets["DAKTELA_URL"]
+except:
+    DAKTELA_URL = ""
 
 def get_db_connection():
-    if not os.path.exists(DB_PATH):
-        return None
-    return sqlite3.connect(DB_PATH)
+    # Sdílené čtecí spojení vlákna, nezavírá se
+    return get_read_connection()
 
 def list_tables():
     conn = get_db_connection()
     if conn is None:
         return []
     cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    # ZMĚNA: Bez interních tabulek fulltextu, statistik plánovače a úložiště obsahu aktivit (content_blocks, content_dicts)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'activities_fts%' AND name NOT LIKE 'sqlite_stat%' AND name NOT LIKE 'content_%';")
     tables = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return tables
 
 def get_lookup_dict(conn, table_name, id_col='id', val_col='title'):
@@ -84,6 +90,26 @@ def enrich_data_with_names(conn, df, table_name):
 
     return df_enriched
 
+# Názvy sloupců po obohacení (enrich_data_with_names) u tabulek ze snapshotu
+ENRICHED_NAMES = {
+    "tickets": {"status_id": "status", "category_id": "category", "user_id": "user", "client_id": "client", "contact_id": "contact"},
+    "activities": {"queue_id": "queue", "category_id": "category"},
+}
+
+def load_enriched_columns(conn, table_name, source_columns, selected_columns):
+    """
+    Vybrané sloupce tabulky ze snapshotu, ID nahrazená názvy (stejný výsledek jako enrich_data_with_names).
+    """
+    names = ENRICHED_NAMES[table_name]
+    wanted = [c for c in source_columns if names.get(c, c) in selected_columns]
+    titles = snapshots.TITLE_COLUMNS[table_name]
+    df = snapshots.load_table(table_name, conn, columns=wanted + [titles[c] for c in wanted if c in titles])
+    for col in wanted:
+        if col not in titles: continue
+        df[col] = df[titles[col]].where(df[titles[col]].notna(), df[col])
+        df = df.drop(columns=[titles[col]]).rename(columns={col: names[col]})
+    return df
+
 def process_data_to_strings(df):
     """
     Převede DataFrame na čisté stringy pro Excel.
@@ -96,7 +122,7 @@ def process_data_to_strings(df):
         
         looks_like_time = any(x in col_lower for x in ['time', 'cas', 'duration', 'start', 'end'])
         looks_like_date = any(x in col_lower for x in ['date', 'day', 'datum'])
-        looks_like_system = any(x in col_lower for x in ['created', 'updated', 'edited', 'deleted', 'timestamp'])
+        looks_like_system = any(x in col_lower for x in ['created', 'updated', 'edited', 'deleted', 'timestamp']) or col_lower.endswith('_at')
         
         if not (looks_like_time or looks_like_date or looks_like_system or 'phone' in col_lower or 'cislo' in col_lower):
              continue
@@ -128,6 +154,42 @@ def process_data_to_strings(df):
 
     return df_export, text_columns
 
+def render_fulltext_search(conn):
+    """ZMĚNA: Vyhledávání v textu aktivit (FTS5) s filtrem data, kategorie a směru."""
+    if not fulltext.is_available(conn):
+        st.info("Fulltextový index zatím neexistuje – vytvoří se při příští synchronizaci (Aktualizace DB).")
+        return
+
+    q_col, opt_col = st.columns([4, 1])
+    query = q_col.text_input("Hledaný text:", key="fts_query", placeholder='např. "chyba přepravce" doprav*')
+    raw = opt_col.checkbox("Syntaxe FTS5", key="fts_raw", help="Povolí OR, NOT, NEAR(…) a závorky. Bez zaškrtnutí musí text obsahovat všechna slova.")
+
+    f1, f2, f3, f4 = st.columns([1, 1, 2, 2])
+    d_from = f1.date_input("Od:", value=None, key="fts_from", format="DD.MM.YYYY")
+    d_to = f2.date_input("Do:", value=None, key="fts_to", format="DD.MM.YYYY")
+    categories = get_lookup_dict(conn, 'categories', 'category_id', 'title')
+    sel_cats = f3.multiselect("Kategorie:", sorted(categories, key=lambda k: str(categories[k])), format_func=lambda k: categories.get(k) or str(k), key="fts_cats")
+    sel_dirs = f4.multiselect("Směr:", ["IN", "OUT", "INTERNAL"], key="fts_dirs")
+
+    if not query.strip():
+        st.caption("Zadejte hledaný text. Diakritika a velikost písmen se ignorují.")
+        return
+    try:
+        df = fulltext.search_activities(conn, query, d_from, d_to, sel_cats, sel_dirs, raw=raw)
+    except Exception as e:
+        st.error(f"Neplatný dotaz: {e}")
+        return
+    if df.empty:
+        st.warning("Nic nenalezeno.")
+        return
+
+    st.caption(f"Nalezeno {len(df)} aktivit (nejrelevantnější nahoře, max. 200) v {df['ticket_id'].nunique()} ticketech.")
+    column_config = {"snippet": st.column_config.TextColumn("Úryvek", width="large"), "score": st.column_config.NumberColumn("Relevance")}
+    if DAKTELA_URL:
+        df.insert(0, "odkaz", DAKTELA_URL.rstrip("/") + "/tickets/update/" + df["ticket_id"].astype(str))
+        column_config["odkaz"] = st.column_config.LinkColumn("Ticket", display_text=r".*/(\d+)$")
+    st.dataframe(df, use_container_width=True, hide_index=True, height=500, column_config=column_config)
+
 def render_db_view():
     # --- CSS PRO ROZŠÍŘENÍ STRÁNKY (WIDE MODE) ---
     # Pouze roztáhne kontejner, nemění styl tlačítek
@@ -162,6 +224,11 @@ def render_db_view():
         st.warning("⚠️ Databáze existuje, ale neobsahuje žádné tabulky.")
         return
 
+    mode = st.radio("Režim:", ["📋 Tabulky", "🔍 Hledat v textu aktivit"], horizontal=True, label_visibility="collapsed", key="dbview_mode")
+    if mode != "📋 Tabulky":
+        render_fulltext_search(get_db_connection())
+        return
+
     # --- VYCENTROVANÝ VÝBĚR TABULKY ---
     c1, c2, c3 = st.columns([1, 2, 1])
     with c2:
@@ -169,19 +236,23 @@ def render_db_view():
 
     if selected_table:
         conn = get_db_connection()
+        # ZMĚNA: Tickety a aktivity ze sloupcového snapshotu – nejdřív jen názvy sloupců, data až pro vybrané sloupce
+        from_snapshot = selected_table in snapshots.SNAPSHOT_QUERIES
         try:
-            # 1. Načtení RAW dat
-            df_raw = pd.read_sql_query(f"SELECT * FROM {selected_table}", conn)
-            # 2. Obohacení
-            df_enriched = enrich_data_with_names(conn, df_raw, selected_table)
+            if from_snapshot:
+                source_columns = [c for c in snapshots.table_columns(selected_table, conn) if not c.startswith("_")]
+                all_columns = [ENRICHED_NAMES[selected_table].get(c, c) for c in source_columns]
+            else:
+                # 1. Načtení RAW dat
+                df_raw = pd.read_sql_query(f"SELECT * FROM {selected_table}", conn)
+                # 2. Obohacení
+                df_enriched = enrich_data_with_names(conn, df_raw, selected_table)
+                all_columns = df_enriched.columns.tolist()
         except Exception as e:
             st.error(f"Chyba při čtení tabulky: {e}")
-            conn.close()
             return
-        conn.close()
 
         # 3. Výběr sloupců
-        all_columns = df_enriched.columns.tolist()
 
         # Expander pro nastavení
         with st.expander(f"🛠️ Filtrovat sloupce pro tabulku '{selected_table}'"):
@@ -205,6 +276,12 @@ def render_db_view():
             st.warning("⚠️ Vyberte alespoň jeden sloupec.")
             return
 
+        if from_snapshot:
+            try: df_enriched = load_enriched_columns(conn, selected_table, source_columns, selected_columns)
+            except Exception as e:
+                st.error(f"Chyba při čtení tabulky: {e}")
+                return
+
         final_cols_ordered = [c for c in all_columns if c in selected_columns]
         df_final = df_enriched[final_cols_ordered]
 
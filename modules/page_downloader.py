@@ -1,9 +1,11 @@
 import streamlit as st
-import requests
 import pandas as pd
 from datetime import timedelta, date
 import time
 import io
+from config import API_PAGE_WORKERS, API_SHARD_MIN_DAYS
+from utils.codebooks import codebook_map, refresh_codebooks
+from utils.daktela_client import get_client, build_query, date_range_filters, ids_filter
 
 # --- KONFIGURACE ---
 try:
@@ -13,40 +15,20 @@ except:
     INSTANCE_URL = "" 
     ACCESS_TOKEN = ""
 
-def get_headers():
-    return {"X-AUTH-TOKEN": ACCESS_TOKEN, "Content-Type": "application/json"}
+def get_api():
+    return get_client(INSTANCE_URL, ACCESS_TOKEN)
 
 # --- POMOCNÉ FUNKCE PRO NAČÍTÁNÍ ČÍSELNÍKŮ ---
+# ZMĚNA: Číselníky jsou ve sdílené cache pro všechny stránky a session (utils/codebooks.py)
 
 def fetch_categories():
-    if 'categories_cache' not in st.session_state:
-        try:
-            resp = requests.get(f"{INSTANCE_URL}/api/v6/ticketsCategories.json", headers=get_headers())
-            if resp.status_code == 200:
-                data = resp.json().get('result', {}).get('data', [])
-                st.session_state['categories_cache'] = {c['title']: str(c['name']) for c in data}
-        except: pass
-    return st.session_state.get('categories_cache', {})
+    return codebook_map(get_api(), "categories")
 
 def fetch_queues():
-    if 'queues_cache' not in st.session_state:
-        try:
-            resp = requests.get(f"{INSTANCE_URL}/api/v6/queues.json", headers=get_headers())
-            if resp.status_code == 200:
-                data = resp.json().get('result', {}).get('data', [])
-                st.session_state['queues_cache'] = {q['title']: str(q['name']) for q in data if q.get('title')}
-        except: pass
-    return st.session_state.get('queues_cache', {})
+    return codebook_map(get_api(), "queues")
 
 def fetch_users():
-    if 'users_cache' not in st.session_state:
-        try:
-            resp = requests.get(f"{INSTANCE_URL}/api/v6/users.json", headers=get_headers())
-            if resp.status_code == 200:
-                data = resp.json().get('result', {}).get('data', [])
-                st.session_state['users_cache'] = {u['title']: u['name'] for u in data if u.get('title')}
-        except: pass
-    return st.session_state.get('users_cache', {})
+    return codebook_map(get_api(), "users")
 
 # --- POMOCNÁ FUNKCE PRO ČIŠTĚNÍ HODNOT (LIST -> STR) ---
 def format_value(val):
@@ -56,6 +38,26 @@ def format_value(val):
         return val.get('title', str(val))
     return val
 
+# --- STAHOVÁNÍ DÁVEK (STRÁNKY / ČASOVÁ OKNA) ---
+def iter_task_batches(task, extra_filters, d_from, d_to, take, workers, use_windows):
+    """
+    Vrací (dávka, podíl hotové práce 0-1, celkový počet nebo None).
+    Dlouhé rozsahy se dělí na časová okna (hluboké 'skip' offsety jsou v API pomalé),
+    krátké se stránkují po 'take' se souběžným stažením zbylých stránek.
+    """
+    path = f"{task['endpoint']}.json"
+    if use_windows:
+        for rows, done_days, total_days in get_api().iter_windows(path, extra_filters, task['date_field'], d_from, d_to,
+                                                                    fields=task['fields'], take=take, max_workers=workers):
+            yield rows, done_days / total_days, None
+        return
+
+    params = build_query(date_range_filters(task['date_field'], d_from, d_to) + extra_filters, fields=task['fields'])
+    fetched = 0
+    for batch, total in get_api().iter_pages(path, params, take=take, max_workers=workers):
+        fetched += len(batch)
+        yield batch, (fetched / total if total else 0), total
+
 # --- HLAVNÍ RENDER ---
 
 def render_downloader():
@@ -70,7 +72,11 @@ def render_downloader():
     if not ACCESS_TOKEN or not INSTANCE_URL:
         st.error("Chybí konfigurace v secrets.toml."); st.stop()
 
-    agenda_type = st.selectbox("Vyberte typ dat k exportu:", ["🎫 Tickety", "📞 Hovory", "🔄 Obojí"], index=0)
+    c_agenda, c_refresh = st.columns([4, 1])
+    agenda_type = c_agenda.selectbox("Vyberte typ dat k exportu:", ["🎫 Tickety", "📞 Hovory", "🔄 Obojí"], index=0)
+    c_refresh.write("")
+    if c_refresh.button("🔄 Obnovit číselníky", use_container_width=True, help="Znovu načte kategorie, fronty a uživatele z Daktely."):
+        refresh_codebooks(); st.rerun()
 
     c1, c2 = st.columns(2)
     default_start = date.today() - timedelta(days=1) if "Hovory" in agenda_type else date.today() - timedelta(days=7)
@@ -151,6 +157,13 @@ def render_downloader():
             ]
         })
 
+    with st.expander("⚙️ Pokročilé nastavení stahování"):
+        parallel_pages = st.checkbox("⚡ Stahovat stránky souběžně", value=True, help="Po první stránce je znám celkový počet záznamů, zbylé stránky (po 1000) se pak stahují najednou.")
+        page_workers = st.number_input("Max. souběžných stránek / oken", min_value=2, max_value=16, value=API_PAGE_WORKERS, disabled=not parallel_pages)
+        span_days = (d_to - d_from).days + 1
+        use_windows = st.checkbox("📅 Rozdělit období na časová okna", value=span_days > API_SHARD_MIN_DAYS,
+                                  help=f"Období delší než {API_SHARD_MIN_DAYS} dní se automaticky stahuje po dnech/týdnech (velikost okna se přizpůsobuje počtu záznamů).")
+
     st.divider()
 
     # ZMĚNA: Tlačítko 'Spustit' zabaleno do 3 sloupců pro vycentrování (poměr 1:2:1)
@@ -171,47 +184,18 @@ def render_downloader():
 
         for task in download_tasks:
             if st.session_state.stop_download: break
-            all_data, skip, take = [], 0, 1000
+            all_data, take = [], 1000
             
             # ZMĚNA: Uložení počátečního času pro výpočet ETA
             start_time = time.time()
-            
-            while True:
-                if st.session_state.stop_download: break
 
-                params = {
-                    "filter[logic]": "and",
-                    "filter[filters][0][field]": task['date_field'], 
-                    "filter[filters][0][operator]": "gte", "filter[filters][0][value]": f"{d_from} 00:00:00",
-                    "filter[filters][1][field]": task['date_field'], 
-                    "filter[filters][1][operator]": "lte", "filter[filters][1][value]": f"{d_to} 23:59:59",
-                    "take": take, "skip": skip
-                }
-                
-                for group_idx, group in enumerate(task['filter_groups'], start=2):
-                    if group['ids']:
-                        if len(group['ids']) == 1:
-                            params[f"filter[filters][{group_idx}][field]"] = group['field']
-                            params[f"filter[filters][{group_idx}][operator]"] = "eq"
-                            params[f"filter[filters][{group_idx}][value]"] = group['ids'][0]
-                        else:
-                            params[f"filter[filters][{group_idx}][logic]"] = "or"
-                            for val_idx, val in enumerate(group['ids']):
-                                params[f"filter[filters][{group_idx}][filters][{val_idx}][field]"] = group['field']
-                                params[f"filter[filters][{group_idx}][filters][{val_idx}][operator]"] = "eq"
-                                params[f"filter[filters][{group_idx}][filters][{val_idx}][value]"] = val
-                
-                for i, f in enumerate(task['fields']):
-                    params[f"fields[{i}]"] = f
+            extra_filters = [ids_filter(group['field'], group['ids']) for group in task['filter_groups'] if group['ids']]
+            workers = page_workers if parallel_pages else 1
 
-                try:
-                    resp = requests.get(f"{INSTANCE_URL}/api/v6/{task['endpoint']}.json", params=params, headers=get_headers())
-                    resp.raise_for_status()
-                    res_json = resp.json().get('result', {})
-                    batch = res_json.get('data', [])
-                    total = res_json.get('total', 0)
-                    
-                    if not batch: break
+            try:
+                batches = iter_task_batches(task, extra_filters, d_from, d_to, take, workers, use_windows)
+                for batch, done_ratio, total in batches:
+                    if st.session_state.stop_download: batches.close(); break
                     
                     for item in batch:
                         row = item.copy()
@@ -232,24 +216,21 @@ def render_downloader():
                         all_data.append(row)
 
                     # ZMĚNA: Výpočet rychlosti a dynamické vytvoření odhadovaného času (ETA)
+                    # (podle podílu hotové práce - u časových oken není celkový počet předem znám)
                     fetched = len(all_data)
                     elapsed = time.time() - start_time
                     eta_str = ""
                     
-                    if fetched > 0 and total > fetched:
-                        avg_time_per_record = elapsed / fetched
-                        eta_seconds = int(avg_time_per_record * (total - fetched))
+                    if 0 < done_ratio < 1:
+                        eta_seconds = int(elapsed * (1 - done_ratio) / done_ratio)
                         m, s = divmod(eta_seconds, 60)
                         h, m = divmod(m, 60)
                         eta_str = f" | ⏳ ETA: {h:02d}:{m:02d}:{s:02d}" if h > 0 else f" | ⏳ ETA: {m:02d}:{s:02d}"
 
-                    status_container.update(label=f"📥 Stahuji {task['name']}: {fetched} / {total} záznamů...{eta_str}")
-                    
-                    if fetched >= total or len(batch) < take: break
-                    skip += take
-                    time.sleep(0.05)
-                except Exception as e:
-                    st.error(f"Chyba u {task['name']}: {e}"); break
+                    count_str = f"{fetched} / {total}" if total else f"{fetched} ({int(done_ratio * 100)} % období)"
+                    status_container.update(label=f"📥 Stahuji {task['name']}: {count_str} záznamů...{eta_str}")
+            except Exception as e:
+                st.error(f"Chyba u {task['name']}: {e}")
 
             if all_data and not st.session_state.stop_download:
                 df = pd.DataFrame(all_data)
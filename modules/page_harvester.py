@@ -1,20 +1,26 @@
 import streamlit as st
-import requests
 import json
 import time
 import re
 import csv
 import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 from collections import defaultdict
 from openai import OpenAI
+from utils.codebooks import codebook_map
+from utils.daktela_client import get_client, build_query, date_range_filters, ACTIVITY_FIELDS
 # Předpokládáme existenci těchto modulů dle kontextu, pokud ne, skript může vyžadovat úpravu cest
 try:
     from config import NOISE_PATTERNS, CUT_OFF_PATTERNS, HISTORY_PATTERNS
+    from config import HARVEST_FETCH_WORKERS, HARVEST_AI_WORKERS, HARVEST_QUEUE_SIZE, API_PAGE_WORKERS, SYNC_BULK_TICKETS
     from utils.helpers import slugify, clean_html, format_date_split, identify_side
 except ImportError:
     # Fallback pro případ, že běžíš izolovaně bez utils
     NOISE_PATTERNS, CUT_OFF_PATTERNS, HISTORY_PATTERNS = [], [], []
+    HARVEST_FETCH_WORKERS, HARVEST_AI_WORKERS, HARVEST_QUEUE_SIZE, API_PAGE_WORKERS = 4, 4, 16, 4
+    SYNC_BULK_TICKETS = 50
     def slugify(s): return s
     def clean_html(s): return s
     def format_date_split(s): return s, ""
@@ -86,6 +92,151 @@ def format_ticket_for_ai(ticket_entry):
         summary += f"[{act_type}] {sender}: {clean_text}\n"
     return summary
 
+def build_ticket_entry(t_obj, acts, combined_cut_regex):
+    """Fáze čištění: z ticketu a jeho aktivit sestaví strukturovaný ticket_entry."""
+    t_num = t_obj.get('name')
+    t_date, t_time = format_date_split(t_obj.get('created'))
+    t_status = t_obj.get('statuses', [{}])[0].get('title', 'N/A') if isinstance(t_obj.get('statuses'), list) and t_obj.get('statuses') else "N/A"
+    custom_fields = t_obj.get('customFields', {})
+    vip_list = custom_fields.get('vip', [])
+    ticket_clientType = "VIP" if "→ VIP KLIENT ←" in vip_list else "Standard"
+    
+    ticket_entry = {
+        "ticket_number": t_num, 
+        "ticket_name": t_obj.get('title', 'Bez předmětu'), 
+        "ticket_clientType": ticket_clientType, 
+        "ticket_category": t_obj.get('category', {}).get('title', 'N/A') if t_obj.get('category') else "N/A", 
+        "ticket_status": t_status, 
+        "ticket_creationDate": t_date, 
+        "ticket_creationTime": t_time, 
+        "activities": []
+    }
+
+    for a_idx, act in enumerate(sorted(acts, key=lambda x: x.get('time', '')), 1):
+        item = act.get('item') or {}; address = item.get('address', '')
+        cleaned = clean_html(item.get('text') or act.get('description'))
+        if not cleaned: continue
+        if any(re.search(p, cleaned, re.IGNORECASE) for p in NOISE_PATTERNS): cleaned = "[AUTOMATICKÝ EMAIL BALÍKOBOTU]"
+        else:
+            if combined_cut_regex:
+                match = combined_cut_regex.search(cleaned)
+                if match: cleaned = cleaned[:match.start()].strip() + "\n\n[PODPIS]"
+        
+        u_title = (act.get('user') or {}).get('title'); c_title = (act.get('contact') or {}).get('title'); direction = item.get('direction', 'out')
+        if direction == "in": sender = identify_side(c_title, address, is_user=False); recipient = "Balíkobot"
+        else: sender = identify_side(u_title, "", is_user=True); recipient = identify_side(c_title, address, is_user=False)
+        
+        a_date, a_time = format_date_split(act.get('time')); act_type = act.get('type') or "COMMENT"
+        act_data = {"activity_number": a_idx, "activity_type": act_type, "activity_sender": sender}
+        if act_type != "COMMENT": act_data["activity_recipient"] = recipient
+        act_data.update({"activity_creationDate": a_date, "activity_creationTime": a_time, "activity_text": cleaned})
+        ticket_entry["activities"].append(act_data)
+    return ticket_entry
+
+def classify_ticket(client, ticket_entry):
+    """Fáze AI: doplní do ticket_entry výsledek klasifikace. Vrací (tokeny, cena v USD)."""
+    try:
+        ai_input = format_ticket_for_ai(ticket_entry)
+        response = client.chat.completions.create(
+            model='gpt-4o-mini',
+            messages=[
+                {'role': 'system', 'content': SYSTEM_PROMPT},
+                {'role': 'user', 'content': ai_input}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.1
+        )
+        
+        usage = response.usage
+        in_tokens = usage.prompt_tokens; out_tokens = usage.completion_tokens
+        cost = (in_tokens / 1_000_000 * PRICE_INPUT_1M) + (out_tokens / 1_000_000 * PRICE_OUTPUT_1M)
+
+        ai_result = json.loads(response.choices[0].message.content)
+        ticket_entry.update(ai_result)
+        return usage.total_tokens, cost
+    except Exception as e:
+        ticket_entry['ai_error'] = str(e); ticket_entry['new_status'] = "CHYBA AI"
+        return 0, 0.0
+
+async def run_processing_pipeline(tickets, api, ai_client, combined_cut_regex, on_progress=None, should_stop=None,
+                                  fetch_workers=HARVEST_FETCH_WORKERS, ai_workers=HARVEST_AI_WORKERS, queue_size=HARVEST_QUEUE_SIZE,
+                                  bulk_size=SYNC_BULK_TICKETS):
+    """
+    Zpracování ticketů jako asyncio pipeline: stahování -> čištění -> AI.
+    Fáze jsou propojené omezenými frontami, takže se u různých ticketů překrývají.
+    Blokující volání (Daktela, presidio, OpenAI) běží ve vláknech, callback on_progress
+    se volá z event loopu (tj. z vlákna skriptu), takže může přímo aktualizovat UI.
+    Aktivity se stahují hromadně po bulk_size ticketech (0/1 = po jednom ticketu).
+    Vrací seznam ticket_entry ve stejném pořadí jako vstupní tickety.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=fetch_workers + ai_workers + 1)
+    def run(fn, *args): return loop.run_in_executor(executor, fn, *args)
+
+    q_fetch = asyncio.Queue(); q_clean = asyncio.Queue(maxsize=queue_size); q_ai = asyncio.Queue(maxsize=queue_size)
+    for job in enumerate(tickets): q_fetch.put_nowait(job)
+    results = [None] * len(tickets)
+    totals = {"done": 0, "tokens": 0, "cost": 0.0}
+
+    def finish(idx, t_num, entry):
+        results[idx] = entry; totals["done"] += 1
+        if on_progress: on_progress(totals["done"], len(tickets), t_num, totals)
+
+    def fetch_one(t_num):
+        try: return api.get_data(f"tickets/{t_num}/activities.json", fields=ACTIVITY_FIELDS)
+        except Exception: return []
+
+    def fetch_bulk(t_nums):
+        # ZMĚNA: Hromadný dotaz na activities.json pro celou skupinu ticketů
+        try: return api.get_activities_bulk(t_nums, fields=ACTIVITY_FIELDS) if len(t_nums) > 1 else {}
+        except Exception: return {}
+
+    async def fetch_worker():
+        while not q_fetch.empty():
+            if should_stop and should_stop(): return
+            chunk = []
+            while not q_fetch.empty() and len(chunk) < max(1, bulk_size): chunk.append(q_fetch.get_nowait())
+            bulk = await run(fetch_bulk, [t_obj.get('name') for _, t_obj in chunk])
+            # Tickety, které se do hromadné stránky nevešly, po jednom (souběžně)
+            missing = [t_obj.get('name') for _, t_obj in chunk if str(t_obj.get('name')) not in bulk]
+            for t_num, acts in zip(missing, await asyncio.gather(*(run(fetch_one, t) for t in missing))): bulk[str(t_num)] = acts
+            for idx, t_obj in chunk:
+                await q_clean.put((idx, t_obj, bulk[str(t_obj.get('name'))]))
+
+    async def clean_worker():
+        while True:
+            job = await q_clean.get()
+            if job is None: return
+            idx, t_obj, acts = job
+            try: entry = await run(build_ticket_entry, t_obj, acts, combined_cut_regex)
+            except Exception:
+                finish(idx, t_obj.get('name'), None); continue
+            if ai_client: await q_ai.put((idx, entry))
+            else: finish(idx, entry["ticket_number"], entry)
+
+    async def ai_worker():
+        while True:
+            job = await q_ai.get()
+            if job is None: return
+            idx, entry = job
+            tokens, cost = await run(classify_ticket, ai_client, entry)
+            totals["tokens"] += tokens; totals["cost"] += cost
+            finish(idx, entry["ticket_number"], entry)
+
+    fetchers = [asyncio.create_task(fetch_worker()) for _ in range(fetch_workers)]
+    cleaner = asyncio.create_task(clean_worker())
+    classifiers = [asyncio.create_task(ai_worker()) for _ in range(ai_workers if ai_client else 0)]
+    try:
+        await asyncio.gather(*fetchers)
+        await q_clean.put(None); await cleaner
+        for _ in classifiers: await q_ai.put(None)
+        await asyncio.gather(*classifiers)
+    finally:
+        for task in fetchers + [cleaner] + classifiers: task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return [entry for entry in results if entry is not None], totals
+
 def generate_csv_stats_bytes(analyzed_data):
     """
     Vygeneruje CSV statistiku (Excel format) v paměti a vrátí bytes (UTF-8-SIG).
@@ -146,6 +297,8 @@ def render_harvester():
         ACCESS_TOKEN = ""
         OPENAI_KEY = ""
 
+    api = get_client(INSTANCE_URL, ACCESS_TOKEN)
+
     # --- CSS PRO ROZŠÍŘENÍ STRÁNKY (ZAROVNÁNÍ S DBUPDATE/VIEW) ---
     st.markdown("""
         <style>
@@ -188,22 +341,14 @@ def render_harvester():
     if 'ai_cost_total' not in st.session_state: st.session_state.ai_cost_total = 0.0
     if 'ai_tokens_total' not in st.session_state: st.session_state.ai_tokens_total = 0
 
-    # OPRAVA CHYBY: Načtení číselníků - kontrolujeme ZDALI NĚCO CHYBÍ (OR místo jen categories)
-    if 'categories' not in st.session_state or 'statuses' not in st.session_state:
-        try:
-            res_cat = requests.get(f"{INSTANCE_URL}/api/v6/ticketsCategories.json", headers={'x-auth-token': ACCESS_TOKEN})
-            cat_data = res_cat.json().get('result', {}).get('data', [])
-            st.session_state['categories'] = sorted(cat_data, key=lambda x: x.get('title', '').lower())
-            
-            res_stat = requests.get(f"{INSTANCE_URL}/api/v6/statuses.json", headers={'x-auth-token': ACCESS_TOKEN})
-            stat_data = res_stat.json().get('result', {}).get('data', [])
-            st.session_state['statuses'] = sorted(stat_data, key=lambda x: x.get('title', '').lower())
-        except: 
-            st.error("Chyba číselníků (Daktela API). Zkontrolujte URL a TOKEN.")
-            st.stop()
+    # ZMĚNA: Číselníky ze sdílené cache (utils/codebooks.py) - při zahřáté cache žádné volání API
+    categories = codebook_map(api, "categories"); statuses = codebook_map(api, "statuses")
+    if not categories or not statuses:
+        st.error("Chyba číselníků (Daktela API). Zkontrolujte URL a TOKEN.")
+        st.stop()
 
-    cat_options_map = {"VŠE (bez filtru)": "ALL"}; cat_options_map.update({c['title']: c['name'] for c in st.session_state['categories']})
-    stat_options_map = {"VŠE (bez filtru)": "ALL"}; stat_options_map.update({s['title']: s['name'] for s in st.session_state['statuses']})
+    cat_options_map = {"VŠE (bez filtru)": "ALL"}; cat_options_map.update(categories)
+    stat_options_map = {"VŠE (bez filtru)": "ALL"}; stat_options_map.update(statuses)
 
     # ========================== LOGIKA FÁZÍ ==========================
 
@@ -266,104 +411,25 @@ def render_harvester():
         tickets_to_process = st.session_state.found_tickets
         if st.session_state.final_limit > 0: tickets_to_process = tickets_to_process[:st.session_state.final_limit]
 
-        full_export_data = []; start_time = time.time(); total_count = len(tickets_to_process)
-        current_cost = 0.0; current_tokens = 0
+        start_time = time.time()
 
-        # --- KROK 3: LOOP ---
-        for idx, t_obj in enumerate(tickets_to_process):
-            if st.session_state.stop_requested: break
-            t_num = t_obj.get('name')
-            
-            status_msg = f"📥 Zpracovávám ticket **{idx + 1}/{total_count}**: `{t_num}`"
+        # --- KROK 3: PIPELINE (stahování -> čištění -> AI běží souběžně) ---
+        def on_progress(done, total, t_num, totals):
+            status_msg = f"📥 Zpracováno **{done}/{total}** ticketů, poslední: `{t_num}`"
             if st.session_state.use_ai_analysis: status_msg += " + 🧠 AI Analýza"
             status_text.markdown(status_msg)
-
-            try:
-                # 1. Daktela
-                acts = []
-                for attempt in range(3):
-                    try:
-                        res_act = requests.get(f"{INSTANCE_URL}/api/v6/tickets/{t_num}/activities.json", headers={'X-AUTH-TOKEN': ACCESS_TOKEN}, timeout=30)
-                        res_act.raise_for_status()
-                        acts = res_act.json().get('result', {}).get('data', [])
-                        break
-                    except: time.sleep(1)
-                
-                t_date, t_time = format_date_split(t_obj.get('created'))
-                t_status = t_obj.get('statuses', [{}])[0].get('title', 'N/A') if isinstance(t_obj.get('statuses'), list) and t_obj.get('statuses') else "N/A"
-                custom_fields = t_obj.get('customFields', {})
-                vip_list = custom_fields.get('vip', [])
-                ticket_clientType = "VIP" if "→ VIP KLIENT ←" in vip_list else "Standard"
-                
-                ticket_entry = {
-                    "ticket_number": t_num, 
-                    "ticket_name": t_obj.get('title', 'Bez předmětu'), 
-                    "ticket_clientType": ticket_clientType, 
-                    "ticket_category": t_obj.get('category', {}).get('title', 'N/A') if t_obj.get('category') else "N/A", 
-                    "ticket_status": t_status, 
-                    "ticket_creationDate": t_date, 
-                    "ticket_creationTime": t_time, 
-                    "activities": []
-                }
-
-                # 2. Cleaning
-                for a_idx, act in enumerate(sorted(acts, key=lambda x: x.get('time', '')), 1):
-                    item = act.get('item') or {}; address = item.get('address', '')
-                    cleaned = clean_html(item.get('text') or act.get('description'))
-                    if not cleaned: continue
-                    if any(re.search(p, cleaned, re.IGNORECASE) for p in NOISE_PATTERNS): cleaned = "[AUTOMATICKÝ EMAIL BALÍKOBOTU]"
-                    else:
-                        if combined_cut_regex:
-                            match = combined_cut_regex.search(cleaned)
-                            if match: cleaned = cleaned[:match.start()].strip() + "\n\n[PODPIS]"
-                    
-                    u_title = (act.get('user') or {}).get('title'); c_title = (act.get('contact') or {}).get('title'); direction = item.get('direction', 'out')
-                    if direction == "in": sender = identify_side(c_title, address, is_user=False); recipient = "Balíkobot"
-                    else: sender = identify_side(u_title, "", is_user=True); recipient = identify_side(c_title, address, is_user=False)
-                    
-                    a_date, a_time = format_date_split(act.get('time')); act_type = act.get('type') or "COMMENT"
-                    act_data = {"activity_number": a_idx, "activity_type": act_type, "activity_sender": sender}
-                    if act_type != "COMMENT": act_data["activity_recipient"] = recipient
-                    act_data.update({"activity_creationDate": a_date, "activity_creationTime": a_time, "activity_text": cleaned})
-                    ticket_entry["activities"].append(act_data)
-                
-                # 3. AI
-                if st.session_state.use_ai_analysis and client:
-                    try:
-                        ai_input = format_ticket_for_ai(ticket_entry)
-                        response = client.chat.completions.create(
-                            model='gpt-4o-mini',
-                            messages=[
-                                {'role': 'system', 'content': SYSTEM_PROMPT},
-                                {'role': 'user', 'content': ai_input}
-                            ],
-                            response_format={"type": "json_object"},
-                            temperature=0.1
-                        )
-                        
-                        usage = response.usage
-                        in_tokens = usage.prompt_tokens; out_tokens = usage.completion_tokens; total_t = usage.total_tokens
-                        cost = (in_tokens / 1_000_000 * PRICE_INPUT_1M) + (out_tokens / 1_000_000 * PRICE_OUTPUT_1M)
-                        current_cost += cost; current_tokens += total_t
-                        token_text.caption(f"🪙 Použité tokeny: **{current_tokens}**")
-
-                        ai_result = json.loads(response.choices[0].message.content)
-                        ticket_entry.update(ai_result)
-                    except Exception as e:
-                        ticket_entry['ai_error'] = str(e); ticket_entry['new_status'] = "CHYBA AI"
-
-                full_export_data.append(ticket_entry)
-                time.sleep(0.1) 
-
-            except Exception: pass
-            
-            progress_bar.progress((idx + 1) / total_count)
-            elapsed = time.time() - start_time
-            if idx > 0:
-                avg_per_item = elapsed / (idx + 1)
-                remaining_sec = (total_count - (idx + 1)) * avg_per_item
+            if totals["tokens"]: token_text.caption(f"🪙 Použité tokeny: **{totals['tokens']}** | 💰 Cena: **${totals['cost']:.4f}**")
+            progress_bar.progress(done / total)
+            if done > 1:
+                remaining_sec = (total - done) * (time.time() - start_time) / done
                 eta_text.caption(f"⏱️ Zbývá cca: **{int(remaining_sec)}** sekund")
 
+        full_export_data, totals = asyncio.run(run_processing_pipeline(
+            tickets_to_process, api, client, combined_cut_regex,
+            on_progress=on_progress, should_stop=lambda: st.session_state.stop_requested
+        ))
+        current_cost = totals["cost"]; current_tokens = totals["tokens"]
+
         # --- KONEC ---
         elapsed = time.time() - start_time
         if elapsed < 60: duration_str = f"{int(elapsed)}s"
@@ -507,7 +573,7 @@ def render_harvester():
                     use_ai = st.checkbox("Zapnout GPT-4o-mini", value=False, help="Odešle data do OpenAI pro analýzu.")
                     
                     if use_ai:
-                        st.caption("⚠️ **Pomalé** (~3s/ticket)")
+                        st.caption(f"⚠️ **Pomalejší** (~3s/ticket, {HARVEST_AI_WORKERS} souběžně)")
                         st.caption("💰 Čerpá kredity OpenAI")
                     else:
                         st.caption("🚀 **Rychlé zpracování**")
@@ -551,21 +617,15 @@ def render_harvester():
             
             st.write("")
             if st.button("🔍 VYHLEDAT TICKETY", type="primary", use_container_width=True, key="search_tickets_btn"):
-                params = {"filter[logic]": "and", "filter[filters][0][field]": "created", "filter[filters][0][operator]": "gte", "filter[filters][0][value]": f"{st.session_state.filter_date_from} 00:00:00", "filter[filters][1][field]": "created", "filter[filters][1][operator]": "lte", "filter[filters][1][value]": f"{st.session_state.filter_date_to} 23:59:59", "fields[0]": "name", "fields[1]": "title", "fields[2]": "created", "fields[3]": "customFields", "fields[4]": "category", "fields[5]": "statuses"}
-                filter_idx = 2
-                if st.session_state.selected_cat_key != "ALL": params[f"filter[filters][{filter_idx}][field]"] = "category"; params[f"filter[filters][{filter_idx}][operator]"] = "eq"; params[f"filter[filters][{filter_idx}][value]"] = st.session_state.selected_cat_key; filter_idx += 1
-                if st.session_state.selected_stat_key != "ALL": params[f"filter[filters][{filter_idx}][field]"] = "statuses"; params[f"filter[filters][{filter_idx}][operator]"] = "eq"; params[f"filter[filters][{filter_idx}][value]"] = st.session_state.selected_stat_key; filter_idx += 1
+                filters = date_range_filters("created", st.session_state.filter_date_from, st.session_state.filter_date_to)
+                if st.session_state.selected_cat_key != "ALL": filters.append({"field": "category", "operator": "eq", "value": st.session_state.selected_cat_key})
+                if st.session_state.selected_stat_key != "ALL": filters.append({"field": "statuses", "operator": "eq", "value": st.session_state.selected_stat_key})
+                params = build_query(filters, fields=["name", "title", "created", "customFields", "category", "statuses"])
                 
                 with st.spinner("Prohledávám databázi..."):
                     try:
-                        all_tickets = []; params["take"] = 1000; params["skip"] = 0
-                        while True:
-                            res = requests.get(f"{INSTANCE_URL}/api/v6/tickets.json", params=params, headers={'X-AUTH-TOKEN': ACCESS_TOKEN})
-                            data = res.json().get('result', {}).get('data', [])
-                            if not data: break
-                            all_tickets.extend(data)
-                            if len(data) < 1000: break
-                            params["skip"] += 1000
+                        # ZMĚNA: Zbylé stránky (po 1000) se po první stránce stahují souběžně
+                        all_tickets = api.fetch_all("tickets.json", params, take=1000, max_workers=API_PAGE_WORKERS)
                         st.session_state.found_tickets = all_tickets
                         st.session_state.harvester_phase = "selection"
                         st.rerun()
@@ -1,6 +1,5 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import os
 import altair as alt
 import datetime
@@ -11,7 +10,11 @@ import vl_convert as vlc
 #test
 
 # --- KONFIGURACE CESTY K DB ---
-DB_PATH = os.path.join('data', 'daktela_data.db')
+# ZMĚNA: Cesta a spojení z utils.storage (čtení nečeká na běžící synchronizaci)
+from utils.storage import DB_FILE as DB_PATH, get_read_connection
+from config import STATS_TABLE_ROWS
+from utils import snapshots, analytics
+from utils.rollups import rollups_available, load_ticket_rollup, load_status_rollup, load_hour_rollup
 
 # --- POMOCNÉ FUNKCE ---
 
@@ -50,30 +53,19 @@ def calculate_kpis(df):
         avg_act = pd.to_numeric(df[col_act], errors='coerce').mean()
         stats["avg_activities"] = round(avg_act, 1) if not pd.isna(avg_act) else 0
         
-    if all(c in df.columns for c in ["created_date", "created_time", "first_answer_date", "first_answer_time"]):
-        start_strs = df["created_date"].astype(str) + " " + df["created_time"].astype(str)
-        end_strs = df["first_answer_date"].astype(str) + " " + df["first_answer_time"].astype(str)
-        
-        start_strs = start_strs.replace({'nan nan': pd.NA, 'None None': pd.NA})
-        end_strs = end_strs.replace({'nan nan': pd.NA, 'None None': pd.NA})
-        
-        starts = pd.to_datetime(start_strs, errors='coerce')
-        ends = pd.to_datetime(end_strs, errors='coerce')
+    # ZMĚNA: Časy jsou v jednom sloupci *_at ('YYYY-MM-DD HH:MM:SS'), bez skládání datum + čas
+    if all(c in df.columns for c in ["created_at", "first_answer_at"]):
+        starts = pd.to_datetime(df["created_at"], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        ends = pd.to_datetime(df["first_answer_at"], format='%Y-%m-%d %H:%M:%S', errors='coerce')
         
         biz_seconds = [calc_biz_sec(s, e) for s, e in zip(starts, ends)]
         med_resp = pd.Series(biz_seconds).median()
         
         if not pd.isna(med_resp): stats["avg_response_time"] = format_human_time(med_resp)
         
-    if all(c in df.columns for c in ["last_activity_op_date", "last_activity_op_time", "last_activity_cl_date", "last_activity_cl_time"]):
-        op_strs = df["last_activity_op_date"].astype(str) + " " + df["last_activity_op_time"].astype(str)
-        cl_strs = df["last_activity_cl_date"].astype(str) + " " + df["last_activity_cl_time"].astype(str)
-        
-        op_strs = op_strs.replace({'nan nan': pd.NA, 'None None': pd.NA})
-        cl_strs = cl_strs.replace({'nan nan': pd.NA, 'None None': pd.NA})
-        
-        starts = pd.to_datetime(op_strs, errors='coerce')
-        ends = pd.to_datetime(cl_strs, errors='coerce')
+    if all(c in df.columns for c in ["last_activity_op_at", "last_activity_cl_at"]):
+        starts = pd.to_datetime(df["last_activity_op_at"], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        ends = pd.to_datetime(df["last_activity_cl_at"], format='%Y-%m-%d %H:%M:%S', errors='coerce')
         
         diffs = (ends - starts).dt.total_seconds()
         diffs = diffs[diffs > 0]
@@ -84,63 +76,45 @@ def calculate_kpis(df):
     return stats
 
 def get_db_connection():
-    if not os.path.exists(DB_PATH): return None
-    return sqlite3.connect(DB_PATH)
+    # Sdílené čtecí spojení vlákna, nezavírá se
+    return get_read_connection()
+
+def load_ticket_statuses():
+    """ZMĚNA: Všechny statusy ticketů jako dvojice [ticket_id, status_id = název] (vazební tabulka přes krycí index)."""
+    conn = get_db_connection()
+    if not conn: return pd.DataFrame(columns=["ticket_id", "status_id"])
+    return pd.read_sql_query('''SELECT ts.ticket_id, st.title AS status_id
+                                FROM ticket_statuses ts JOIN statuses st ON st.status_id = ts.status_id''', conn)
 
 def get_all_tables():
     conn = get_db_connection()
     if not conn: return []
     cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'activities_fts%' AND name NOT LIKE 'sqlite_stat%' AND name NOT LIKE 'content_%';")
     tables = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return tables
 
 def load_data_from_db(agenda):
     conn = get_db_connection()
     if not conn: return pd.DataFrame()
     try:
+        # ZMĚNA: Tickety a aktivity ze sloupcového snapshotu (utils.snapshots), při zastaralém snapshotu z SQLite
         if agenda == "Tickety":
-            query = """
-            SELECT t.*, 
-                   c.title as _cat_title, 
-                   u.title as _user_title, 
-                   (SELECT GROUP_CONCAT(st.title, ', ') 
-                    FROM ticket_statuses ts 
-                    JOIN statuses st ON ts.status_id = st.status_id 
-                    WHERE ts.ticket_id = t.ticket_id) as _stat_title, 
-                   cl.title as _client_title, 
-                   co.title as _contact_title
-            FROM tickets t
-            LEFT JOIN categories c ON t.category_id = c.category_id
-            LEFT JOIN users u ON t.user_id = u.user_id
-            LEFT JOIN clients cl ON t.client_id = cl.client_id
-            LEFT JOIN contacts co ON t.contact_id = co.contact_id
-            """
-            df = pd.read_sql_query(query, conn)
-            
+            df = snapshots.load_table("tickets", conn)
             mapping = {
                 "category_id": "_cat_title",
                 "user_id": "_user_title",
-                "status_id": "_stat_title",
+                "status_id": "status_titles",
                 "client_id": "_client_title",
                 "contact_id": "_contact_title"
             }
             for col, temp_col in mapping.items():
                 if col in df.columns and temp_col in df.columns:
                     df[col] = df[temp_col].where(df[temp_col].notna(), df[col])
-            df.drop(columns=list(mapping.values()), inplace=True, errors='ignore')
+            df.drop(columns=list(mapping.values()) + ["_status_title"], inplace=True, errors='ignore')
 
         elif agenda == "Aktivity":
-            query = """
-            SELECT a.*, 
-                   q.title as _queue_title, 
-                   c.title as _cat_title
-            FROM activities a
-            LEFT JOIN queues q ON a.queue_id = q.queue_id
-            LEFT JOIN categories c ON a.category_id = c.category_id
-            """
-            df = pd.read_sql_query(query, conn)
+            df = snapshots.load_table("activities", conn)
             mapping = {"queue_id": "_queue_title", "category_id": "_cat_title"}
             for col, temp_col in mapping.items():
                 if col in df.columns and temp_col in df.columns:
@@ -163,7 +137,6 @@ def load_data_from_db(agenda):
             except: df = pd.DataFrame()
     except Exception as e: 
         st.error(f"SQL Error: {e}"); df = pd.DataFrame()
-    finally: conn.close()
     return df
 
 def generate_excel_report(df, kpis, charts=None, agenda_name="Report", date_range_str="N/A"):
@@ -208,6 +181,174 @@ def reset_filters():
     for k in list(st.session_state.keys()):
         if k.startswith(("filter_", "stat_", "tg_", "slider_", "date_col_select", "check_", "search_")): del st.session_state[k]
 
+DAYS_CZ = {0: '1_Pondělí', 1: '2_Úterý', 2: '3_Středa', 3: '4_Čtvrtek', 4: '5_Pátek', 5: '6_Sobota', 6: '7_Neděle'}
+
+def apply_detail_filters(sel_agenda):
+    """
+    Načte detailní řádky agendy a vykreslí filtry v postranním panelu. Vrací (df, filtered_df, active_date_col, extra)
+    nebo None; extra u ticketů = {'status': dvojice ticket–status vyfiltrovaných ticketů}.
+    """
+    df = load_data_from_db(sel_agenda)
+    if df.empty: st.warning("Žádná data."); return None
+    
+    if sel_agenda == "Tickety" and "created_at" in df.columns:
+        temp_date = pd.to_datetime(df["created_at"], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+        idx_date = df.columns.get_loc("created_at")
+        df.insert(idx_date + 1, "created_day", temp_date.dt.dayofweek.map(DAYS_CZ))
+        df.insert(idx_date + 2, "created_week", temp_date.dt.isocalendar().week.astype('Int64'))
+        hour_labels = temp_date.dt.hour.apply(lambda h: f"{int(h):02d}:00 - {int(h)+1:02d}:00" if pd.notna(h) else None)
+        df.insert(idx_date + 3, "created_hour", hour_labels)
+
+    filtered_df = df.copy()
+
+    if sel_agenda == "Tickety" and "ticket_id" in filtered_df.columns:
+        search_ticket_id = st.text_input("🔍 Vyhledat ID ticketu:", key="search_ticket_id", help="Vyhledá konkrétní ticket podle jeho ID v databázi.")
+        if search_ticket_id:
+            filtered_df = filtered_df[filtered_df["ticket_id"].astype(str).str.contains(search_ticket_id.strip(), na=False)]
+
+    date_cols = [c for c in df.columns if any(x in str(c).lower() for x in ["datum", "date", "vytvořeno", "created", "time"]) or str(c).endswith("_at")]
+    active_date_col = None
+    if date_cols:
+        active_date_col = st.selectbox("Dle data:", date_cols, index=0, key="date_col_select")
+        filtered_df[active_date_col] = pd.to_datetime(filtered_df[active_date_col], errors='coerce').dt.date
+        
+        valid_dates = filtered_df[active_date_col].dropna()
+        if not valid_dates.empty:
+            mn, mx = valid_dates.min(), valid_dates.max()
+            if mn < mx:
+                default_start = max(mn, mx - datetime.timedelta(days=30))
+                d_range = st.slider("", min_value=mn, max_value=mx, value=(default_start, mx), format="DD.MM", key="slider_date")
+                s_date = d_range[0]
+                e_date = d_range[1] + datetime.timedelta(days=1)
+                filtered_df = filtered_df[(filtered_df[active_date_col] >= s_date) & (filtered_df[active_date_col] < e_date)]
+            else:
+                st.caption(f"Pouze jeden den: {mn}")
+        else:
+            st.caption("Sloupec neobsahuje platná data.")
+
+    filter_cols = []
+    if sel_agenda == "Tickety": filter_cols = ["created_day", "created_week", "category_id", "priority", "user_id", "status_id"]
+    elif sel_agenda == "Aktivity": filter_cols = ["type", "direction", "sender"]
+    elif sel_agenda == "Zásilky": filter_cols = ["carrier", "status"]
+    else:
+        for c in filtered_df.columns:
+            if filtered_df[c].dtype == 'object' and filtered_df[c].nunique() < 50: filter_cols.append(c)
+
+    # ZMĚNA: Statusy z vazební tabulky (ticket může mít víc statusů) místo dělení textu
+    ticket_statuses = load_ticket_statuses() if sel_agenda == "Tickety" and "ticket_id" in df.columns else None
+    for col in filter_cols:
+        if col in filtered_df.columns:
+            if col == "status_id" and ticket_statuses is not None:
+                opts = sorted(ticket_statuses.loc[ticket_statuses["ticket_id"].isin(filtered_df["ticket_id"]), "status_id"].dropna().unique())
+                if opts:
+                    sel = st.multiselect(col, opts, key=f"filter_{col}")
+                    if sel:
+                        filtered_df = filtered_df[filtered_df["ticket_id"].isin(ticket_statuses.loc[ticket_statuses["status_id"].isin(sel), "ticket_id"])]
+            else:
+                opts = sorted(filtered_df[col].dropna().astype(str).unique())
+                if opts:
+                    display_opts = [o.split('_')[1] if col == 'created_day' and '_' in o else o for o in opts]
+                    sel = st.multiselect(col, opts, format_func=lambda x: x.split('_')[1] if col == 'created_day' and '_' in x else x, key=f"filter_{col}")
+                    if sel: filtered_df = filtered_df[filtered_df[col].astype(str).isin(sel)]
+
+    if sel_agenda == "Tickety":
+        if "vip" in filtered_df.columns:
+            if st.checkbox("⭐ Pouze VIP klienti", key="check_vip", help="Zobrazí pouze tickety označené VIP."):
+                filtered_df = filtered_df[filtered_df["vip"].astype(str) == '1']
+        has_dev = any(x in filtered_df.columns for x in ["dev_task1", "dev_task2"])
+        if has_dev:
+            if st.checkbox("🛠️ Pouze s vazbou na vývoj", key="check_dev", help="Tickety s vazbou na BO, HL, TZ, NL ad."):
+                cond = pd.Series(False, index=filtered_df.index)
+                for c in ["dev_task1", "dev_task2"]:
+                    if c in filtered_df.columns: cond |= filtered_df[c].notna() & (filtered_df[c] != "")
+                filtered_df = filtered_df[cond]
+    extra = None
+    if ticket_statuses is not None:
+        extra = {"status": ticket_statuses[ticket_statuses["ticket_id"].isin(filtered_df["ticket_id"])]}
+    return df, filtered_df, active_date_col, extra
+
+def count_values(df, col):
+    """Počty podle sloupce [hodnota, počet]; souhrnná data (sloupec _n) se sčítají podle vah."""
+    if "_n" in df.columns: return df.groupby(col)["_n"].sum().sort_values(ascending=False).reset_index()
+    return df[col].value_counts().reset_index()
+
+def apply_duckdb_filters():
+    """
+    ZMĚNA: Filtry ticketů jako SQL dotaz nad DuckDB (utils.analytics), stejné prvky jako detailní režim.
+    Vrací (rows, rows, active_date_col, {'status': ..., 'query': TicketQuery}) nebo None;
+    rows = prvních STATS_TABLE_ROWS vyfiltrovaných ticketů (tabulka), export i ostatní počty dává query.
+    """
+    query = analytics.ticket_query(get_db_connection(), DAYS_CZ)
+    if query is None or query.count() == 0: st.warning("Žádná data."); return None
+
+    search_ticket_id = st.text_input("🔍 Vyhledat ID ticketu:", key="search_d_ticket_id", help="Vyhledá konkrétní ticket podle jeho ID v databázi.")
+    if search_ticket_id: query = query.filter("CAST(ticket_id AS VARCHAR) LIKE ?", f"%{search_ticket_id.strip()}%")
+
+    date_cols = query.timestamp_columns()
+    active_date_col = None
+    if date_cols:
+        active_date_col = st.selectbox("Dle data:", date_cols, index=0, key="date_col_select_d")
+        mn, mx = query.date_bounds(active_date_col)
+        if mn is None: st.caption("Sloupec neobsahuje platná data.")
+        elif mn < mx:
+            default_start = max(mn, mx - datetime.timedelta(days=30))
+            s_date, e_date = st.slider("", min_value=mn, max_value=mx, value=(default_start, mx), format="DD.MM", key="slider_d_date")
+            query = query.between_dates(active_date_col, s_date, e_date)
+        else:
+            st.caption(f"Pouze jeden den: {mn}")
+
+    columns = query.columns()
+    for col in ["created_day", "created_week", "category_id", "priority", "user_id", "status_id"]:
+        if col not in columns: continue
+        opts = query.status_options() if col == "status_id" else query.options(col)
+        if not opts: continue
+        sel = st.multiselect(col, opts, format_func=lambda x: x.split('_')[1] if col == 'created_day' and '_' in x else x, key=f"filter_d_{col}")
+        if sel: query = query.with_statuses(sel) if col == "status_id" else query.isin(col, sel)
+
+    if "vip" in columns and st.checkbox("⭐ Pouze VIP klienti", key="check_d_vip", help="Zobrazí pouze tickety označené VIP."):
+        query = query.filter("vip = 1")
+    dev_cols = [c for c in ["dev_task1", "dev_task2"] if c in columns]
+    if dev_cols and st.checkbox("🛠️ Pouze s vazbou na vývoj", key="check_d_dev", help="Tickety s vazbou na BO, HL, TZ, NL ad."):
+        query = query.any_filled(dev_cols)
+
+    rows = query.rows(STATS_TABLE_ROWS)
+    return rows, rows, active_date_col, {"status": query.count_statuses(), "query": query}
+
+def apply_rollup_filters():
+    """
+    ZMĚNA: Filtry nad souhrny ticketů (utils.rollups) – den vytvoření, den v týdnu, týden, kategorie, priorita, uživatel.
+    Vrací (df, filtered_df, 'created_at', {'status': ..., 'hour': ...}) nebo None; 'hour' je None,
+    pokud filtr uživatele/priority hodinový souhrn neumí (nemá tyto dimenze).
+    """
+    conn = get_db_connection()
+    df = load_ticket_rollup(conn)
+    if df.empty: st.warning("Žádná data."); return None
+    extra = {"status": load_status_rollup(conn), "hour": load_hour_rollup(conn)}
+    for d in (df, *extra.values()):
+        d.rename(columns={"day": "created_at"}, inplace=True)
+        days = pd.to_datetime(d["created_at"])
+        d.insert(1, "created_day", days.dt.dayofweek.map(DAYS_CZ))
+        d.insert(2, "created_week", days.dt.isocalendar().week.astype('Int64'))
+    extra["hour"]["created_hour"] = extra["hour"]["hour"].apply(lambda h: f"{int(h):02d}:00 - {int(h)+1:02d}:00")
+
+    filtered_df = df.copy()
+    st.caption("Datum = den vytvoření ticketu.")
+    mn, mx = df["created_at"].min(), df["created_at"].max()
+    if mn < mx:
+        default_start = max(mn, mx - datetime.timedelta(days=30))
+        s_date, e_date = st.slider("", min_value=mn, max_value=mx, value=(default_start, mx), format="DD.MM.YY", key="slider_r_date")
+        filtered_df = filtered_df[(filtered_df["created_at"] >= s_date) & (filtered_df["created_at"] <= e_date)]
+        extra = {k: d[(d["created_at"] >= s_date) & (d["created_at"] <= e_date)] for k, d in extra.items()}
+
+    for col in ["created_day", "created_week", "category_id", "priority", "user_id"]:
+        opts = sorted(filtered_df[col].dropna().astype(str).unique())
+        if not opts: continue
+        sel = st.multiselect(col, opts, format_func=lambda x: x.split('_')[1] if col == 'created_day' and '_' in x else x, key=f"filter_r_{col}")
+        if sel:
+            filtered_df = filtered_df[filtered_df[col].astype(str).isin(sel)]
+            extra = {k: (d[d[col].astype(str).isin(sel)] if d is not None and col in d.columns else None) for k, d in extra.items()}
+    return df, filtered_df, "created_at", extra
+
 # --- MAIN ---
 def render_statistics():
     st.markdown("""<style>[data-testid="stSidebar"] { display: block !important; border-right: 1px solid #f0f0f0; } .block-container { padding-top: 1rem !important; } hr { margin: 0.5rem 0; }</style>""", unsafe_allow_html=True)
@@ -230,101 +371,55 @@ def render_statistics():
             return
 
         sel_agenda = st.selectbox("Agenda:", options, key="agenda_select", label_visibility="collapsed")
+        # ZMĚNA: Tickety lze počítat ze souhrnných tabulek (bez načítání všech řádků)
+        use_rollup = False
+        if sel_agenda == "Tickety" and rollups_available(get_db_connection()):
+            use_rollup = st.toggle("⚡ Rychlý přehled ze souhrnů", value=False, key="tg_rollup",
+                                   help="Grafy a počty z denních souhrnů – okamžitě i pro roky dat. Detailní tabulku, export XLSX, hledání ID, filtr statusů, VIP a mediány odezvy nabízí jen režim detailních dat.")
         
         st.markdown("### 👁️ Zobrazení")
         show_metrics = st.checkbox("Metriky a Export", value=True)
         show_graph = st.checkbox("Grafy", value=True)
-        show_table = st.checkbox("Tabulka", value=True)
+        # ZMĚNA: Detailní režim může filtrovat a počítat přes DuckDB (jen malé výsledky zpět do Pythonu)
+        use_duckdb = False
+        if sel_agenda == "Tickety" and not use_rollup and analytics.is_available():
+            use_duckdb = st.toggle("🦆 Výpočty v DuckDB", value=True, key="tg_duckdb",
+                                   help=f"Filtry, grafy a mediány počítá SQL nad sloupcovou kopií ticketů. Tabulka zobrazí prvních {STATS_TABLE_ROWS} vyfiltrovaných ticketů, export obsahuje všechny.")
+        show_table = st.checkbox("Tabulka", value=True, disabled=use_rollup) and not use_rollup
         st.divider()
         if st.button("🔄 Vyčistit filtry", use_container_width=True): reset_filters(); st.rerun()
         st.markdown("### 🔍 Filtry")
-        df = load_data_from_db(sel_agenda)
-        if df.empty: st.warning("Žádná data."); return
-        
-        if sel_agenda == "Tickety" and "created_date" in df.columns:
-            temp_date = pd.to_datetime(df["created_date"], errors='coerce')
-            days_cz = {0: '1_Pondělí', 1: '2_Úterý', 2: '3_Středa', 3: '4_Čtvrtek', 4: '5_Pátek', 5: '6_Sobota', 6: '7_Neděle'}
-            idx_date = df.columns.get_loc("created_date")
-            df.insert(idx_date + 1, "created_day", temp_date.dt.dayofweek.map(days_cz))
-            df.insert(idx_date + 2, "created_week", temp_date.dt.isocalendar().week.astype('Int64'))
-            
-            if "created_time" in df.columns:
-                temp_time = pd.to_datetime(df["created_time"], format='%H:%M:%S', errors='coerce')
-                hour_labels = temp_time.dt.hour.apply(lambda h: f"{int(h):02d}:00 - {int(h)+1:02d}:00" if pd.notna(h) else None)
-                df.insert(idx_date + 3, "created_hour", hour_labels)
-
-        filtered_df = df.copy()
-
-        if sel_agenda == "Tickety" and "ticket_id" in filtered_df.columns:
-            search_ticket_id = st.text_input("🔍 Vyhledat ID ticketu:", key="search_ticket_id", help="Vyhledá konkrétní ticket podle jeho ID v databázi.")
-            if search_ticket_id:
-                filtered_df = filtered_df[filtered_df["ticket_id"].astype(str).str.contains(search_ticket_id.strip(), na=False)]
-
-        date_cols = [c for c in df.columns if any(x in str(c).lower() for x in ["datum", "date", "vytvořeno", "created", "time"])]
-        active_date_col = None
-        if date_cols:
-            active_date_col = st.selectbox("Dle data:", date_cols, index=0, key="date_col_select")
-            filtered_df[active_date_col] = pd.to_datetime(filtered_df[active_date_col], errors='coerce').dt.date
-            
-            valid_dates = filtered_df[active_date_col].dropna()
-            if not valid_dates.empty:
-                mn, mx = valid_dates.min(), valid_dates.max()
-                if mn < mx:
-                    default_start = max(mn, mx - datetime.timedelta(days=30))
-                    d_range = st.slider("", min_value=mn, max_value=mx, value=(default_start, mx), format="DD.MM", key="slider_date")
-                    s_date = d_range[0]
-                    e_date = d_range[1] + datetime.timedelta(days=1)
-                    filtered_df = filtered_df[(filtered_df[active_date_col] >= s_date) & (filtered_df[active_date_col] < e_date)]
-                else:
-                    st.caption(f"Pouze jeden den: {mn}")
-            else:
-                st.caption("Sloupec neobsahuje platná data.")
+        if use_rollup: loaded = apply_rollup_filters()
+        elif use_duckdb: loaded = apply_duckdb_filters()
+        else: loaded = apply_detail_filters(sel_agenda)
+        if loaded is None: return
+        df, filtered_df, active_date_col, rollup_extra = loaded
+    query = rollup_extra["query"] if use_duckdb else None
 
-        filter_cols = []
-        if sel_agenda == "Tickety": filter_cols = ["created_day", "created_week", "category_id", "priority", "user_id", "status_id"]
-        elif sel_agenda == "Aktivity": filter_cols = ["type", "direction", "sender"]
-        elif sel_agenda == "Zásilky": filter_cols = ["carrier", "status"]
-        else:
-            for c in filtered_df.columns:
-                if filtered_df[c].dtype == 'object' and filtered_df[c].nunique() < 50: filter_cols.append(c)
-
-        for col in filter_cols:
-            if col in filtered_df.columns:
-                if col == "status_id":
-                    opts = sorted(filtered_df[col].dropna().astype(str).str.split(', ').explode().unique())
-                    if opts:
-                        sel = st.multiselect(col, opts, key=f"filter_{col}")
-                        if sel:
-                            filtered_df = filtered_df[filtered_df[col].astype(str).apply(lambda x: any(item in sel for item in x.split(', ')))]
-                else:
-                    opts = sorted(filtered_df[col].dropna().astype(str).unique())
-                    if opts:
-                        display_opts = [o.split('_')[1] if col == 'created_day' and '_' in o else o for o in opts]
-                        sel = st.multiselect(col, opts, format_func=lambda x: x.split('_')[1] if col == 'created_day' and '_' in x else x, key=f"filter_{col}")
-                        if sel: filtered_df = filtered_df[filtered_df[col].astype(str).isin(sel)]
-
-        if sel_agenda == "Tickety":
-            if "vip" in filtered_df.columns:
-                if st.checkbox("⭐ Pouze VIP klienti", key="check_vip", help="Zobrazí pouze tickety označené VIP."):
-                    filtered_df = filtered_df[filtered_df["vip"].astype(str) == '1']
-            has_dev = any(x in filtered_df.columns for x in ["dev_task1", "dev_task2"])
-            if has_dev:
-                if st.checkbox("🛠️ Pouze s vazbou na vývoj", key="check_dev", help="Tickety s vazbou na BO, HL, TZ, NL ad."):
-                    cond = pd.Series(False, index=filtered_df.index)
-                    for c in ["dev_task1", "dev_task2"]:
-                        if c in filtered_df.columns: cond |= filtered_df[c].notna() & (filtered_df[c] != "")
-                    filtered_df = filtered_df[cond]
+    def counts(col, as_date=False):
+        # Počty pro grafy: v režimu DuckDB dotazem nad všemi vyfiltrovanými tickety
+        return query.count_by(col, as_date) if query is not None else count_values(filtered_df, col)
 
     with c_tit: 
         st.markdown(f"<h1 style='text-align: center; margin: 0; padding-bottom: 2rem;'>{sel_agenda}</h1>", unsafe_allow_html=True)
         placeholder_export = st.empty()
     
     # --- METRIKY & EXPORT ---
-    kpis = calculate_kpis(filtered_df)
+    if use_rollup:
+        n = int(filtered_df["_n"].sum())
+        kpis = {"row_count": n, "avg_activities": round(filtered_df["_activities"].sum() / n, 1) if n else 0, "avg_response_time": None, "avg_client_response": None}
+    elif query is not None:
+        k = query.kpis()
+        kpis = {"row_count": k["row_count"], "avg_activities": round(k["avg_activities"], 1) if k["avg_activities"] is not None else 0,
+                "avg_response_time": format_human_time(k["response_seconds"]) if k["response_seconds"] is not None else None,
+                "avg_client_response": format_human_time(k["client_seconds"]) if k["client_seconds"] is not None else None}
+    else:
+        # ZMĚNA: KPI z původních řádků – filtr data zkracuje zvolený sloupec *_at na datum
+        kpis = calculate_kpis(df.loc[filtered_df.index])
     
     date_range_str = "N/A"
     if active_date_col and not filtered_df.empty:
-        df_min, df_max = filtered_df[active_date_col].min(), filtered_df[active_date_col].max()
+        df_min, df_max = query.date_bounds(active_date_col) if query is not None else (filtered_df[active_date_col].min(), filtered_df[active_date_col].max())
         if pd.notna(df_min) and pd.notna(df_max):
             date_range_str = f"{df_min.strftime('%d.%m.%Y')} - {df_max.strftime('%d.%m.%Y')}"
             
@@ -344,13 +439,13 @@ def render_statistics():
     # --- GRAFY S VYUŽITÍM ZÁLOŽEK ---
     if show_graph and not filtered_df.empty and sel_agenda == "Tickety" and active_date_col:
         st.markdown("### 📈 Grafický přehled")
-        total_rows = len(filtered_df)
+        total_rows = int(filtered_df["_n"].sum()) if use_rollup else (kpis["row_count"] if query is not None else len(filtered_df))
         
         tab_time, tab_cat, tab_detail, tab_clients = st.tabs(["📅 Vývoj v čase", "📊 Kategorie a Statusy", "⏰ Časové rozložení", "👥 Klienti"])
         
         with tab_time:
-            chart_df = filtered_df.copy()
-            daily = chart_df.groupby(active_date_col).size().reset_index(name='Počet')
+            daily = counts(active_date_col, as_date=True)
+            daily.columns = [active_date_col, 'Počet']
             export_chart = alt.Chart(daily).mark_line(point=True).encode(
                 x=alt.X(f'{active_date_col}:T', title='Datum'),
                 y=alt.Y('Počet:Q', title='Počet'),
@@ -363,7 +458,7 @@ def render_statistics():
             g1, g2 = st.columns(2)
             with g1:
                 if "category_id" in filtered_df.columns:
-                    cat_counts = filtered_df["category_id"].value_counts().reset_index()
+                    cat_counts = counts("category_id")
                     cat_counts.columns = ["Kategorie", "Počet"]
                     cat_counts["Podíl"] = (cat_counts["Počet"] / total_rows * 100).round(1).astype(str) + " %"
                     c_cat = alt.Chart(cat_counts).mark_arc(innerRadius=60).encode(
@@ -374,9 +469,8 @@ def render_statistics():
                     st.altair_chart(c_cat, use_container_width=True)
                     collected_charts.append(c_cat) 
                     
-                if "status_id" in filtered_df.columns:
-                    stat_series = filtered_df["status_id"].dropna().astype(str).str.split(', ').explode()
-                    stat_counts = stat_series.value_counts().reset_index()
+                if "status_id" in filtered_df.columns and rollup_extra:
+                    stat_counts = count_values(rollup_extra["status"], "status_id")
                     stat_counts.columns = ["Statusy", "Počet"]
                     stat_counts["Podíl"] = (stat_counts["Počet"] / total_rows * 100).round(1).astype(str) + " %"
                     c_stat = alt.Chart(stat_counts).mark_bar().encode(
@@ -390,7 +484,7 @@ def render_statistics():
                     
             with g2:
                 if "priority" in filtered_df.columns:
-                    prio_counts = filtered_df["priority"].value_counts().reset_index()
+                    prio_counts = counts("priority")
                     prio_counts.columns = ["Priorita", "Počet"]
                     prio_counts["Podíl"] = (prio_counts["Počet"] / total_rows * 100).round(1).astype(str) + " %"
                     c_prio = alt.Chart(prio_counts).mark_arc().encode(
@@ -402,7 +496,7 @@ def render_statistics():
                     collected_charts.append(c_prio) 
                     
                 if "user_id" in filtered_df.columns:
-                    user_counts_full = filtered_df["user_id"].value_counts().reset_index()
+                    user_counts_full = counts("user_id")
                     user_counts_full.columns = ["Uživatel", "Počet"]
                     user_counts_full["Podíl celkem"] = (user_counts_full["Počet"] / total_rows * 100).round(1).astype(str) + " %"
                     user_counts_top10 = user_counts_full.head(10)
@@ -420,7 +514,7 @@ def render_statistics():
             d1, d2 = st.columns(2)
             with d1:
                 if "created_day" in filtered_df.columns:
-                    day_counts = filtered_df["created_day"].dropna().value_counts().reset_index()
+                    day_counts = counts("created_day")
                     day_counts.columns = ["Den", "Počet"]
                     day_counts = day_counts.sort_values(by="Den")
                     day_counts["Den zobrazení"] = day_counts["Den"].apply(lambda x: x.split('_')[1] if '_' in x else x)
@@ -436,8 +530,11 @@ def render_statistics():
                     collected_charts.append(c_day) 
             
             with d2:
-                if "created_hour" in filtered_df.columns:
-                    hour_counts = filtered_df["created_hour"].dropna().value_counts().reset_index()
+                hour_src = rollup_extra["hour"] if use_rollup else filtered_df
+                if hour_src is None:
+                    st.caption("Rozložení dle hodin je v rychlém přehledu jen s filtrem data, dne, týdne a kategorie.")
+                elif "created_hour" in hour_src.columns:
+                    hour_counts = counts("created_hour") if query is not None else count_values(hour_src, "created_hour")
                     hour_counts.columns = ["Hodina", "Počet"]
                     hour_counts = hour_counts.sort_values(by="Hodina")
                     hour_counts["Podíl"] = (hour_counts["Počet"] / total_rows * 100).round(1).astype(str) + " %"
@@ -456,9 +553,11 @@ def render_statistics():
             client_col = "account_title" if "account_title" in filtered_df.columns else "_client_title"
             if client_col in filtered_df.columns:
                 # Očištění dat o prázdné a nechtěné hodnoty
-                df_clients = filtered_df[~filtered_df[client_col].astype(str).str.strip().isin(["Klient", "Balíkobot s.r.o.", "Balikobot s.r.o.", "None", "nan"])]
-                
-                client_counts = df_clients[client_col].value_counts().reset_index()
+                excluded = ["Klient", "Balíkobot s.r.o.", "Balikobot s.r.o.", "None", "nan"]
+                if query is not None: client_counts = query.count_clients(client_col, excluded)
+                else:
+                    df_clients = filtered_df[~filtered_df[client_col].astype(str).str.strip().isin(excluded)]
+                    client_counts = df_clients[client_col].value_counts().reset_index()
                 client_counts.columns = ["Klient", "Počet"]
                 client_counts_top10 = client_counts.head(10)
                 
@@ -473,8 +572,12 @@ def render_statistics():
 
         st.divider()
 
-    if sel_agenda == "Tickety" and not filtered_df.empty and placeholder_export is not None:
-        xlsx = generate_excel_report(filtered_df, kpis, collected_charts, sel_agenda, date_range_str)
+    # ZMĚNA: Souhrny nejsou seznam ticketů – export XLSX jen z detailních dat
+    if use_rollup: placeholder_export.caption("Export XLSX je dostupný v režimu detailních dat.")
+    elif sel_agenda == "Tickety" and not filtered_df.empty and placeholder_export is not None:
+        # ZMĚNA: V režimu DuckDB obsahuje export všechny vyfiltrované tickety, ne jen řádky tabulky
+        export_df = query.rows() if query is not None else filtered_df
+        xlsx = generate_excel_report(export_df, kpis, collected_charts, sel_agenda, date_range_str)
         placeholder_export.download_button("📥 Export XLSX", xlsx, f"Report_{sel_agenda}.xlsx", "application/vnd.ms-excel", use_container_width=True)
 
     # --- TABULKA DAT ---
@@ -485,4 +588,6 @@ def render_statistics():
         if "created_day" in display_df.columns:
             display_df["created_day"] = display_df["created_day"].apply(lambda x: str(x).split('_')[1] if pd.notna(x) and '_' in str(x) else x)
             
-        st.dataframe(display_df, use_container_width=True, height=500)
\ No newline at end of file
+        st.dataframe(display_df, use_container_width=True, height=500)
+        if query is not None and kpis["row_count"] > len(display_df):
+            st.caption(f"Zobrazeno prvních {len(display_df)} z {kpis['row_count']} ticketů (podle ID); grafy a metriky počítají se všemi.")
\ No newline at end of file
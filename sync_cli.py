@@ -0,0 +1,131 @@
+"""
+Synchronizace Daktela -> SQLite z příkazové řádky (např. z cronu).
+
+Příklady:
+    python sync_cli.py --since-last
+    python sync_cli.py --from 2024-01-01 --to 2024-01-31 --category "Reklamace" --workers 8
+    python sync_cli.py --resume
+
+Přístup k API: --url/--token, jinak proměnné prostředí DAKTELA_URL / DAKTELA_TOKEN,
+jinak .streamlit/secrets.toml. Průběh se vypisuje jako JSON řádky na stdout.
+Návratový kód: 0 = OK, 1 = chyba, 130 = přerušeno (běh lze navázat přes --resume).
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import date
+
+# Cesty k datům (data/...) jsou relativní ke kořeni aplikace
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE_DIR)
+sys.path.insert(0, BASE_DIR)
+
+from config import SYNC_MAX_WORKERS, SYNC_MAX_RPS, SYNC_BULK_TICKETS, SYNC_WRITE_BATCH, API_PAGE_WORKERS
+from utils.codebooks import get_codebook
+from utils.daktela_client import get_client
+from utils.db_sync import init_db, run_sync, get_resumable_run, SyncCancelled
+
+def load_credentials(args):
+    url, token = args.url or os.environ.get("DAKTELA_URL"), args.token or os.environ.get("DAKTELA_TOKEN")
+    if url and token: return url, token
+    try:
+        import tomllib
+        with open(os.path.join(".streamlit", "secrets.toml"), "rb") as f: secrets = tomllib.load(f)
+        return url or secrets.get("DAKTELA_URL"), token or secrets.get("DAKTELA_TOKEN")
+    except (ImportError, OSError, ValueError):
+        return url, token
+
+def emit(event, **data):
+    print(json.dumps({"event": event, "ts": time.strftime("%Y-%m-%d %H:%M:%S"), **data}, ensure_ascii=False, default=str), flush=True)
+
+def resolve_categories(client, values):
+    """Kategorie lze zadat názvem i Daktela ID; vrací (ID, názvy)."""
+    items = get_codebook(client, "categories")
+    by_title = {c["title"]: c["name"] for c in items}
+    by_name = {c["name"]: c["title"] for c in items}
+    ids, titles = [], []
+    for v in values:
+        if v in by_title: ids.append(by_title[v]); titles.append(v)
+        elif v in by_name: ids.append(v); titles.append(by_name[v])
+        else: raise ValueError(f"Neznámá kategorie: {v}")
+    return ids, titles
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Synchronizace tiketů a aktivit z Daktely do lokální SQLite databáze.")
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument("--since-last", action="store_true", help="jen změny od posledního dokončeného běhu (značka 'edited')")
+    mode.add_argument("--resume", nargs="?", const="latest", metavar="RUN_ID", help="navázat na přerušený běh (bez čísla = poslední)")
+    p.add_argument("--from", dest="d_from", type=date.fromisoformat, default=date.today(), help="datum od (edited), YYYY-MM-DD")
+    p.add_argument("--to", dest="d_to", type=date.fromisoformat, default=date.today(), help="datum do (edited), YYYY-MM-DD")
+    p.add_argument("--category", action="append", default=[], help="název nebo ID kategorie (lze opakovat)")
+    p.add_argument("--workers", type=int, default=SYNC_MAX_WORKERS, help="souběžná stahování aktivit")
+    p.add_argument("--rps", type=int, default=SYNC_MAX_RPS, help="max. požadavků za sekundu")
+    p.add_argument("--page-workers", type=int, default=API_PAGE_WORKERS, help="souběžné stránky seznamu ticketů")
+    p.add_argument("--bulk-size", type=int, default=SYNC_BULK_TICKETS, help="ticketů na hromadný dotaz na aktivity (0 = po jednom)")
+    p.add_argument("--write-batch", type=int, default=SYNC_WRITE_BATCH, help="řádků v jedné dávce zápisu do SQLite")
+    p.add_argument("--progress-interval", type=float, default=5.0, help="jak často vypisovat průběh (s)")
+    p.add_argument("--url", help="URL instance Daktela")
+    p.add_argument("--token", help="přístupový token Daktela")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    url, token = load_credentials(args)
+    if not url or not token:
+        emit("error", message="Chybí DAKTELA_URL / DAKTELA_TOKEN."); return 1
+
+    client = get_client(url, token)
+    cancel_event = threading.Event()
+    # Ctrl+C / SIGTERM: dokončí rozpracovaný ticket, uloží checkpoint a skončí
+    for sig in (signal.SIGINT, signal.SIGTERM): signal.signal(sig, lambda *_: cancel_event.set())
+
+    try:
+        # Migrace schématu ještě před čtením rozpracovaných běhů (--resume)
+        init_db()
+        params = {"max_workers": args.workers, "max_rps": args.rps, "page_workers": args.page_workers, "bulk_size": args.bulk_size,
+                  "write_batch": args.write_batch}
+        if args.resume:
+            run = get_resumable_run()
+            run_id = run["run_id"] if args.resume == "latest" and run else (int(args.resume) if args.resume != "latest" else None)
+            if not run_id: emit("done", message="Žádný přerušený běh k navázání."); return 0
+            params.update(mode="resume", resume_run_id=run_id)
+        elif args.since_last:
+            params.update(mode="since")
+        else:
+            if args.d_from > args.d_to: raise ValueError("--from je později než --to")
+            cat_ids, cat_titles = resolve_categories(client, args.category) if args.category else ([], [])
+            params.update(mode="range", d_from=args.d_from, d_to=args.d_to, category_ids=cat_ids, category_titles=cat_titles)
+    except Exception as e:
+        emit("error", message=str(e)); return 1
+
+    start_stats = client.stats_snapshot()
+    started = time.time()
+    last = {"phase": None, "at": 0.0}
+
+    def on_progress(phase, **data):
+        now = time.time()
+        if phase == last["phase"] and now - last["at"] < args.progress_interval: return
+        last.update(phase=phase, at=now)
+        if phase != "done": emit("progress", phase=phase, elapsed=round(now - started, 1), **data)
+
+    def transfer():
+        stats = client.stats_snapshot()
+        return {k: stats[k] - start_stats[k] for k in ("requests", "wire_bytes", "json_bytes")}
+
+    emit("start", mode=params["mode"], **{k: v for k, v in params.items() if k != "mode"})
+    try:
+        summary = run_sync(client, progress=on_progress, cancel_event=cancel_event, **params)
+    except SyncCancelled:
+        emit("cancelled", elapsed=round(time.time() - started, 1), **transfer()); return 130
+    except Exception as e:
+        emit("error", message=str(e), elapsed=round(time.time() - started, 1), **transfer()); return 1
+    summary["duration"] = round(summary["duration"], 1)
+    emit("done", **summary, **transfer())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Volitelný analytický engine (DuckDB) pro statistiky ticketů.
+
+Tickety se jednou načtou do sloupcové tabulky DuckDB v paměti (přes utils.snapshots –
+Arrow snapshot, případně čtecí spojení SQLite) a znovu až po změně dat (data_signature).
+Filtry postranního panelu, počty pro grafy a mediány KPI se pak počítají SQL dotazy
+a do Pythonu se vrací jen malé výsledky. Bez balíčku duckdb se engine nepoužije
+(statistiky počítají v pandas).
+
+Sloupce tabulky odpovídají detailním datům statistik: ID číselníků jsou nahrazená
+názvy (status_id = všechny statusy ticketu), za created_at následují created_day,
+created_week a created_hour.
+"""
+import threading
+import pandas as pd
+from utils import snapshots
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+DISPLAY_COLUMNS = {"category_id": "_cat_title", "user_id": "_user_title", "status_id": "status_titles",
+                   "client_id": "_client_title", "contact_id": "_contact_title"}
+HELPER_COLUMNS = {"_cat_title", "_user_title", "_status_title", "_client_title", "_contact_title", "status_titles"}
+
+_lock = threading.Lock()
+_state = {"con": None, "signature": None}
+
+def is_available():
+    return duckdb is not None
+
+def _q(col):
+    return '"' + col.replace('"', '""') + '"'
+
+def _ticket_select(columns, day_labels):
+    """SELECT pro tabulku tickets v DuckDB (názvy místo ID, odvozené sloupce dne/týdne/hodiny)."""
+    days = "[" + ", ".join("'" + day_labels[i] + "'" for i in range(7)) + "]"
+    parts = []
+    for col in columns:
+        if col in HELPER_COLUMNS: continue
+        if col in DISPLAY_COLUMNS and DISPLAY_COLUMNS[col] in columns:
+            parts.append(f"COALESCE({_q(DISPLAY_COLUMNS[col])}, CAST({_q(col)} AS VARCHAR)) AS {_q(col)}")
+        else: parts.append(_q(col))
+        if col == "created_at":
+            parts.append(f"list_extract({days}, isodow(created_at)) AS created_day")
+            parts.append("CAST(week(created_at) AS BIGINT) AS created_week")
+            parts.append("lpad(CAST(hour(created_at) AS VARCHAR), 2, '0') || ':00 - ' || lpad(CAST(hour(created_at) + 1 AS VARCHAR), 2, '0') || ':00' AS created_hour")
+    return "SELECT " + ", ".join(parts) + " FROM src"
+
+def _refresh(conn, day_labels):
+    """Načte tickety a jejich statusy do DuckDB, pokud se od posledního načtení změnila data."""
+    signature = snapshots.data_signature(conn)
+    if _state["con"] is not None and _state["signature"] == signature: return _state["con"]
+    con = _state["con"] or duckdb.connect(":memory:")
+    src = snapshots.load_table("tickets", conn)
+    con.register("src", src)
+    con.execute("CREATE OR REPLACE TABLE tickets AS " + _ticket_select(list(src.columns), day_labels))
+    con.unregister("src")
+    pairs = pd.read_sql_query('''SELECT ts.ticket_id, st.title AS status
+                                 FROM ticket_statuses ts JOIN statuses st ON st.status_id = ts.status_id''', conn)
+    con.register("src_pairs", pairs)
+    con.execute("CREATE OR REPLACE TABLE ticket_statuses AS SELECT * FROM src_pairs")
+    con.unregister("src_pairs")
+    _state.update(con=con, signature=signature)
+    return con
+
+def ticket_query(conn, day_labels):
+    """Dotaz nad všemi tickety (TicketQuery); None, pokud DuckDB není k dispozici nebo chybí data."""
+    if duckdb is None or conn is None: return None
+    with _lock:
+        con = _refresh(conn, day_labels)
+        cursor = con.cursor()  # každé vlákno (rerun Streamlitu) vlastní kurzor
+    return TicketQuery(cursor)
+
+class TicketQuery:
+    """
+    Vyfiltrovaná množina ticketů. filter() vrací nový dotaz s další podmínkou,
+    ostatní metody vracejí malé výsledky (počty, mediány, rozsahy).
+    """
+    def __init__(self, cursor, where=(), params=()):
+        self.cursor = cursor
+        self.where, self.params = tuple(where), tuple(params)
+
+    def filter(self, condition, *params):
+        return TicketQuery(self.cursor, self.where + (condition,), self.params + params)
+
+    def isin(self, col, values):
+        """Hodnota sloupce (jako text) je mezi values."""
+        return self.filter(f"CAST({_q(col)} AS VARCHAR) IN ({', '.join('?' * len(values))})", *values)
+
+    def between_dates(self, col, date_from, date_to):
+        return self.filter(f"CAST({_q(col)} AS DATE) BETWEEN ? AND ?", date_from, date_to)
+
+    def with_statuses(self, statuses):
+        """Ticket má aspoň jeden ze statusů."""
+        return self.filter(f"ticket_id IN (SELECT ticket_id FROM ticket_statuses WHERE status IN ({', '.join('?' * len(statuses))}))", *statuses)
+
+    def any_filled(self, cols):
+        """Aspoň jeden ze sloupců je vyplněný (neprázdný text)."""
+        return self.filter(" OR ".join(f"({_q(c)} IS NOT NULL AND CAST({_q(c)} AS VARCHAR) <> '')" for c in cols))
+
+    def _from(self, *extra):
+        where = self.where + extra
+        return "FROM tickets" + (" WHERE " + " AND ".join(f"({w})" for w in where) if where else "")
+
+    def _df(self, sql, params=()):
+        return self.cursor.execute(sql, list(self.params) + list(params)).df()
+
+    def columns(self):
+        return self.cursor.execute("SELECT * FROM tickets LIMIT 0").df().columns.tolist()
+
+    def timestamp_columns(self):
+        rows = self.cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'tickets' AND data_type LIKE 'TIMESTAMP%' ORDER BY ordinal_position").fetchall()
+        return [r[0] for r in rows]
+
+    def count(self):
+        return self.cursor.execute(f"SELECT COUNT(*) {self._from()}", list(self.params)).fetchone()[0]
+
+    def date_bounds(self, col):
+        return self.cursor.execute(f"SELECT MIN(CAST({_q(col)} AS DATE)), MAX(CAST({_q(col)} AS DATE)) {self._from()}", list(self.params)).fetchone()
+
+    def options(self, col):
+        """Seřazené hodnoty sloupce (jako text) ve vyfiltrovaných ticketech."""
+        return self._df(f"SELECT DISTINCT CAST({_q(col)} AS VARCHAR) AS v {self._from(f'{_q(col)} IS NOT NULL')} ORDER BY v")["v"].tolist()
+
+    def status_options(self):
+        return self._df(f"SELECT DISTINCT s.status FROM ticket_statuses s WHERE s.ticket_id IN (SELECT ticket_id {self._from()}) ORDER BY 1")["status"].tolist()
+
+    def count_by(self, col, as_date=False):
+        """Počty [hodnota, _n] seřazené sestupně (jako count_values)."""
+        expr = f"CAST({_q(col)} AS DATE)" if as_date else _q(col)
+        return self._df(f"SELECT {expr} AS {_q(col)}, COUNT(*) AS _n {self._from(f'{expr} IS NOT NULL')} GROUP BY 1 ORDER BY 2 DESC, 1")
+
+    def count_statuses(self):
+        return self._df(f"SELECT s.status AS status_id, COUNT(*) AS _n FROM ticket_statuses s WHERE s.ticket_id IN (SELECT ticket_id {self._from()}) GROUP BY 1 ORDER BY 2 DESC, 1")
+
+    def count_clients(self, col, excluded):
+        cond = f"{_q(col)} IS NOT NULL AND trim(CAST({_q(col)} AS VARCHAR)) NOT IN ({', '.join('?' * len(excluded))})"
+        return self._df(f"SELECT {_q(col)}, COUNT(*) AS _n {self._from(cond)} GROUP BY 1 ORDER BY 2 DESC, 1", excluded)
+
+    def kpis(self):
+        """
+        Počet ticketů, průměr aktivit a mediány odezvy v sekundách: první odpověď v pracovní době
+        (Po–Pá 8–18, stejně jako calc_biz_sec) a odezva klienta (last_activity_op_at -> last_activity_cl_at).
+        """
+        cols = set(self.columns())
+        n, avg_act = self.cursor.execute(f"SELECT COUNT(*), AVG(activity_count) {self._from()}" if "activity_count" in cols
+                                         else f"SELECT COUNT(*), NULL {self._from()}", list(self.params)).fetchone()
+        stats = {"row_count": n, "avg_activities": avg_act, "response_seconds": None, "client_seconds": None}
+        if {"created_at", "first_answer_at"} <= cols:
+            stats["response_seconds"] = self.cursor.execute(f'''
+                WITH f AS (SELECT ticket_id, created_at AS s, first_answer_at AS e {self._from()}),
+                     days AS (SELECT ticket_id, s, e, unnest(generate_series(date_trunc('day', s), date_trunc('day', e), INTERVAL 1 DAY)) AS d
+                              FROM f WHERE s < e)
+                SELECT median(biz) FROM (
+                    SELECT ticket_id, SUM(CASE WHEN isodow(d) <= 5 THEN greatest(0, epoch(least(e, d + INTERVAL 18 HOUR)) - epoch(greatest(s, d + INTERVAL 8 HOUR))) ELSE 0 END) AS biz
+                    FROM days GROUP BY ticket_id)''', list(self.params)).fetchone()[0]
+        if {"last_activity_op_at", "last_activity_cl_at"} <= cols:
+            stats["client_seconds"] = self.cursor.execute(f'''
+                SELECT median(diff) FROM (SELECT epoch(last_activity_cl_at) - epoch(last_activity_op_at) AS diff {self._from()}) WHERE diff > 0''',
+                list(self.params)).fetchone()[0]
+        return stats
+
+    def rows(self, limit=None):
+        """Detailní řádky podle ID – prvních limit ticketů pro tabulku, bez limitu všechny (export)."""
+        return self._df(f"SELECT * {self._from()} ORDER BY ticket_id" + (f" LIMIT {int(limit)}" if limit is not None else ""))
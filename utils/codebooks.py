@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import time
+from config import CODEBOOK_TTL
+
+# --- SDÍLENÁ CACHE ČÍSELNÍKŮ ---
+# Jedna cache pro celý proces (všechny stránky i session), se zálohou na disku.
+# Každý číselník má jednotný tvar: seznam {"name": <Daktela ID>, "title": <název>} seřazený dle názvu.
+
+CODEBOOK_ENDPOINTS = {
+    "categories": "ticketsCategories.json",
+    "statuses": "statuses.json",
+    "queues": "queues.json",
+    "users": "users.json",
+}
+CACHE_FILE = os.path.join("data", "codebooks.json")
+
+_cache = {}         # {název číselníku: (čas stažení, položky)}
+_lock = threading.Lock()    # paměť a soubor na disku (jen krátké operace, nikdy ne dotaz na API)
+_fetch_locks = {}   # {název číselníku: zámek} – jeden číselník stahuje z API nejvýš jedno vlákno
+
+def _load_disk():
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_disk(entries):
+    """Zapíše {název: (čas, položky)} na disk; ostatní číselníky v souboru zůstanou jako záloha."""
+    try:
+        data = _load_disk()
+        data.update({k: {"fetched_at": ts, "items": items} for k, (ts, items) in entries.items()})
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_file = CACHE_FILE + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, CACHE_FILE)
+    except Exception:
+        pass
+
+def _normalize(data):
+    items = [{"name": str(d["name"]), "title": d.get("title") or ""} for d in data if d.get("name") is not None]
+    return sorted(items, key=lambda x: x["title"].lower())
+
+def _lookup(name, ttl):
+    """(platné položky nebo None, záloha pro případ nedostupného API) z paměti a disku."""
+    with _lock:
+        now = time.time()
+        if name in _cache and now - _cache[name][0] < ttl:
+            return _cache[name][1], None
+        disk = _load_disk().get(name)
+        if disk and now - disk.get("fetched_at", 0) < ttl:
+            _cache[name] = (disk["fetched_at"], disk["items"])
+            return disk["items"], None
+        if name in _cache: return None, _cache[name][1]
+        return None, disk["items"] if disk else []
+
+def get_codebook(client, name, ttl=CODEBOOK_TTL):
+    """
+    Vrátí číselník 'name' (categories/statuses/queues/users).
+    Pořadí zdrojů: paměť (platná) -> disk (platný) -> API -> neplatná paměť/disk jako záloha.
+    Dotaz na API běží mimo společný zámek, ostatní číselníky na něj nečekají.
+    """
+    items, fallback = _lookup(name, ttl)
+    if items is not None: return items
+    with _lock: fetch_lock = _fetch_locks.setdefault(name, threading.Lock())
+    with fetch_lock:
+        # Mezitím ho mohlo stáhnout jiné vlákno
+        items, fallback = _lookup(name, ttl)
+        if items is not None: return items
+        try:
+            items = _normalize(client.get_data(CODEBOOK_ENDPOINTS[name]))
+        except Exception:
+            return fallback
+        with _lock:
+            _cache[name] = (time.time(), items)
+            _save_disk({name: _cache[name]})
+        return items
+
+def codebook_map(client, name, ttl=CODEBOOK_TTL):
+    """{název: Daktela ID} pro selectboxy a filtry."""
+    return {item["title"]: item["name"] for item in get_codebook(client, name, ttl) if item["title"]}
+
+def refresh_codebooks():
+    """Ruční obnovení: zneplatní paměť i disk (obsah zůstane jako záloha), další volání stáhne číselníky z API."""
+    with _lock:
+        stale = {k: (0, v["items"]) for k, v in _load_disk().items()}
+        stale.update({k: (0, v[1]) for k, v in _cache.items()})
+        _cache.clear(); _cache.update(stale)
+        _save_disk(stale)
@@ -0,0 +1,221 @@
+"""
+Komprimované a deduplikované úložiště obsahu aktivit (activities.content_z, viz migrace 6).
+
+Text e-mailu se dělí na vlastní zprávu a citovanou historii (za prvním řádkem podle
+HISTORY_PATTERNS). Historie od CONTENT_BLOCK_MIN_CHARS znaků se ukládá jednou jako blok
+v content_blocks pod hashem svého textu (blake2b) a aktivita na něj jen odkazuje; blok se
+dělí stejně, takže celé vlákno odpovědí zabere jen vlastní texty zpráv.
+
+Vše se komprimuje zlib (deflate) se sdíleným slovníkem z content_dicts – ten obsahuje
+často opakované řádky (podpisy, patičky, oslovení) a pomáhá hlavně krátkým zprávám.
+Hlavička blobu (1 bajt): bit 7 = obsahuje odkazy na bloky, bity 0–6 = ID slovníku (0 = bez).
+Odkaz v textu je '\\x00<hash>\\x00'; text s nulovým znakem se ukládá bez odkazů.
+
+Čtení je transparentní: funkce content_text(content_z) je registrovaná na každém spojení
+z utils.storage a dočasný pohled activities_text (TEMP, jen v těchto spojeních) vrací sloupec
+content jako dřív. Schéma v souboru databáze na funkcích aplikace nezávisí (migrace 7) –
+jiné nástroje mohou aktivity číst i mazat, jen obsah vidí jako blob content_z.
+"""
+import re
+import zlib
+import hashlib
+from collections import Counter, OrderedDict
+from config import HISTORY_PATTERNS, CONTENT_BLOCK_MIN_CHARS, CONTENT_DICT_SIZE, CONTENT_DICT_MIN_ROWS, CONTENT_CACHE_CHARS
+
+SQL_INSERT_BLOCK = "INSERT OR IGNORE INTO content_blocks (hash, data) VALUES (?, ?)"
+_HISTORY_RE = re.compile("|".join(HISTORY_PATTERNS), re.IGNORECASE)
+_REF_RE = re.compile("\x00([0-9a-f]{32})\x00")
+_REFS_FLAG = 0x80
+_CHUNK = 1000
+SQL_ACTIVITY_CHUNK = "SELECT activity_id, content_z FROM activities WHERE activity_id > ? ORDER BY activity_id LIMIT {limit}"
+SQL_BLOCK_CHUNK = "SELECT hash, data FROM content_blocks WHERE hash > ? ORDER BY hash LIMIT {limit}"
+
+def create_content_tables(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS content_dicts (dict_id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS content_blocks (hash TEXT PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID")
+
+def split_history(text):
+    """(vlastní zpráva včetně řádku s oddělovačem, citovaná historie); bez oddělovače (text, '')."""
+    m = _HISTORY_RE.search(text)
+    end = text.find("\n", m.end()) if m else -1
+    if end < 0: return text, ""
+    return text[:end + 1], text[end + 1:]
+
+def block_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def train_dictionary(texts, size=CONTENT_DICT_SIZE):
+    """
+    Slovník z řádků, které se ve vzorku opakují (počítá se výskyt v různých textech).
+    Nejcennější řádky (výskyt × délka) jsou na konci – deflate k nim má nejkratší vzdálenost.
+    """
+    counts = Counter(line for text in texts if text for line in set(text.splitlines()) if len(line) >= 8)
+    lines = sorted((line for line, n in counts.items() if n >= 2), key=lambda line: counts[line] * len(line), reverse=True)
+    chosen, total = [], 0
+    for line in lines:
+        data = (line + "\n").encode("utf-8")
+        if total + len(data) > size: continue
+        chosen.append(data); total += len(data)
+    return b"".join(reversed(chosen))
+
+class ContentCodec:
+    """Kódování / dekódování obsahu nad jedním spojením (cache slovníků a rozbalených bloků)."""
+    def __init__(self, conn):
+        self.conn = conn
+        self._dicts = {}
+        self._cache, self._cache_chars = OrderedDict(), 0  # LRU rozbalených bloků {hash: text}
+        self.dict_id = self.latest_dict_id()
+
+    def latest_dict_id(self):
+        try: return self.conn.execute("SELECT MAX(dict_id) FROM content_dicts").fetchone()[0] or 0
+        except Exception: return 0  # databáze před migrací 6
+
+    def _zdict(self, dict_id):
+        if dict_id not in self._dicts:
+            self._dicts[dict_id] = self.conn.execute("SELECT data FROM content_dicts WHERE dict_id = ?", (dict_id,)).fetchone()[0]
+        return self._dicts[dict_id]
+
+    def pack(self, payload, refs=False):
+        zdict = self._zdict(self.dict_id) if self.dict_id else None
+        comp = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=zdict) if zdict else zlib.compressobj(9, zlib.DEFLATED, -15)
+        return bytes([self.dict_id | (_REFS_FLAG if refs else 0)]) + comp.compress(payload.encode("utf-8")) + comp.flush()
+
+    def unpack(self, blob):
+        """(text s odkazy, obsahuje odkazy)"""
+        dict_id = blob[0] & ~_REFS_FLAG
+        decomp = zlib.decompressobj(-15, zdict=self._zdict(dict_id)) if dict_id else zlib.decompressobj(-15)
+        return (decomp.decompress(blob[1:]) + decomp.flush()).decode("utf-8"), bool(blob[0] & _REFS_FLAG)
+
+    def encode(self, text, blocks):
+        """
+        Blob pro content_z; nové bloky se přidají do blocks {hash: data} (zapsat SQL_INSERT_BLOCK před aktivitou).
+        Historie se rozkládá smyčkou (ne rekurzí) – dlouhá vlákna odpovědí jsou řetězce stovek bloků.
+        """
+        if text is None: return None
+        result, key = None, None
+        while True:
+            head, tail = split_history(text)
+            h = block_hash(tail) if len(tail) >= CONTENT_BLOCK_MIN_CHARS and "\x00" not in text else None
+            data = self.pack(head + "\x00" + h + "\x00", refs=True) if h else self.pack(text)
+            if key is None: result = data
+            else: blocks[key] = data
+            if h is None or h in blocks or self._stored(h): return result
+            text, key = tail, h
+
+    def _stored(self, h):
+        return self.conn.execute("SELECT 1 FROM content_blocks WHERE hash = ?", (h,)).fetchone() is not None
+
+    def _expand(self, text, refs, resolved):
+        if not refs: return text
+        return _REF_RE.sub(lambda m: resolved[m.group(1)] if m.group(1) in resolved else self._cache[m.group(1)], text)
+
+    def block_text(self, h):
+        """Rozbalený text bloku. Chybějící bloky řetězce se načtou a rozbalí od nejhlubšího (bez rekurze)."""
+        if h in self._cache:
+            self._cache.move_to_end(h)
+            return self._cache[h]
+        raw, resolved, stack = {}, {}, [h]
+        while stack:
+            top = stack[-1]
+            if top not in raw:
+                row = self.conn.execute("SELECT data FROM content_blocks WHERE hash = ?", (top,)).fetchone()
+                if row is None: raise ValueError(f"Chybí blok obsahu {top}")
+                raw[top] = self.unpack(row[0])
+            text, refs = raw[top]
+            missing = [r for r in _REF_RE.findall(text) if r not in resolved and r not in self._cache] if refs else []
+            if missing: stack.extend(missing); continue
+            stack.pop()
+            if top not in resolved: resolved[top] = self._expand(text, refs, resolved)
+        for key, value in resolved.items(): self._remember(key, value)
+        return resolved[h]
+
+    def _remember(self, h, text):
+        self._cache[h] = text
+        self._cache_chars += len(text)
+        while self._cache_chars > CONTENT_CACHE_CHARS and len(self._cache) > 1:
+            self._cache_chars -= len(self._cache.popitem(last=False)[1])
+
+    def decode(self, blob):
+        if blob is None: return None
+        text, refs = self.unpack(blob)
+        return _REF_RE.sub(lambda m: self.block_text(m.group(1)), text) if refs else text
+
+    def refs(self, blob):
+        text, refs = self.unpack(blob)
+        return _REF_RE.findall(text) if refs else []
+
+def register_functions(conn):
+    """SQL funkce content_text(blob) -> text a dočasný pohled activities_text (fulltext, snapshoty, prohlížeč)."""
+    codec = ContentCodec(conn)
+    conn.create_function("content_text", 1, codec.decode, deterministic=True)
+    create_text_view(conn)
+    return conn
+
+def create_text_view(conn):
+    """TEMP pohled activities_text se sloupci activities v původním pořadí (content místo content_z)."""
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(activities)")]
+    conn.execute("DROP VIEW IF EXISTS temp.activities_text")
+    if "content_z" not in columns: return  # databáze před migrací 6
+    # content na původním místě – před created_at, který přidala až migrace 2
+    columns.remove("content_z")
+    columns.insert(columns.index("created_at") if "created_at" in columns else len(columns), "content_text(content_z) AS content")
+    select = ", ".join(columns)
+    conn.execute(f"CREATE TEMP VIEW activities_text AS SELECT {select} FROM main.activities")
+
+def encode_rows(conn, texts):
+    """Zakóduje texty a zapíše jejich bloky; vrací bloby ve stejném pořadí."""
+    codec, blocks = ContentCodec(conn), {}
+    blobs = [codec.encode(text, blocks) for text in texts]
+    conn.executemany(SQL_INSERT_BLOCK, blocks.items())
+    return blobs
+
+def _iter_chunks(conn, query, last):
+    """Řádky (klíč, blob) po dávkách podle klíče – tabulku lze mezi dávkami upravovat."""
+    while True:
+        rows = conn.execute(query.format(limit=_CHUNK), (last,)).fetchall()
+        if not rows: return
+        yield rows
+        last = rows[-1][0]
+
+def store_dictionary(conn, texts):
+    """Natrénuje a uloží nový slovník ze vzorku textů; vrací jeho ID (None = vzorek bez opakování)."""
+    data = train_dictionary(texts)
+    if not data: return None
+    dict_id = conn.execute("INSERT INTO content_dicts (data) VALUES (?)", (data,)).lastrowid
+    if dict_id > 0x7F: raise ValueError("Překročen počet slovníků obsahu (127)")
+    return dict_id
+
+def recompress(conn):
+    """Přebalí aktivity a bloky komprimované jiným než posledním slovníkem (text i odkazy zůstávají)."""
+    codec = ContentCodec(conn)
+    for query, start, update in ((SQL_ACTIVITY_CHUNK, 0, "UPDATE activities SET content_z = ? WHERE activity_id = ?"),
+                                 (SQL_BLOCK_CHUNK, "", "UPDATE content_blocks SET data = ? WHERE hash = ?")):
+        for rows in _iter_chunks(conn, query, start):
+            changed = [(codec.pack(*codec.unpack(blob)), key) for key, blob in rows if blob is not None and blob[0] & ~_REFS_FLAG != codec.dict_id]
+            if changed: conn.executemany(update, changed)
+
+def ensure_dictionary(conn):
+    """Po naplnění nové databáze natrénuje slovník a přebalí dosavadní obsah. Vrací True, pokud vznikl."""
+    if conn.execute("SELECT 1 FROM content_dicts LIMIT 1").fetchone(): return False
+    if conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0] < CONTENT_DICT_MIN_ROWS: return False
+    texts = [r[0] for r in conn.execute('''SELECT content_text(content_z) FROM activities
+                                           WHERE activity_id IN (SELECT activity_id FROM activities ORDER BY random() LIMIT 2000)''')]
+    if store_dictionary(conn, texts) is None: return False
+    recompress(conn)
+    return True
+
+def prune_blocks(conn):
+    """Smaže bloky, na které už nic neodkazuje (po přepsání / smazání aktivit). Vrací počet smazaných."""
+    codec = ContentCodec(conn)
+    live, todo = set(), []
+    for rows in _iter_chunks(conn, SQL_ACTIVITY_CHUNK, 0):
+        todo.extend(h for _, blob in rows if blob is not None for h in codec.refs(blob))
+    while todo:
+        h = todo.pop()
+        if h in live: continue
+        live.add(h)
+        row = conn.execute("SELECT data FROM content_blocks WHERE hash = ?", (h,)).fetchone()
+        if row: todo.extend(codec.refs(row[0]))
+    dead = [r[0] for r in conn.execute("SELECT hash FROM content_blocks") if r[0] not in live]
+    conn.executemany("DELETE FROM content_blocks WHERE hash = ?", ((h,) for h in dead))
+    return len(dead)
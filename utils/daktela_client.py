@@ -0,0 +1,343 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- KONFIGURACE KLIENTA ---
+API_PREFIX = "/api/v6"
+DEFAULT_TIMEOUT = (10, 60)          # (connect, read) v sekundách
+DEFAULT_POOL_SIZE = 32              # Max. počet keep-alive spojení v poolu
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BACKOFF = 0.5               # První čekání před opakováním (s), dále se zdvojnásobuje
+DEFAULT_MAX_BACKOFF = 60            # Strop pro jedno čekání (s)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_WINDOW_DAYS = 7             # Počáteční velikost časového okna
+MAX_WINDOW_DAYS = 31
+DEFAULT_WINDOW_TARGET = 2000        # Cílový počet záznamů v jednom okně (~2 stránky)
+
+# --- PROJEKCE POLÍ AKTIVIT ---
+# Jen klíče, které čte synchronizace (get_activity_details, is_auto_reply, INSERT) a analýza ticketů.
+# Vnořená pole objektu 'item' (EMAIL/CALL/...) se zapisují tečkovou notací.
+ACTIVITY_FIELDS = [
+    "name", "time", "type", "text", "description",
+    "user.title", "contact.title", "options.headers",
+    "item.text", "item.description", "item.mail.body", "item.direction", "item.address",
+    "item.clid", "item.did", "item.options.headers", "item.attachments.name",
+    "item.queue.name", "item.queue.title",
+]
+
+# --- OMEZENÍ POČTU POŽADAVKŮ ---
+class RateLimiter:
+    """Jednoduchý limiter požadavků za sekundu sdílený všemi vlákny."""
+    def __init__(self, max_rps):
+        self.interval = 1.0 / max_rps if max_rps and max_rps > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval: return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+# --- SESTAVENÍ QUERY STRINGU (filter[...] / fields[...]) ---
+def date_range_filters(field, d_from, d_to):
+    """Dvojice filtrů 'field >= d_from 00:00:00' a 'field <= d_to 23:59:59'."""
+    return [
+        {"field": field, "operator": "gte", "value": f"{d_from} 00:00:00"},
+        {"field": field, "operator": "lte", "value": f"{d_to} 23:59:59"},
+    ]
+
+def ids_filter(field, ids):
+    """Filtr na seznam hodnot: jedna hodnota = 'eq', více hodnot = vnořená skupina 'or'."""
+    if not ids: return None
+    if len(ids) == 1: return {"field": field, "operator": "eq", "value": ids[0]}
+    return {"logic": "or", "filters": [{"field": field, "operator": "eq", "value": v} for v in ids]}
+
+def build_filter_params(filters, logic="and"):
+    """
+    Převede seznam filtrů na parametry Daktela API, např.
+    [{"field": "edited", "operator": "gte", "value": "..."}] -> {"filter[logic]": "and", "filter[filters][0][field]": "edited", ...}
+    Položka s klíčem 'filters' je vnořená skupina, hodnota typu list se rozepíše jako [value][i] (operátor 'in').
+    """
+    params = {}
+
+    def add(prefix, flt):
+        if "filters" in flt:
+            params[f"{prefix}[logic]"] = flt.get("logic", "and")
+            for idx, sub in enumerate(f for f in flt["filters"] if f):
+                add(f"{prefix}[filters][{idx}]", sub)
+            return
+        params[f"{prefix}[field]"] = flt["field"]
+        params[f"{prefix}[operator]"] = flt["operator"]
+        value = flt.get("value")
+        if isinstance(value, (list, tuple, set)):
+            for idx, v in enumerate(value): params[f"{prefix}[value][{idx}]"] = v
+        else:
+            params[f"{prefix}[value]"] = value
+
+    add("filter", {"logic": logic, "filters": filters})
+    return params
+
+def build_fields_params(fields):
+    """['name', 'title'] -> {'fields[0]': 'name', 'fields[1]': 'title'}"""
+    return {f"fields[{idx}]": f for idx, f in enumerate(fields or [])}
+
+def build_sort_params(sort):
+    """[('time', 'desc')] -> {'sort[0][field]': 'time', 'sort[0][dir]': 'desc'}"""
+    params = {}
+    for idx, (field, direction) in enumerate(sort or []):
+        params[f"sort[{idx}][field]"] = field
+        params[f"sort[{idx}][dir]"] = direction
+    return params
+
+def build_query(filters=None, fields=None, logic="and", sort=None, **extra):
+    params = build_filter_params(filters, logic) if filters else {}
+    params.update(build_fields_params(fields))
+    params.update(build_sort_params(sort))
+    params.update({k: v for k, v in extra.items() if v is not None})
+    return params
+
+# --- KLIENT ---
+def parse_retry_after(value):
+    """Hlavička Retry-After může být počet sekund nebo HTTP datum."""
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def projection_endpoint(path):
+    """Koncový bod bez ID záznamu ('tickets/123/activities.json' -> 'activities.json')."""
+    return path.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+
+class DaktelaClient:
+    """
+    Sdílený klient Daktela API: keep-alive pool spojení, timeouty
+    a opakování s exponenciálním backoffem (respektuje Retry-After u 429/5xx, nejvýš max_backoff).
+    """
+    def __init__(self, instance_url, token, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.base_url = f"{(instance_url or '').rstrip('/')}{API_PREFIX}"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        # gzip výslovně - velká vlákna e-mailů se komprimují na zlomek velikosti
+        self.session.headers.update({"X-AUTH-TOKEN": token or "", "Accept-Encoding": "gzip, deflate"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.projection_unsupported = set()  # koncové body (projection_endpoint), které fields[] odmítly
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "wire_bytes": 0, "json_bytes": 0, "gzip_responses": 0}
+
+    def _count(self, resp):
+        """Počítadlo přenesených dat: wire_bytes = skutečně přenesené (komprimované), json_bytes = po rozbalení."""
+        body = resp.content
+        wire = resp.raw.tell() if hasattr(resp.raw, "tell") else 0
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["json_bytes"] += len(body)
+            self.stats["wire_bytes"] += wire or len(body)
+            if "gzip" in resp.headers.get("Content-Encoding", ""): self.stats["gzip_responses"] += 1
+
+    def stats_snapshot(self):
+        with self._stats_lock: return dict(self.stats)
+
+    def url(self, path):
+        return path if path.startswith("http") else f"{self.base_url}/{path.lstrip('/')}"
+
+    def _delay(self, attempt, response=None):
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        # ZMĚNA: I Retry-After je omezený stropem – sleep nejde přerušit a blokoval by celou synchronizaci
+        if retry_after is not None: return min(retry_after, self.max_backoff)
+        return min(self.max_backoff, self.backoff * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    def get(self, path, params=None, limiter=None, **kwargs):
+        """GET s opakováním. Vrací poslední Response (i neúspěšnou), síťové chyby po vyčerpání pokusů vyhodí."""
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if limiter: limiter.wait()
+            try:
+                resp = self.session.get(self.url(path), params=params, **kwargs)
+                self._count(resp)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries: raise
+                time.sleep(self._delay(attempt))
+                continue
+            if resp.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                return resp
+            time.sleep(self._delay(attempt, resp))
+        return resp
+
+    def get_result(self, path, params=None, fields=None, **kwargs):
+        """
+        Vrátí 'result' z odpovědi, při chybném HTTP kódu vyhodí requests.HTTPError.
+        'fields' je volitelná projekce (i vnořená, viz ACTIVITY_FIELDS); pokud ji instance odmítne (400),
+        dotaz se zopakuje bez ní. Teprve když bez projekce projde, klient ji u daného koncového bodu
+        dál nepoužívá – 400 kvůli chybnému filtru nebo datu projekci nevypne.
+        """
+        endpoint = projection_endpoint(path)
+        if fields and endpoint not in self.projection_unsupported:
+            resp = self.get(path, params={**(params or {}), **build_fields_params(fields)}, **kwargs)
+            if resp.status_code == 400:
+                resp = self.get(path, params=params, **kwargs)
+                if resp.ok: self.projection_unsupported.add(endpoint)
+        else:
+            resp = self.get(path, params=params, **kwargs)
+        resp.raise_for_status()
+        return resp.json().get("result", {})
+
+    def get_data(self, path, params=None, fields=None, **kwargs):
+        return self.get_result(path, params=params, fields=fields, **kwargs).get("data", [])
+
+    def get_activities_bulk(self, ticket_ids, fields=None, take=DEFAULT_PAGE_SIZE, limiter=None):
+        """
+        Aktivity více ticketů hromadnými dotazy na activities.json (filtr 'ticket in [...]').
+        Nedokončené tickety se dotazují znovu; ticket, který sám zaplní celou stránku, se vynechá.
+        Vrací {str(ticket_id): aktivity}; chybějící tickety (víc aktivit než stránka) je třeba stáhnout po jednom.
+        """
+        result, remaining = {}, [str(t) for t in ticket_ids]
+        while remaining:
+            got, last_seen = self._activities_bulk_page(remaining, fields, take, limiter)
+            if not got and last_seen not in remaining: break
+            result.update(got)
+            remaining = [t for t in remaining if t not in got and (got or t != last_seen)]
+        return result
+
+    def _activities_bulk_page(self, ticket_ids, fields, take, limiter):
+        """
+        Jedna stránka seřazená dle ticketu a času, roztříděná lokálně. Kompletní jsou
+        všechny tickety (i bez aktivit), pokud se vše vešlo, jinak všechny kromě posledního na stránce.
+        Vrací (kompletní tickety, poslední ticket na neúplné stránce).
+        """
+        params = build_query([{"field": "ticket", "operator": "in", "value": ticket_ids}],
+                             sort=[("ticket", "asc"), ("time", "asc")], take=take, skip=0)
+        res = self.get_result("activities.json", params=params, fields=(fields + ["ticket.name"]) if fields else None, limiter=limiter)
+        data, total = res.get("data") or [], res.get("total")
+
+        groups, order, contiguous = {}, [], True
+        for act in data:
+            tk = act.get("ticket")
+            t_id = str(tk.get("name") if isinstance(tk, dict) else tk)
+            if t_id not in groups: groups[t_id] = []; order.append(t_id)
+            elif order[-1] != t_id: contiguous = False      # řazení API nerespektuje
+            groups[t_id].append(act)
+
+        if total is not None and len(data) >= int(total):
+            return {t_id: groups.get(t_id, []) for t_id in ticket_ids}, None
+        if not contiguous or not order: return {}, None
+        return {t_id: groups[t_id] for t_id in order[:-1] if t_id in ticket_ids}, order[-1]
+
+    def iter_pages(self, path, params=None, take=DEFAULT_PAGE_SIZE, max_workers=1, limiter=None):
+        """
+        Generátor stránek (data, total) ve správném pořadí podle 'skip'.
+        První stránka se stáhne vždy samostatně. Pokud API vrátí 'total' a max_workers > 1,
+        zbylé offsety jsou známé předem a stáhnou se souběžně (nejvýše max_workers najednou);
+        pak se vždy dočítá sekvenčně až do prázdné nebo neúplné stránky.
+        Po předčasném ukončení generátoru se nestažené stránky zruší.
+        """
+        params = dict(params or {})
+        def page(skip): return self.get_result(path, params={**params, "take": take, "skip": skip}, limiter=limiter)
+
+        first = page(0)
+        batch, total = first.get("data", []), first.get("total")
+        yield batch, total
+        if len(batch) < take: return
+
+        skip = take
+        if max_workers > 1 and total:
+            offsets = list(range(take, int(total), take))
+            pool = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [pool.submit(page, offset) for offset in offsets]
+                # Krátká stránka uprostřed (záznamy se během výpisu změnily) výpis neukončí – vydají se všechny stažené
+                for future in futures:
+                    batch = future.result().get("data", [])
+                    if batch: yield batch, total
+                skip += len(offsets) * take
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        # Sekvenční dočtení (bez 'total', nebo pokud mezitím záznamy přibyly)
+        while True:
+            batch = page(skip).get("data", [])
+            if not batch: return
+            yield batch, total
+            if len(batch) < take: return
+            skip += take
+
+    def fetch_all(self, path, params=None, take=DEFAULT_PAGE_SIZE, max_workers=1, limiter=None):
+        return [row for batch, _ in self.iter_pages(path, params, take, max_workers, limiter) for row in batch]
+
+    def iter_windows(self, path, filters, date_field, d_from, d_to, fields=None, take=DEFAULT_PAGE_SIZE, max_workers=1,
+                     window_days=DEFAULT_WINDOW_DAYS, target_per_window=DEFAULT_WINDOW_TARGET, key="name"):
+        """
+        Rozdělí rozsah d_from..d_to (date) na časová okna podle date_field (created/edited/call_time).
+        Každé okno se stránkuje samostatně (krátké 'skip' offsety), okna jedné vlny běží souběžně.
+        Velikost oken další vlny se přizpůsobí počtu záznamů na den v předchozí vlně.
+        Vrací (rows, hotové dny, celkem dnů) chronologicky, duplicity na hranách oken odfiltruje dle 'key'.
+        """
+        total_days = (d_to - d_from).days + 1
+        seen = set()
+        cursor, days = d_from, window_days
+        workers = max(1, max_workers)
+
+        def fetch(start, end):
+            params = build_query(date_range_filters(date_field, start, end) + list(filters or []), fields=fields)
+            return self.fetch_all(path, params, take=take)
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while cursor <= d_to:
+                wave = []
+                for _ in range(workers):
+                    if cursor > d_to: break
+                    end = min(d_to, cursor + timedelta(days=days - 1))
+                    wave.append((cursor, end, pool.submit(fetch, cursor, end)))
+                    cursor = end + timedelta(days=1)
+
+                wave_rows = wave_days = 0
+                for start, end, future in wave:
+                    rows = future.result()
+                    wave_rows += len(rows); wave_days += (end - start).days + 1
+                    unique = []
+                    for row in rows:
+                        row_key = row.get(key)
+                        if row_key is not None:
+                            if row_key in seen: continue
+                            seen.add(row_key)
+                        unique.append(row)
+                    yield unique, (end - d_from).days + 1, total_days
+
+                per_day = wave_rows / wave_days if wave_days else 0
+                days = max(1, min(MAX_WINDOW_DAYS, int(target_per_window / per_day))) if per_day else MAX_WINDOW_DAYS
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self.session.close()
+
+# Jeden klient (a tedy jeden pool spojení) na proces pro každou kombinaci URL + token
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(instance_url, token):
+    key = (instance_url, token)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = DaktelaClient(instance_url, token)
+        return _clients[key]
@@ -0,0 +1,327 @@
+"""
+Lokální náhrada Daktela API v6 pro offline testy a měření propustnosti.
+
+Obsluhuje endpointy, které používají stránky aplikace (tickets, aktivity ticketu,
+activities, activitiesCall a číselníky) se sémantikou filter[...] / fields[...] / sort[...] / skip / take.
+Data jsou buď syntetická (MockDataset.synthetic), nebo nahraná ze skutečné instance (record_dataset).
+Volitelně přidává latenci, náhodné chyby 5xx a odpovědi 429 (náhodně nebo při překročení limitu req/s).
+
+Spuštění:
+    python -m utils.daktela_mock --tickets 2000 --latency 40 --error-rate 0.01 --rps-limit 20
+    python -m utils.daktela_mock --data data/mock_dataset.json
+    python -m utils.daktela_mock --record https://firma.daktela.com TOKEN --from 2024-01-01 --to 2024-01-31 --out data/mock_dataset.json
+Aplikace se pak nasměruje na DAKTELA_URL=http://127.0.0.1:8765 (token libovolný, pokud není --token).
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+API_PREFIX = "/api/v6/"
+DEFAULT_TAKE = 50
+CODEBOOKS = {"ticketsCategories": "categories", "statuses": "statuses", "queues": "queues", "users": "users"}
+
+# --- DATA ---
+class MockDataset:
+    """Kolekce záznamů podle endpointu: tickets, activities, activitiesCall, categories, statuses, queues, users."""
+    def __init__(self, collections):
+        self.collections = {k: list(v) for k, v in collections.items()}
+        self.activities_by_ticket = {}
+        for act in self.collections.get("activities", []):
+            self.activities_by_ticket.setdefault(str(get_path(act, "ticket.name")), []).append(act)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f: return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f: json.dump(self.collections, f, ensure_ascii=False)
+
+    @classmethod
+    def synthetic(cls, tickets=1000, days=90, avg_activities=4, calls=None, seed=42, end=None):
+        """Náhodná, ale reprodukovatelná data (stejný seed = stejná data)."""
+        rnd = random.Random(seed)
+        end = end or datetime.now().replace(microsecond=0)
+        start = end - timedelta(days=days)
+        def ts(dt): return dt.strftime("%Y-%m-%d %H:%M:%S")
+        def rand_time(lo, hi): return lo + timedelta(seconds=rnd.randint(0, max(0, int((hi - lo).total_seconds()))))
+
+        categories = [{"name": f"categories_{i}", "title": t} for i, t in enumerate(["Reklamace", "Dotaz", "Objednávka", "Fakturace", "Technická podpora", "Ostatní"])]
+        statuses = [{"name": f"status_{i}", "title": t} for i, t in enumerate(["Nový", "V řešení", "Čeká na zákazníka", "Vyřešeno", "Uzavřeno"])]
+        queues = [{"name": str(1000 + i), "title": t} for i, t in enumerate(["Podpora CZ", "Podpora SK", "Obchod", "Hlasová linka"])]
+        users = [{"name": f"user{i}", "title": f"Operátor {i}"} for i in range(1, 13)]
+        accounts = [{"name": f"account_{i}", "title": f"Firma {i} s.r.o.", "customFields": {"organization_id": [str(50000 + i)]}} for i in range(1, 201)]
+
+        all_tickets, all_acts, all_calls = [], [], []
+        act_id = call_id = 0
+        for n in range(1, tickets + 1):
+            created = rand_time(start, end)
+            acc = rnd.choice(accounts)
+            contact = {"name": f"contact_{n}", "title": f"Kontakt {n}", "account": acc, "database": {"title": rnd.choice(["Dopravci", "E-shopy"])}}
+            user = rnd.choice(users)
+            # Pár ticketů s dlouhou historií (stránkování aktivit, hromadné dotazy)
+            n_acts = rnd.randint(150, 400) if rnd.random() < 0.01 else max(1, int(rnd.expovariate(1 / avg_activities)))
+            times = sorted(rand_time(created, min(end, created + timedelta(days=14))) for _ in range(n_acts))
+            for t in times:
+                act_id += 1
+                kind = rnd.choices(["EMAIL", "COMMENT", "CALL"], weights=[6, 3, 1])[0]
+                direction = rnd.choice(["IN", "OUT"])
+                item = {"direction": direction.lower(), "queue": rnd.choice(queues), "attachments": [{"name": "priloha.pdf"}] if rnd.random() < 0.1 else []}
+                if kind == "EMAIL":
+                    item["text"] = f"<p>Dobrý den,</p><p>zpráva č. {act_id} k ticketu {n}.</p><p>S pozdravem<br>{contact['title']}</p>"
+                    item["options"] = {"headers": {"from": [{"address": f"kontakt{n}@example.com"}], "to": [{"address": "podpora@example.com"}]}}
+                elif kind == "CALL":
+                    item.update(clid=f"+420{rnd.randint(600000000, 799999999)}", did="+420222000111")
+                act = {"name": f"activity_{act_id}", "time": ts(t), "type": kind, "ticket": {"name": n, "title": f"Ticket {n}"},
+                       "user": user, "contact": contact, "item": item}
+                if kind == "COMMENT": act["description"] = f"Interní poznámka {act_id}"
+                all_acts.append(act)
+            edited = max(times[-1], created) if times else created
+            all_tickets.append({
+                "name": n, "title": f"Ticket {n}", "created": ts(created), "edited": ts(edited),
+                "category": rnd.choice(categories), "user": user, "statuses": [rnd.choice(statuses)],
+                "status": None, "priority": rnd.choice(["LOW", "MEDIUM", "HIGH"]), "stage": rnd.choice(["OPEN", "WAIT", "CLOSE"]),
+                "first_answer": ts(times[0]) if times else None, "last_activity": ts(times[-1]) if times else None,
+                "last_activity_operator": ts(times[-1]) if times else None, "last_activity_client": ts(times[0]) if times else None,
+                "reopen": None, "contact": contact, "followers": [{"name": u["name"]} for u in rnd.sample(users, rnd.randint(0, 2))],
+                "customFields": {"vip": ["1"] if rnd.random() < 0.05 else [], "note": [], "dev_task_2": []},
+                "activity_count": len(times),
+            })
+        for _ in range(calls if calls is not None else tickets // 2):
+            call_id += 1
+            answered = rnd.random() < 0.8
+            all_calls.append({"name": f"call_{call_id}", "id_call": f"call_{call_id}", "ticket": rnd.randint(1, max(1, tickets)),
+                              "number": f"+420{rnd.randint(600000000, 799999999)}", "call_time": ts(rand_time(start, end)),
+                              "direction": rnd.choice(["in", "out"]), "id_queue": rnd.choice(queues), "id_agent": rnd.choice(users),
+                              "duration": rnd.randint(10, 900) if answered else 0, "answered": answered})
+
+        return cls({"tickets": all_tickets, "activities": all_acts, "activitiesCall": all_calls,
+                    "categories": categories, "statuses": statuses, "queues": queues, "users": users})
+
+def record_dataset(client, d_from, d_to, path, ticket_date_field="edited"):
+    """Nahraje data ze skutečné instance (tickety v období, jejich aktivity, hovory, číselníky) do souboru pro --data."""
+    from utils.daktela_client import build_query, date_range_filters
+    tickets = client.fetch_all("tickets.json", build_query(date_range_filters(ticket_date_field, d_from, d_to)), max_workers=4)
+    activities = []
+    for t in tickets:
+        for act in client.fetch_all(f"tickets/{t['name']}/activities.json", take=100):
+            act.setdefault("ticket", {"name": t["name"]})
+            activities.append(act)
+    calls = client.fetch_all("activitiesCall.json", build_query(date_range_filters("call_time", d_from, d_to)), max_workers=4)
+    collections = {"tickets": tickets, "activities": activities, "activitiesCall": calls}
+    for endpoint, name in CODEBOOKS.items(): collections[name] = client.fetch_all(f"{endpoint}.json")
+    dataset = MockDataset(collections)
+    dataset.save(path)
+    return dataset
+
+# --- SÉMANTIKA DOTAZŮ (filter / fields / sort / skip / take) ---
+def get_path(obj, path):
+    for part in path.split("."):
+        if isinstance(obj, dict): obj = obj.get(part)
+        else: return None
+    return obj
+
+def parse_nested(params):
+    """Ploché parametry 'filter[filters][0][field]' -> vnořené slovníky/seznamy."""
+    root = {}
+    for key, value in params:
+        parts = re.findall(r"[^\[\]]+", key)
+        node = root
+        for part in parts[:-1]: node = node.setdefault(part, {})
+        if parts: node[parts[-1]] = value
+    def listify(node):
+        if not isinstance(node, dict): return node
+        node = {k: listify(v) for k, v in node.items()}
+        if node and all(k.isdigit() for k in node): return [node[k] for k in sorted(node, key=int)]
+        return node
+    return listify(root)
+
+def scalar(value):
+    """Relace (objekty) se porovnávají podle 'name'."""
+    return value.get("name") if isinstance(value, dict) else value
+
+def compare(op, actual, expected):
+    if isinstance(actual, list):
+        return any(compare(op, a, expected) for a in actual) if op not in ("neq", "notin") else all(compare(op, a, expected) for a in actual)
+    actual = scalar(actual)
+    if op == "isnull": return actual is None
+    if op == "isnotnull": return actual is not None
+    if op in ("in", "notin"):
+        values = {str(v) for v in (expected if isinstance(expected, list) else [expected])}
+        return (str(actual) in values) == (op == "in")
+    a, e = "" if actual is None else str(actual), "" if expected is None else str(expected)
+    if op == "eq": return a == e
+    if op == "neq": return a != e
+    if op == "like": return e.strip("%").lower() in a.lower()
+    if op in ("gt", "gte", "lt", "lte"):
+        if actual is None: return False
+        try: a, e = float(a), float(e)
+        except ValueError: pass
+        return {"gt": a > e, "gte": a >= e, "lt": a < e, "lte": a <= e}[op]
+    raise ValueError(f"Nepodporovaný operátor: {op}")
+
+def matches(record, flt):
+    if not flt: return True
+    if "filters" in flt:
+        subs = flt["filters"] if isinstance(flt["filters"], list) else []
+        results = (matches(record, f) for f in subs)
+        return any(results) if flt.get("logic", "and") == "or" else all(results)
+    return compare(flt.get("operator", "eq"), get_path(record, flt["field"]), flt.get("value"))
+
+def project(record, fields):
+    """fields[i] včetně tečkové notace (item.queue.title) -> jen vyžádané větve."""
+    if not fields: return record
+    out = {}
+    for path in fields:
+        parts = path.split(".")
+        value = get_path(record, path)
+        if value is None and get_path(record, parts[0]) is None: continue
+        node = out
+        for part in parts[:-1]:
+            nxt = node.get(part)
+            if not isinstance(nxt, dict): nxt = node[part] = {}
+            node = nxt
+        if value is not None or parts[-1] not in node: node[parts[-1]] = value
+    return out
+
+def sort_key(value):
+    value = scalar(value)
+    if value is None: return (1, 0, "")
+    try: return (0, 0, float(value))
+    except (TypeError, ValueError): return (0, 1, str(value))
+
+def run_query(records, params):
+    q = parse_nested(params)
+    flt = q.get("filter")
+    rows = [r for r in records if matches(r, flt)] if flt else list(records)
+    for s in reversed(q.get("sort") or []):
+        rows.sort(key=lambda r: sort_key(get_path(r, s["field"])), reverse=s.get("dir") == "desc")
+    skip, take = int(q.get("skip", 0) or 0), int(q.get("take", DEFAULT_TAKE) or DEFAULT_TAKE)
+    fields = q.get("fields") if isinstance(q.get("fields"), list) else None
+    return {"data": [project(r, fields) for r in rows[skip:skip + take]], "total": len(rows)}
+
+# --- HTTP SERVER ---
+class FaultInjector:
+    """Latence, náhodné 5xx / 429 a limit požadavků za sekundu (klouzavé okno 1 s)."""
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate429=0.0, rps_limit=0, retry_after=1, seed=None):
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.error_rate, self.rate429, self.rps_limit, self.retry_after = error_rate, rate429, rps_limit, retry_after
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = []
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0, self.latency_ms + self.rnd.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def verdict(self):
+        """None = obsloužit, jinak (status, Retry-After)."""
+        with self.lock:
+            now = time.time()
+            if self.rps_limit:
+                self.recent = [t for t in self.recent if now - t < 1.0]
+                if len(self.recent) >= self.rps_limit: return 429, self.retry_after
+                self.recent.append(now)
+            if self.rate429 and self.rnd.random() < self.rate429: return 429, self.retry_after
+            if self.error_rate and self.rnd.random() < self.error_rate: return self.rnd.choice([500, 502, 503]), None
+        return None
+
+def make_handler(dataset, faults, token=None, stats=None):
+    stats = stats if stats is not None else Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *args): pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                body = gzip.compress(body); self.send_header("Content-Encoding", "gzip")
+            for k, v in (headers or {}).items(): self.send_header(k, str(v))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats": return self.send_json(200, dict(stats))
+            if not url.path.startswith(API_PREFIX): return self.send_json(404, {"error": ["Not found"], "result": None})
+            endpoint = url.path[len(API_PREFIX):].removesuffix(".json")
+            stats["requests"] += 1; stats[re.sub(r"/\d+/", "/{id}/", endpoint)] += 1
+            faults.delay()
+            if token and self.headers.get("X-AUTH-TOKEN") != token: return self.send_json(401, {"error": ["Unauthorized"], "result": None})
+            verdict = faults.verdict()
+            if verdict:
+                status, retry_after = verdict
+                stats[f"injected_{status}"] += 1
+                return self.send_json(status, {"error": ["Injected failure"], "result": None}, {"Retry-After": retry_after} if retry_after else None)
+
+            m = re.fullmatch(r"tickets/([^/]+)/activities", endpoint)
+            if m: records = dataset.activities_by_ticket.get(m.group(1), [])
+            elif endpoint in CODEBOOKS: records = dataset.collections.get(CODEBOOKS[endpoint], [])
+            elif endpoint in ("tickets", "activities", "activitiesCall"): records = dataset.collections.get(endpoint, [])
+            else: return self.send_json(404, {"error": [f"Unknown endpoint {endpoint}"], "result": None})
+            try: result = run_query(records, parse_qsl(url.query, keep_blank_values=True))
+            except (ValueError, KeyError, TypeError) as e: return self.send_json(400, {"error": [str(e)], "result": None})
+            self.send_json(200, {"error": [], "result": result, "_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+
+    return Handler
+
+def start_mock_server(dataset=None, host="127.0.0.1", port=0, faults=None, token=None):
+    """Spustí server ve vlákně na pozadí; vrací (server, base_url). Ukončení: server.shutdown()."""
+    dataset = dataset or MockDataset.synthetic()
+    server = ThreadingHTTPServer((host, port), make_handler(dataset, faults or FaultInjector(), token, Counter()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Lokální náhrada Daktela API v6.")
+    p.add_argument("--host", default="127.0.0.1"); p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--data", help="JSON soubor s nahranými daty (viz --record)")
+    p.add_argument("--tickets", type=int, default=1000, help="počet syntetických ticketů")
+    p.add_argument("--days", type=int, default=90, help="rozsah syntetických dat (dní zpět)")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--latency", type=float, default=0, help="latence odpovědi v ms")
+    p.add_argument("--jitter", type=float, default=0, help="náhodný rozptyl latence v ms")
+    p.add_argument("--error-rate", type=float, default=0.0, help="podíl odpovědí 5xx (0-1)")
+    p.add_argument("--rate429", type=float, default=0.0, help="podíl náhodných odpovědí 429 (0-1)")
+    p.add_argument("--rps-limit", type=int, default=0, help="429 při překročení počtu požadavků za sekundu")
+    p.add_argument("--retry-after", type=int, default=1, help="hodnota hlavičky Retry-After u 429")
+    p.add_argument("--token", help="vyžadovaný X-AUTH-TOKEN (jinak se nekontroluje)")
+    p.add_argument("--record", nargs=2, metavar=("URL", "TOKEN"), help="nahrát data ze skutečné instance a skončit")
+    p.add_argument("--from", dest="d_from"); p.add_argument("--to", dest="d_to")
+    p.add_argument("--out", default="data/mock_dataset.json")
+    args = p.parse_args(argv)
+
+    if args.record:
+        from utils.daktela_client import DaktelaClient
+        if not (args.d_from and args.d_to): p.error("--record vyžaduje --from a --to")
+        ds = record_dataset(DaktelaClient(*args.record), args.d_from, args.d_to, args.out)
+        print(f"Uloženo do {args.out}: " + ", ".join(f"{k}={len(v)}" for k, v in ds.collections.items()))
+        return 0
+
+    dataset = MockDataset.load(args.data) if args.data else MockDataset.synthetic(tickets=args.tickets, days=args.days, seed=args.seed)
+    faults = FaultInjector(args.latency, args.jitter, args.error_rate, args.rate429, args.rps_limit, args.retry_after, seed=args.seed)
+    stats = Counter()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(dataset, faults, args.token, stats))
+    server.daemon_threads = True
+    print(f"Daktela mock na http://{args.host}:{args.port} ({', '.join(f'{k}={len(v)}' for k, v in dataset.collections.items())})", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(stats), ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
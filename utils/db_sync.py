@@ -0,0 +1,918 @@
+"""
+Synchronizace Daktela -> SQLite bez závislosti na UI.
+
+Výpis ticketů, porovnání s DB, souběžné stažení aktivit a zápis. Volá ji stránka
+Aktualizace DB (přes utils.sync_jobs na pozadí) a lze ji spustit i bez prohlížeče.
+Průběh se hlásí přes callback progress(phase, **údaje), přerušení přes threading.Event.
+"""
+import sqlite3
+import pandas as pd
+from datetime import datetime, date
+import time
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup
+import os
+import json
+from config import (SYNC_MAX_WORKERS, SYNC_MAX_RPS, SYNC_BULK_TICKETS, SYNC_WRITE_BATCH, API_PAGE_WORKERS, API_SHARD_MIN_DAYS, SNAPSHOT_AFTER_SYNC,
+                    SYNC_LOOKUP_BATCH, SYNC_LOOKUP_CACHE)
+from utils.daktela_client import build_query, date_range_filters, RateLimiter, ACTIVITY_FIELDS
+# ZMĚNA: Spojení na DB spravuje utils.storage (WAL, jeden zapisovatel, čtecí spojení pro vlákna)
+from utils.storage import DATA_DIR, writer, get_read_connection, bump_generation
+from utils.migrations import apply_migrations, SQL_STATUS_TITLES
+from utils.rollups import apply_ticket_delta, prune_rollups
+from utils import snapshots, fulltext
+from utils.content_store import ContentCodec, SQL_INSERT_BLOCK, ensure_dictionary, prune_blocks
+
+class SyncCancelled(Exception):
+    """Synchronizace byla přerušena (cancel_event); rozpracovaný běh lze navázat."""
+
+# --- IN-MEMORY CACHE PRO EXTRÉMNÍ ZRYCHLENÍ ---
+class DBLookup:
+    """
+    ZMĚNA: Daktela ID -> lokální ID číselníků bez načítání celých tabulek předem.
+    prefetch() zjistí neznámé / změněné záznamy jedním dotazem IN (...), chybějící vloží
+    hromadně a změněný název (title) přepíše; prázdný název uložený nepřepisuje. Ostatní
+    sloupce (crm_id, client_type, client_id) se jako dřív zapisují jen při vložení.
+    Mezi dávkami drží omezenou LRU cache {daktela_id: (lokální ID, hodnoty)}.
+    """
+    KEYS = {'users': 'user_id', 'categories': 'category_id', 'statuses': 'status_id',
+            'queues': 'queue_id', 'clients': 'client_id', 'contacts': 'contact_id'}
+    UPSERT_COLUMNS = ("title",)
+
+    def __init__(self, conn, cache_size=SYNC_LOOKUP_CACHE):
+        self.conn = conn
+        self.cache_size = max(1, int(cache_size))
+        self.cache = {table: OrderedDict() for table in self.KEYS}
+
+    @classmethod
+    def _differs(cls, stored, values):
+        return any(values.get(c) is not None and stored.get(c) != values[c] for c in cls.UPSERT_COLUMNS if c in values)
+
+    def _select(self, table, cols, dak_ids, chunk=500):
+        found = {}
+        for i in range(0, len(dak_ids), chunk):
+            part = dak_ids[i:i + chunk]
+            rows = self.conn.execute(f"SELECT daktela_id, {', '.join([self.KEYS[table]] + cols)} FROM {table} WHERE daktela_id IN ({','.join('?' * len(part))})", part)
+            for row in rows: found[row[0]] = (row[1], dict(zip(cols, row[2:])))
+        return found
+
+    def prefetch(self, table, items):
+        """items = {daktela_id: {sloupec: hodnota}} – po volání jsou všechny v cache s aktuálními hodnotami."""
+        cache, todo = self.cache[table], {}
+        for dak_id, values in items.items():
+            if not dak_id: continue
+            entry = cache.get(str(dak_id))
+            if entry is None or self._differs(entry[1], values): todo[str(dak_id)] = values
+            else: cache.move_to_end(str(dak_id))
+        if not todo: return
+        cols = sorted({c for values in todo.values() for c in values})
+        found = self._select(table, cols, list(todo))
+        upsert = [k for k, values in todo.items() if k not in found or self._differs(found[k][1], values)]
+        renamed = [found[k][0] for k in upsert if k in found] if table == 'statuses' else []
+        if upsert:
+            updated = [c for c in cols if c in self.UPSERT_COLUMNS]
+            sql = (f"INSERT INTO {table} ({', '.join(['daktela_id'] + cols)}) VALUES ({','.join('?' * (len(cols) + 1))}) "
+                   + ("ON CONFLICT (daktela_id) DO UPDATE SET " + ", ".join(f"{c} = COALESCE(excluded.{c}, {c})" for c in updated) if updated else "ON CONFLICT (daktela_id) DO NOTHING"))
+            self.conn.executemany(sql, [(k, *[todo[k].get(c) for c in cols]) for k in upsert])
+            found.update(self._select(table, cols, [k for k in upsert if k not in found]))
+        for k, values in todo.items():
+            local_id, stored = found[k]
+            cache[k] = (local_id, {**stored, **{c: values[c] for c in self.UPSERT_COLUMNS if values.get(c) is not None}})
+            cache.move_to_end(k)
+        # Přejmenovaný status: seznam statusů (status_titles) i u ticketů mimo dávku
+        for i in range(0, len(renamed), 500):
+            part = renamed[i:i + 500]
+            self.conn.execute(f"{SQL_STATUS_TITLES} WHERE ticket_id IN (SELECT ticket_id FROM ticket_statuses WHERE status_id IN ({','.join('?' * len(part))}))", part)
+        while len(cache) > self.cache_size: cache.popitem(last=False)
+
+    def get_or_create(self, table, dak_id, **kwargs):
+        if not dak_id: return None
+        dak_id = str(dak_id)
+        entry = self.cache[table].get(dak_id)
+        if entry is None or self._differs(entry[1], kwargs):
+            self.prefetch(table, {dak_id: kwargs})
+            entry = self.cache[table][dak_id]
+        else: self.cache[table].move_to_end(dak_id)
+        return entry[0]
+
+    def resolve(self, item, **extra):
+        """Lokální ID pro položku z ticket_codebook_items (tabulka, daktela_id, hodnoty), None = položka chybí."""
+        if not item: return None
+        return self.get_or_create(item[0], item[1], **item[2], **extra)
+
+def ticket_codebook_items(t):
+    """
+    Položky číselníků ticketu jako (tabulka, daktela_id, hodnoty). Kontakt je bez client_id
+    (lokální ID klienta, doplní se až po jeho zápisu).
+    """
+    cat_dict, user_dict = t.get('category') or {}, t.get('user') or {}
+    items = {"category": ('categories', cat_dict.get('name'), {"title": cat_dict.get('title')}),
+             "user": ('users', user_dict.get('name'), {"title": user_dict.get('title')}),
+             "statuses": [('statuses', s.get('name'), {"title": s.get('title')}) for s in t.get('statuses') or []],
+             "client": None, "contact": None}
+    contact_data = t.get('contact') or {}
+    if contact_data:
+        acc_data = contact_data.get('account') or {}
+        if acc_data:
+            items["client"] = ('clients', acc_data.get('name'), {"title": acc_data.get('title'), "crm_id": find_crm_id(acc_data.get('customFields') or {}),
+                                                                "client_type": (contact_data.get('database') or {}).get('title', '')})
+        items["contact"] = ('contacts', contact_data.get('name'), {"title": contact_data.get('title')})
+    return items
+
+def prefetch_ticket_codebooks(db, tickets):
+    """Číselníky dávky ticketů jedním dotazem na tabulku (kontakty až po klientech kvůli client_id)."""
+    items = [ticket_codebook_items(t) for t in tickets]
+    grouped = {}
+    for it in items:
+        for item in [it["category"], it["user"], *it["statuses"], it["client"]]:
+            # Hodnoty prvního ticketu dávky, kde se záznam objeví (stejně jako při zápisu po jednom)
+            if item and item[1]: grouped.setdefault(item[0], {}).setdefault(str(item[1]), item[2])
+    for table, values in grouped.items(): db.prefetch(table, values)
+    contacts = {}
+    for it in items:
+        if it["contact"] and it["contact"][1]:
+            contacts.setdefault(str(it["contact"][1]), {**it["contact"][2], "client_id": db.resolve(it["client"])})
+    db.prefetch('contacts', contacts)
+
+# --- POMOCNÉ FUNKCE ---
+
+TICKET_SYNC_FIELDS = [
+    "name", "title", "created", "edited", "category", "user", "statuses", "customFields",
+    "priority", "stage", "first_answer", "last_activity_operator", "last_activity_client",
+    "contact", "followers", "reopen"
+]
+
+def ensure_data_dir():
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+
+def clean_daktela_html(html_content):
+    if not html_content or not isinstance(html_content, str): return ""
+    try:
+        soup = BeautifulSoup(html_content, "html.parser")
+        for s in soup(['script', 'style', 'head', 'title', 'meta']): s.decompose()
+        for br in soup.find_all("br"): br.replace_with("\n")
+        return "\n".join(line.strip() for line in soup.get_text(separator="\n").splitlines() if line.strip())
+    except:
+        return str(html_content)
+
+def parse_iso_datetime(iso_string):
+    """ZMĚNA: Časový údaj z API jako jeden text 'YYYY-MM-DD HH:MM:SS' (sloupce *_at), jinak None."""
+    if not iso_string or iso_string == "null":
+        return None
+    try:
+        return datetime.strptime(iso_string, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+# --- SOUBĚŽNÉ STAHOVÁNÍ AKTIVIT ---
+def fetch_ticket_activities(client, t_id, limiter, cancel_event, act_take=100):
+    all_activities = []
+    act_skip = 0
+    try:
+        while not cancel_event.is_set():
+            acts = client.get_data(f"tickets/{t_id}/activities.json", params={"skip": act_skip, "take": act_take}, fields=ACTIVITY_FIELDS, limiter=limiter)
+            if not acts: break
+            all_activities.extend(acts)
+            if len(acts) < act_take: break
+            act_skip += act_take
+    except: pass
+    return all_activities
+
+# ZMĚNA: Přírůstkové stažení aktivit u ticketu, který už je v DB
+def fetch_ticket_activity_delta(client, t_id, state, limiter, cancel_event, act_take=100):
+    """
+    Stahuje aktivity od nejnovější (řazení dle 'time' sestupně), dokud nenarazí na starší než
+    poslední uložená. Vrací jen aktivity s neznámým daktela_id, nebo None, pokud
+    uložený počet + nové nesedí s 'total' z API (smazané / dodatečně vložené aktivity).
+    """
+    new_acts, act_skip, total = [], 0, None
+    params = build_query(sort=[("time", "desc")], take=act_take)
+    try:
+        while not cancel_event.is_set():
+            res = client.get_result(f"tickets/{t_id}/activities.json", params={**params, "skip": act_skip}, fields=ACTIVITY_FIELDS, limiter=limiter)
+            acts = res.get("data") or []
+            total = res.get("total")
+            reached = False
+            for act in acts:
+                if str(act.get('time') or '') < state['last']: reached = True; break
+                if str(act.get('name')) not in state['ids']: new_acts.append(act)
+            if reached or len(acts) < act_take: break
+            act_skip += act_take
+    except: return None
+    if total is None or state['count'] + len(new_acts) != int(total): return None
+    return new_acts
+
+def fetch_ticket_activities_smart(client, t_id, state, limiter, cancel_event):
+    """(aktivity, je_přírůstek) – přírůstek, pokud je ticket v DB a počty sedí, jinak celá historie."""
+    if state:
+        new_acts = fetch_ticket_activity_delta(client, t_id, state, limiter, cancel_event)
+        if new_acts is not None: return new_acts, True
+    return fetch_ticket_activities(client, t_id, limiter, cancel_event), False
+
+def get_activity_state(conn, ticket_ids, chunk=500):
+    """{ticket_id: {'count', 'last' (čas nejnovější aktivity), 'ids' (daktela_id)}} pro tickety s uloženými aktivitami."""
+    state = {}
+    ticket_ids = list(ticket_ids)
+    for i in range(0, len(ticket_ids), chunk):
+        part = ticket_ids[i:i + chunk]
+        rows = conn.execute(f'''SELECT ticket_id, daktela_id, created_at FROM activities
+                                WHERE ticket_id IN ({",".join("?" * len(part))})''', part)
+        for t_id, dak_id, ts in rows:
+            st_ = state.setdefault(str(t_id), {"count": 0, "last": "", "ids": set()})
+            st_["count"] += 1
+            st_["ids"].add(str(dak_id))
+            if ts and ts > st_["last"]: st_["last"] = ts
+    return state
+
+def iter_ticket_activities(client, tickets, max_workers=SYNC_MAX_WORKERS, max_rps=SYNC_MAX_RPS, activity_state=None):
+    """
+    Stahuje aktivity více ticketů souběžně (omezený pool vláken + limit req/s)
+    a vrací trojice (ticket, aktivity, je_přírůstek) ve STEJNÉM pořadí jako vstup.
+    Zápis do SQLite tak zůstává v hlavním vlákně přes jedno spojení.
+    """
+    activity_state = activity_state or {}
+    limiter = RateLimiter(max_rps)
+    cancel_event = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    it = iter(tickets)
+    try:
+        # Rozpracováno je nejvýše 2x tolik ticketů, kolik je vláken (omezení paměti)
+        for t in it:
+            pending.append((t, pool.submit(fetch_ticket_activities_smart, client, t['name'], activity_state.get(str(t['name'])), limiter, cancel_event)))
+            if len(pending) >= max_workers * 2: break
+        while pending:
+            t, future = pending.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(fetch_ticket_activities_smart, client, nxt['name'], activity_state.get(str(nxt['name'])), limiter, cancel_event)))
+            yield (t, *future.result())
+    finally:
+        # Při zastavení (tlačítko STOP / rerun) zrušíme rozpracované požadavky
+        cancel_event.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# ZMĚNA: Hromadné stažení aktivit více ticketů jedním dotazem
+def resolve_bulk_activities(acts, state):
+    """
+    Kompletní aktivity ticketu z hromadného dotazu -> (aktivity, je_přírůstek).
+    Pokud jsou všechny uložené aktivity stále v API, zapíšou se jen nové (stejně jako u přírůstku).
+    """
+    if state and state['ids'] <= {str(a.get('name')) for a in acts}:
+        new_acts = [a for a in acts if str(a.get('name')) not in state['ids']]
+        if all(str(a.get('time') or '') >= state['last'] for a in new_acts): return new_acts, True
+    return acts, False
+
+def fetch_bulk_chunk(client, ticket_ids, limiter, cancel_event):
+    if cancel_event.is_set(): return {}
+    try: return client.get_activities_bulk(ticket_ids, fields=ACTIVITY_FIELDS, limiter=limiter)
+    except: return {}
+
+def iter_ticket_activities_bulk(client, tickets, max_workers=SYNC_MAX_WORKERS, max_rps=SYNC_MAX_RPS, activity_state=None, bulk_size=SYNC_BULK_TICKETS):
+    """
+    Jako iter_ticket_activities, ale aktivity se stahují po skupinách bulk_size ticketů
+    (activities.json s filtrem 'ticket in [...]'). Tickety, které se do jedné stránky
+    nevešly (nebo hromadný dotaz selhal), se dotáhnou po jednom.
+    """
+    activity_state = activity_state or {}
+    limiter = RateLimiter(max_rps)
+    cancel_event = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    chunks = (tickets[i:i + bulk_size] for i in range(0, len(tickets), bulk_size))
+    pending = deque()
+
+    def submit(chunk):
+        pending.append((chunk, pool.submit(fetch_bulk_chunk, client, [t['name'] for t in chunk], limiter, cancel_event)))
+
+    try:
+        for chunk in chunks:
+            submit(chunk)
+            if len(pending) >= max_workers: break
+        while pending:
+            chunk, future = pending.popleft()
+            nxt = next(chunks, None)
+            if nxt: submit(nxt)
+            bulk = future.result()
+            fallback = {str(t['name']): pool.submit(fetch_ticket_activities_smart, client, t['name'], activity_state.get(str(t['name'])), limiter, cancel_event)
+                        for t in chunk if str(t['name']) not in bulk}
+            for t in chunk:
+                t_id = str(t['name'])
+                if t_id in fallback: yield (t, *fallback[t_id].result())
+                else: yield (t, *resolve_bulk_activities(bulk[t_id], activity_state.get(t_id)))
+    finally:
+        cancel_event.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def get_cf_value(cf_data, key):
+    val = cf_data.get(key)
+    if isinstance(val, list):
+        return str(val[0]) if val else ""
+    return str(val) if val else ""
+
+def find_crm_id(cf_data):
+    priority_keys = ['organization_id', 'shipper_id', 'dealer_id', 'Dealer ID', 'id_dopravce']
+    for key in priority_keys:
+        val = get_cf_value(cf_data, key)
+        if val: return val
+    return ""
+
+def extract_email_address(data):
+    if not data: return ""
+    if isinstance(data, list) and len(data) > 0:
+        first = data[0]
+        if isinstance(first, dict): return first.get('address', '')
+        elif isinstance(first, str): return first
+    elif isinstance(data, str): return data
+    return ""
+
+def get_activity_details(act, operator_title):
+    act_type = act.get('type')
+    
+    if not act_type and act.get('description'):
+        act_type = 'COMMENT'
+
+    item = act.get('item') or {}
+    sender = ""
+    recipient = ""
+    direction = str(item.get('direction', '')).upper()
+    
+    if act_type == 'EMAIL':
+        options = item.get('options') or {}
+        headers = options.get('headers') or {}
+        sender = extract_email_address(headers.get('from'))
+        recipient = extract_email_address(headers.get('to'))
+        
+        if not sender and direction == 'OUT': sender = operator_title
+        if not direction:
+            direction = "OUT" if sender == operator_title else "IN"
+
+    elif act_type == 'CALL':
+        if direction == 'IN':
+            sender = item.get('clid', 'Unknown')
+            recipient = item.get('did', 'System')
+        else:
+            sender = operator_title
+            recipient = item.get('clid', '')
+
+    elif act_type == 'COMMENT':
+        sender = (act.get('user') or {}).get('title', 'System')
+        recipient = "Internal"
+        direction = "INTERNAL"
+        
+    else:
+        sender = (act.get('user') or {}).get('title', 'Unknown')
+        recipient = (item.get('queue') or {}).get('title', '')
+        
+    return sender, recipient, direction, act_type
+
+def is_auto_reply(act, raw_desc):
+    item = act.get('item') or {}
+    
+    options = item.get('options') or act.get('options') or {}
+    headers = options.get('headers') or {}
+    
+    headers_lower = {str(k).lower(): str(v).lower() for k, v in headers.items()}
+    if headers_lower.get('auto-submitted') == 'auto-generated':
+        return 1
+    if headers_lower.get('x-auto-response-suppress') == 'all':
+        return 1
+        
+    text_to_check = str(raw_desc).lower()
+    
+    split_markers = [
+        "---------- odpovězená zpráva ----------", 
+        "---------- replied message ----------",
+        "napsal(a):", 
+        "wrote:",
+        "<blockquote"
+    ]
+    
+    for marker in split_markers:
+        if marker in text_to_check:
+            text_to_check = text_to_check.split(marker)[0]
+            
+    auto_phrases = [
+        "potvrzujeme, že vaše zpráva byla úspěšně doručena",
+        "we are confirming that your message has been successfully delivered",
+        "upozornění na napojení dopravců",
+        "automaticky generovaná zpráva",
+        "toto je automatická odpověď"
+    ]
+    
+    for phrase in auto_phrases:
+        if phrase in text_to_check:
+            return 1
+            
+    return 0
+
+# --- DATABÁZE INIT ---
+def init_db():
+    """Vytvoří chybějící tabulky a provede čekající migrace (indexy apod., viz utils.migrations)."""
+    with writer() as conn:
+        _create_schema(conn.cursor())
+        conn.commit()
+        apply_migrations(conn)
+
+def _create_schema(c):
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS categories (category_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS statuses (status_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS queues (queue_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT)''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS clients (client_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT, crm_id TEXT, client_type TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS contacts (contact_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, title TEXT, client_id INTEGER, FOREIGN KEY (client_id) REFERENCES clients(client_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS tickets (
+        ticket_id INTEGER PRIMARY KEY, title TEXT, category_id INTEGER, user_id INTEGER, status_id INTEGER, client_id INTEGER, contact_id INTEGER, 
+        priority TEXT, stage TEXT, created_date TEXT, created_time TEXT, edited_date TEXT, edited_time TEXT, first_answer_date TEXT, first_answer_time TEXT, 
+        last_activity_op_date TEXT, last_activity_op_time TEXT, last_activity_cl_date TEXT, last_activity_cl_time TEXT, reopen_date TEXT, reopen_time TEXT, 
+        activity_count INTEGER, followers TEXT, account_title TEXT, vip INTEGER, dev_task1 TEXT, dev_task2 TEXT, last_synced_date TEXT, last_synced_time TEXT,
+        FOREIGN KEY (category_id) REFERENCES categories(category_id), FOREIGN KEY (user_id) REFERENCES users(user_id), FOREIGN KEY (status_id) REFERENCES statuses(status_id),
+        FOREIGN KEY (client_id) REFERENCES clients(client_id), FOREIGN KEY (contact_id) REFERENCES contacts(contact_id)
+    )''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS activities (
+        activity_id INTEGER PRIMARY KEY AUTOINCREMENT, daktela_id TEXT UNIQUE, ticket_id INTEGER, created_date TEXT, created_time TEXT, 
+        type TEXT, direction TEXT, sender TEXT, recipient TEXT, queue_id INTEGER, category_id INTEGER, has_attachment INTEGER, 
+        activity_order INTEGER, automatic_reply INTEGER, content TEXT,
+        FOREIGN KEY (ticket_id) REFERENCES tickets(ticket_id), FOREIGN KEY (queue_id) REFERENCES queues(queue_id), FOREIGN KEY (category_id) REFERENCES categories(category_id)
+    )''')
+    
+    # ZMĚNA: Nová spojovací tabulka pro ukládání VŠECH statusů u ticketů
+    c.execute('''CREATE TABLE IF NOT EXISTS ticket_statuses (
+        ticket_id INTEGER, 
+        status_id INTEGER,
+        PRIMARY KEY (ticket_id, status_id),
+        FOREIGN KEY (ticket_id) REFERENCES tickets(ticket_id),
+        FOREIGN KEY (status_id) REFERENCES statuses(status_id)
+    )''')
+    
+    # ZMĚNA: Evidence běhů synchronizace s kurzorem pro navázání po přerušení
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT,
+        started_at TEXT, updated_at TEXT, finished_at TEXT,
+        date_from TEXT, date_to TEXT, categories TEXT,
+        pending_tickets TEXT,
+        total_tickets INTEGER, processed_count INTEGER DEFAULT 0, last_ticket_id INTEGER
+    )''')
+    # ZMĚNA: Kandidát na novou značku synchronizace (uplatní se až po dokončení běhu)
+    try: c.execute("ALTER TABLE sync_runs ADD COLUMN watermark TEXT")
+    except sqlite3.OperationalError: pass
+
+    # ZMĚNA: Metadata synchronizace (klíč/hodnota), např. značka posledního 'edited'
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_metadata (key TEXT PRIMARY KEY, value TEXT, updated_at TEXT)''')
+
+# --- BĚHY SYNCHRONIZACE (CHECKPOINTY) ---
+def create_sync_run(d_from, d_to, categories, tickets, watermark=None):
+    """Založí běh a uloží seznam ticketů ke zpracování (data z kroku 1, aby šlo navázat bez nového výpisu)."""
+    init_db()
+    with writer() as conn:
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cur = conn.execute('''INSERT INTO sync_runs (status, started_at, updated_at, date_from, date_to, categories, pending_tickets, total_tickets, processed_count, watermark)
+                              VALUES ('running', ?, ?, ?, ?, ?, ?, ?, 0, ?)''',
+                           (now, now, str(d_from), str(d_to), json.dumps(categories, ensure_ascii=False), json.dumps(tickets, ensure_ascii=False), len(tickets),
+                            json.dumps(watermark) if watermark else None))
+        conn.commit()
+        return cur.lastrowid
+
+UNFINISHED_STATUSES = ("running", "stopped", "failed")
+
+def get_resumable_run():
+    """Poslední nedokončený běh (přerušený tlačítkem, obnovením stránky nebo restartem serveru)."""
+    conn = get_read_connection()
+    if conn is None: return None
+    try:
+        cols = ["run_id", "started_at", "updated_at", "date_from", "date_to", "categories", "total_tickets", "processed_count", "last_ticket_id"]
+        row = conn.execute(f'''SELECT {", ".join(cols)} FROM sync_runs
+                               WHERE status IN ({", ".join("'" + st + "'" for st in UNFINISHED_STATUSES)}) AND processed_count < total_tickets
+                               ORDER BY run_id DESC LIMIT 1''').fetchone()
+        return dict(zip(cols, row)) if row else None
+    except: return None
+
+def load_pending_tickets(run_id):
+    conn = get_read_connection()
+    if conn is None: return []
+    row = conn.execute("SELECT pending_tickets FROM sync_runs WHERE run_id = ?", (run_id,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else []
+
+def save_sync_checkpoint(conn, run_id, processed_count, last_ticket_id, status="running"):
+    """Kurzor se zapisuje ve stejné transakci jako data ticketů (volat těsně před commit)."""
+    conn.execute("UPDATE sync_runs SET status = ?, processed_count = ?, last_ticket_id = ?, updated_at = ? WHERE run_id = ?",
+                 (status, processed_count, last_ticket_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id))
+
+def finish_sync_run(run_id, status="done", conn=None):
+    if conn is None:
+        with writer() as conn: return finish_sync_run(run_id, status, conn)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if status == "done":
+        row = conn.execute("SELECT watermark FROM sync_runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row and row[0]: save_watermark(conn, json.loads(row[0]))
+    # Seznam ticketů po dokončení už není potřeba
+    conn.execute("UPDATE sync_runs SET status = ?, finished_at = ?, updated_at = ?, pending_tickets = NULL WHERE run_id = ?", (status, now, now, run_id))
+    conn.commit()
+
+# --- ZNAČKA SYNCHRONIZACE (WATERMARK) ---
+# Poslední zpracovaný 'edited' (na sekundu) + ID ticketů s právě tímto časem.
+# Další běh se ptá API jen na 'edited >= značka' a tickety ze značky přeskočí,
+# takže se nic neztratí ani při více změnách ve stejné sekundě.
+def get_watermark():
+    conn = get_read_connection()
+    if conn is None: return None
+    try:
+        row = conn.execute("SELECT value FROM sync_metadata WHERE key = 'tickets_watermark'").fetchone()
+        if row and row[0]: return json.loads(row[0])
+        # Databáze z doby před zavedením značky: odvození z uložených ticketů
+        last = conn.execute("SELECT MAX(edited_at) FROM tickets").fetchone()[0]
+        if last:
+            ids = [str(r[0]) for r in conn.execute("SELECT ticket_id FROM tickets WHERE edited_at = ?", (last,))]
+            return {"edited": last, "ids": ids}
+    except: pass
+    return None
+
+def save_watermark(conn, watermark):
+    """Značka se jen posouvá vpřed (starší období synchronizované později ji nevrátí zpět)."""
+    row = conn.execute("SELECT value FROM sync_metadata WHERE key = 'tickets_watermark'").fetchone()
+    current = json.loads(row[0]) if row and row[0] else None
+    if current and current["edited"] > watermark["edited"]: return
+    if current and current["edited"] == watermark["edited"]:
+        watermark = {"edited": watermark["edited"], "ids": sorted(set(current["ids"]) | set(watermark["ids"]))}
+    conn.execute("INSERT OR REPLACE INTO sync_metadata (key, value, updated_at) VALUES ('tickets_watermark', ?, ?)",
+                 (json.dumps(watermark), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def compute_watermark(api_tickets):
+    """Nejvyšší 'edited' ve výpisu a ID všech ticketů s touto hodnotou."""
+    edited = [str(t['edited']) for t in api_tickets if t.get('edited')]
+    if not edited: return None
+    top = max(edited)
+    return {"edited": top, "ids": sorted({str(t['name']) for t in api_tickets if str(t.get('edited')) == top})}
+
+def get_db_ticket_map():
+    conn = get_read_connection()
+    if conn is None: return {}
+    try:
+        df = pd.read_sql("SELECT ticket_id, edited_at FROM tickets", conn)
+        return dict(zip(df.ticket_id, df.edited_at)) if not df.empty else {}
+    except: return {}
+
+def get_last_ticket_date():
+    conn = get_read_connection()
+    if conn is None: return None
+    try:
+        res = pd.read_sql("SELECT substr(MAX(edited_at), 1, 10) as last_edit FROM tickets", conn)
+        if not res.empty and res.iloc[0]['last_edit']:
+            return pd.to_datetime(res.iloc[0]['last_edit']).date()
+    except: pass
+    return None
+
+# --- DÁVKOVÝ ZÁPIS ---
+class SyncWriter:
+    """
+    ZMĚNA: Řádky ticketů, statusů a aktivit se sbírají do dávek a zapisují přes executemany.
+    Dávka se zapíše po dosažení batch_size řádků; commit() ji vždy nejdřív dopíše,
+    takže commit po N ticketech (checkpoint) zůstává konzistentní.
+    """
+    SQL_DELETE_STATUSES = "DELETE FROM ticket_statuses WHERE ticket_id = ?"
+    SQL_DELETE_ACTIVITIES = "DELETE FROM activities WHERE ticket_id = ?"
+    SQL_INSERT_STATUS = "INSERT OR IGNORE INTO ticket_statuses (ticket_id, status_id) VALUES (?, ?)"
+    SQL_INSERT_ACTIVITY = '''INSERT OR REPLACE INTO activities 
+                           (daktela_id, ticket_id, created_at, 
+                            type, direction, sender, recipient, 
+                            queue_id, category_id, has_attachment, activity_order, automatic_reply, content_z) 
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    SQL_INSERT_TICKET = '''INSERT OR REPLACE INTO tickets 
+                   (ticket_id, title, category_id, user_id, status_id, client_id, contact_id,
+                    priority, stage, created_at, edited_at, first_answer_at, last_activity_op_at,
+                    last_activity_cl_at, reopen_at,
+                    activity_count, followers, account_title, vip, dev_task1, dev_task2, last_synced_at) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+    def __init__(self, conn, batch_size=SYNC_WRITE_BATCH):
+        self.conn = conn
+        self.batch_size = max(1, int(batch_size))
+        self.codec = ContentCodec(conn)
+        self.fts = fulltext.is_available(conn)
+        self.reset()
+
+    def reset(self):
+        """Zahodí nezapsané řádky (po rollbacku)."""
+        self.del_statuses, self.del_activities = [], []
+        self.statuses, self.activities, self.tickets = [], [], []
+
+    def pending(self):
+        return len(self.del_statuses) + len(self.del_activities) + len(self.statuses) + len(self.activities) + len(self.tickets)
+
+    def maybe_flush(self):
+        if self.pending() >= self.batch_size: self.flush()
+
+    def flush(self):
+        # Mazání musí předcházet vkládání (každý ticket je v dávce nejvýše jednou)
+        c = self.conn.cursor()
+        # ZMĚNA: Souhrny pro statistiky – odečíst staré řádky ticketů z dávky, po zápisu přičíst nové
+        ticket_ids = [row[0] for row in self.tickets]
+        if ticket_ids: apply_ticket_delta(c, ticket_ids, -1)
+        # ZMĚNA: Obsah aktivit komprimovaný, citovaná historie jako sdílené bloky (utils.content_store) – bloky před aktivitami
+        blocks = {}
+        activities = [row[:-1] + (self.codec.encode(row[-1], blocks),) for row in self.activities]
+        # ZMĚNA: Fulltext bez obsahu – z indexu odebrat mazané a nahrazované aktivity (se stejným textem, jaký se indexoval)
+        if self.fts: fulltext.unindex_activities(c, self._replaced_activities(c))
+        for sql, rows in ((self.SQL_DELETE_STATUSES, self.del_statuses), (self.SQL_DELETE_ACTIVITIES, self.del_activities),
+                          (SQL_INSERT_BLOCK, list(blocks.items())),
+                          (self.SQL_INSERT_STATUS, self.statuses), (self.SQL_INSERT_ACTIVITY, activities),
+                          (self.SQL_INSERT_TICKET, self.tickets)):
+            if rows: c.executemany(sql, rows)
+        if self.fts and self.activities:
+            texts = {row[0]: row[-1] for row in self.activities}
+            fulltext.index_activities(c, [(a_id, texts[dak_id]) for dak_id, a_id in self._activity_ids(c, list(texts))])
+        # ZMĚNA: Seznam statusů u ticketu (status_titles) – přepočet jen pro tickety z dávky
+        for i in range(0, len(ticket_ids), 500):
+            part = ticket_ids[i:i + 500]
+            c.execute(f"{SQL_STATUS_TITLES} WHERE ticket_id IN ({','.join('?' * len(part))})", part)
+        if ticket_ids: apply_ticket_delta(c, ticket_ids, 1)
+        self.reset()
+
+    def _activity_ids(self, c, dak_ids):
+        """[(daktela_id, activity_id)] uložených aktivit."""
+        found = []
+        for i in range(0, len(dak_ids), 500):
+            part = dak_ids[i:i + 500]
+            found.extend(c.execute(f"SELECT daktela_id, activity_id FROM activities WHERE daktela_id IN ({','.join('?' * len(part))})", part).fetchall())
+        return found
+
+    def _replaced_activities(self, c):
+        """(activity_id, text) aktivit, které dávka smaže (tickety s plnou historií) nebo přepíše (stejné daktela_id)."""
+        old = {}
+        ticket_ids = [row[0] for row in self.del_activities]
+        for i in range(0, len(ticket_ids), 500):
+            part = ticket_ids[i:i + 500]
+            old.update(c.execute(f"SELECT activity_id, content_z FROM activities WHERE ticket_id IN ({','.join('?' * len(part))})", part).fetchall())
+        existing = [a_id for _, a_id in self._activity_ids(c, [row[0] for row in self.activities]) if a_id not in old]
+        for i in range(0, len(existing), 500):
+            part = existing[i:i + 500]
+            old.update(c.execute(f"SELECT activity_id, content_z FROM activities WHERE activity_id IN ({','.join('?' * len(part))})", part).fetchall())
+        return [(a_id, self.codec.decode(blob)) for a_id, blob in old.items()]
+
+    def commit(self):
+        self.flush()
+        # ZMĚNA: Průběžné commity synchronizace posouvají čítač zápisů (podpis dat pro snapshoty a DuckDB)
+        bump_generation(self.conn)
+        self.conn.commit()
+
+# --- ZÁPIS TICKETU ---
+def store_ticket(db, writer, t, all_activities, stored_count=None):
+    """
+    Připraví řádky ticketu včetně statusů a aktivit do dávky writer (bez commitu).
+    stored_count = počet již uložených aktivit u přírůstku (nic se nemaže, číslování pokračuje),
+    None = plná historie (staré aktivity ticketu se nahradí).
+    """
+    t_id = t['name']
+
+    # ZMĚNA: Číselníky ze stejných položek, jaké připravuje prefetch_ticket_codebooks
+    codebook = ticket_codebook_items(t)
+    db_category_id = db.resolve(codebook["category"])
+    db_user_id = db.resolve(codebook["user"])
+
+    # ZMĚNA: Ukládání všech statusů ticketu do vazební tabulky
+    db_status_id = db.resolve(codebook["statuses"][0]) if codebook["statuses"] else None
+
+    # Vymazání starých statusů pro tento ticket (pokud jde o update)
+    writer.del_statuses.append((t_id,))
+    # Zápis všech aktuálních statusů do nové tabulky
+    for s in codebook["statuses"]:
+        writer.statuses.append((t_id, db.resolve(s)))
+
+    # --- AKTIVITY (stažené souběžně v iter_ticket_activities) ---
+    real_activity_count = 0
+    # ZMĚNA: U přírůstku se nic nemaže, nové aktivity se číslují za stávajícími
+    order_offset = stored_count or 0
+    if stored_count is not None: real_activity_count = order_offset
+
+    if all_activities:
+        all_activities.sort(key=lambda x: x.get('time', ''))
+        real_activity_count = order_offset + len(all_activities)
+        if stored_count is None: writer.del_activities.append((t_id,))
+        # Fronty všech aktivit ticketu jedním dotazem (známé a nezměněné se berou z cache)
+        queues = ((act.get('item') or {}).get('queue') or {} for act in all_activities)
+        db.prefetch('queues', {q.get('name'): {"title": q.get('title')} for q in queues if q.get('name')})
+
+        for idx, act in enumerate(all_activities, start=order_offset + 1):
+            dak_act_id = act['name']
+            a_at = parse_iso_datetime(act.get('time'))
+
+            item = act.get('item') or {}
+
+            raw_desc = act.get('text') or act.get('description') or item.get('text') or item.get('description') or (item.get('mail') or {}).get('body') or ""
+
+            queue_dict = item.get('queue') or {}
+            db_queue_id = db.get_or_create('queues', queue_dict.get('name'), title=queue_dict.get('title'))
+
+            op_title = (act.get('user') or {}).get('title', 'System')
+            sender, recipient, direction, act_type_final = get_activity_details(act, op_title)
+
+            has_att = 1 if len(item.get('attachments') or []) > 0 else 0
+            auto_flag = is_auto_reply(act, raw_desc)
+
+            writer.activities.append((dak_act_id, t_id, a_at, 
+                                      act_type_final, direction, sender, recipient,
+                                      db_queue_id, db_category_id, has_att, idx, auto_flag, clean_daktela_html(raw_desc)))
+
+    # --- PARSING TICKETU ---
+    c_at = parse_iso_datetime(t.get('created'))
+    e_at = parse_iso_datetime(t.get('edited'))
+    fa_at = parse_iso_datetime(t.get('first_answer'))
+    lao_at = parse_iso_datetime(t.get('last_activity_operator'))
+    lac_at = parse_iso_datetime(t.get('last_activity_client'))
+    reopen_at = parse_iso_datetime(t.get('reopen'))
+
+    contact_data = t.get('contact') or {}
+    db_client_id = db.resolve(codebook["client"])
+    db_contact_id = db.resolve(codebook["contact"], client_id=db_client_id)
+
+    followers_str = ""
+    raw_followers = t.get('followers')
+    if isinstance(raw_followers, list):
+        followers_str = ",".join([f.get('name') for f in raw_followers if isinstance(f, dict) and f.get('name')])
+
+    account_title_flat = ""
+    if contact_data and isinstance(contact_data.get('account'), dict):
+         account_title_flat = contact_data['account'].get('title', '')
+
+    cf_raw = t.get('customFields')
+    cf = cf_raw if isinstance(cf_raw, dict) else {}
+
+    vip_val = cf.get('vip')
+    is_vip = 1 if vip_val and isinstance(vip_val, list) and len(vip_val) > 0 else 0
+    dev_task1 = get_cf_value(cf, 'note')
+    dev_task2 = get_cf_value(cf, 'dev_task_2')
+
+    s_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    writer.tickets.append((t_id, t.get('title'), db_category_id, db_user_id, db_status_id, db_client_id, db_contact_id,
+                          t.get('priority'), t.get('stage'), c_at, e_at, fa_at, lao_at, lac_at, reopen_at,
+                          real_activity_count, followers_str, account_title_flat, is_vip, dev_task1, dev_task2, s_at))
+    writer.maybe_flush()
+
+
+# --- CELÁ SYNCHRONIZACE ---
+def list_sync_tickets(client, mode, d_from, d_to, category_ids, watermark, page_workers, progress, cancel_event, take=1000):
+    """Krok 1: seznam ticketů z API (období / od značky). Dlouhá období po časových oknech."""
+    api_tickets = []
+    cat_filters = [{"field": "category", "operator": "in", "value": list(category_ids)}] if category_ids else []
+
+    if mode == "since":
+        base_params = build_query([{"field": "edited", "operator": "gte", "value": watermark['edited']}], fields=TICKET_SYNC_FIELDS)
+        inner = client.iter_pages("tickets.json", base_params, take=take, max_workers=page_workers)
+        source = ((batch, None, total) for batch, total in inner)
+    elif (d_to - d_from).days + 1 > API_SHARD_MIN_DAYS:
+        # ZMĚNA: Dlouhé období se dělí na časová okna dle 'edited' (krátké skip offsety, okna souběžně)
+        inner = client.iter_windows("tickets.json", cat_filters, "edited", d_from, d_to, fields=TICKET_SYNC_FIELDS, take=take, max_workers=page_workers)
+        source = ((batch, (done_days, total_days), None) for batch, done_days, total_days in inner)
+    else:
+        # Stránkování (skip/take) řeší klient, po první stránce se zbylé stahují souběžně
+        base_params = build_query(date_range_filters("edited", d_from, d_to) + cat_filters, fields=TICKET_SYNC_FIELDS)
+        inner = client.iter_pages("tickets.json", base_params, take=take, max_workers=page_workers)
+        source = ((batch, None, total) for batch, total in inner)
+
+    try:
+        for batch, days, total in source:
+            if cancel_event.is_set(): raise SyncCancelled()
+            if mode == "since":
+                # Tickety přesně ze značky už byly zpracovány minule
+                batch = [t for t in batch if not (str(t.get('edited')) == watermark['edited'] and str(t['name']) in watermark['ids'])]
+            api_tickets.extend(batch)
+            progress("listing", listed=len(api_tickets), total=total, days=days)
+    finally:
+        # Zruší rozpracované stránky / okna
+        inner.close()
+    return api_tickets
+
+def _process_tickets(client, conn, run_id, remaining, done_offset, last_t_id, total_tickets, summary, max_workers, max_rps,
+                     bulk_size, write_batch, progress, cancel_event, commit_every):
+    """Fáze 3 synchronizace: stažení aktivit a zápis ticketů s checkpointy (conn = zapisovací spojení)."""
+    db = DBLookup(conn)
+    writer = SyncWriter(conn, write_batch)
+    activity_state = get_activity_state(conn, [t['name'] for t in remaining])
+    if bulk_size and bulk_size > 1:
+        activity_stream = iter_ticket_activities_bulk(client, remaining, max_workers=int(max_workers), max_rps=max_rps, activity_state=activity_state, bulk_size=int(bulk_size))
+    else:
+        activity_stream = iter_ticket_activities(client, remaining, max_workers=int(max_workers), max_rps=max_rps, activity_state=activity_state)
+    i = done_offset
+    try:
+        for i, (t, all_activities, is_delta) in enumerate(activity_stream, start=done_offset + 1):
+            if cancel_event.is_set():
+                activity_stream.close()
+                save_sync_checkpoint(conn, run_id, i - 1, last_t_id, status="stopped"); writer.commit()
+                raise SyncCancelled()
+
+            t_id = t['name']
+            # ZMĚNA: Číselníky dalších SYNC_LOOKUP_BATCH ticketů najednou (stream zachovává pořadí remaining)
+            k = i - done_offset - 1
+            if k % SYNC_LOOKUP_BATCH == 0: prefetch_ticket_codebooks(db, remaining[k:k + SYNC_LOOKUP_BATCH])
+            if is_delta: summary["delta"] += 1
+            store_ticket(db, writer, t, all_activities, activity_state[str(t_id)]['count'] if is_delta else None)
+            last_t_id = t_id
+            summary["tickets"] += 1
+            if i % commit_every == 0:
+                save_sync_checkpoint(conn, run_id, i, t_id)
+                writer.commit()
+            progress("processing", processed=i, total=total_tickets, ticket_id=t_id, run_id=run_id)
+
+        save_sync_checkpoint(conn, run_id, total_tickets, last_t_id)
+        writer.commit()
+        finish_sync_run(run_id, "done", conn)
+        prune_rollups(conn); conn.commit()
+        # ZMĚNA: Nová databáze – slovník komprese obsahu z prvních stažených aktivit
+        if ensure_dictionary(conn): conn.commit()
+        # ZMĚNA: Bloky historie, na které po nahrazení aktivit už nic neodkazuje
+        if prune_blocks(conn): conn.commit()
+        # ZMĚNA: Aktualizace statistik pro plánovač dotazů (ANALYZE jen tam, kde je potřeba)
+        conn.execute("PRAGMA optimize")
+    except SyncCancelled:
+        raise
+    except Exception:
+        # Nedokončený ticket se zahodí, běh zůstává navázatelný od posledního checkpointu
+        conn.rollback(); writer.reset()
+        conn.execute("UPDATE sync_runs SET status = 'failed', updated_at = ? WHERE run_id = ?", (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id))
+        conn.commit()
+        raise
+    finally:
+        activity_stream.close()
+
+def run_sync(client, mode="range", d_from=None, d_to=None, category_ids=None, category_titles=None, resume_run_id=None,
+             max_workers=SYNC_MAX_WORKERS, max_rps=SYNC_MAX_RPS, page_workers=API_PAGE_WORKERS, bulk_size=SYNC_BULK_TICKETS,
+             write_batch=SYNC_WRITE_BATCH, progress=None, cancel_event=None, commit_every=50):
+    """
+    Celá synchronizace: výpis ticketů -> porovnání s DB -> stažení aktivit a zápis s checkpointy.
+    mode: 'range' (d_from..d_to dle 'edited'), 'since' (od značky posledního běhu), 'resume' (běh resume_run_id).
+    bulk_size > 1 zapne hromadné stahování aktivit (viz iter_ticket_activities_bulk),
+    write_batch = počet řádků v jedné dávce zápisu (SyncWriter); commit proběhne vždy po commit_every ticketech.
+    Vrací souhrn {run_id, listed, tickets, delta, duration}; při přerušení vyhodí SyncCancelled.
+    """
+    progress = progress or (lambda phase, **kw: None)
+    cancel_event = cancel_event or threading.Event()
+    started = time.time()
+    summary = {"run_id": resume_run_id, "listed": 0, "tickets": 0, "delta": 0, "duration": 0.0}
+    init_db()
+
+    if mode == "resume":
+        run_id = resume_run_id
+        to_process = load_pending_tickets(run_id)
+        row = get_read_connection().execute("SELECT processed_count, last_ticket_id, status FROM sync_runs WHERE run_id = ?", (run_id,)).fetchone()
+        # ZMĚNA: Dokončené / zahozené běhy (např. --resume s libovolným ID) se nemění
+        if not row or row[2] not in UNFINISHED_STATUSES:
+            raise ValueError(f"Běh {run_id} neexistuje nebo není rozpracovaný ({row[2] if row else 'nenalezen'}).")
+        if not to_process:
+            finish_sync_run(run_id, "discarded")
+            raise ValueError("Rozpracovaný běh nemá uložený seznam ticketů, spusťte synchronizaci znovu.")
+        done_offset, last_t_id = row[0] or 0, row[1]
+    else:
+        watermark = get_watermark()
+        if mode == "since" and not watermark: raise ValueError("Značka posledního běhu neexistuje (databáze je prázdná).")
+        progress("listing", listed=0)
+        api_tickets = list_sync_tickets(client, mode, d_from, d_to, category_ids, watermark, page_workers, progress, cancel_event)
+        summary["listed"] = len(api_tickets)
+
+        progress("compare", listed=len(api_tickets))
+        db_map = get_db_ticket_map()
+        to_process = [t for t in api_tickets if t['name'] not in db_map or str(t['edited']) > str(db_map[t['name']])]
+
+        # Značku lze posunout jen tehdy, když výpis pokryl vše od ní (nebo od začátku) bez filtru kategorií
+        new_watermark = None
+        if mode == "since" or (not category_ids and (not watermark or str(d_from) <= watermark['edited'][:10])):
+            new_watermark = compute_watermark(api_tickets)
+
+        if not to_process:
+            if new_watermark:
+                with writer() as conn: save_watermark(conn, new_watermark)
+            summary["duration"] = time.time() - started
+            progress("done", **summary)
+            return summary
+
+        if mode == "since": d_from, d_to = watermark['edited'][:10], date.today()
+        run_id = create_sync_run(d_from, d_to, category_titles or [], to_process, watermark=new_watermark)
+        done_offset, last_t_id = 0, None
+
+    summary["run_id"] = run_id
+    total_tickets = len(to_process)
+    remaining = to_process[done_offset:]
+    progress("processing", processed=done_offset, total=total_tickets, run_id=run_id)
+
+    # Zapisovací spojení drží synchronizace po celou dobu zpracování (jediný zapisovatel),
+    # statistiky a prohlížeč DB mezitím čtou vlastními spojeními (WAL)
+    with writer() as conn:
+        _process_tickets(client, conn, run_id, remaining, done_offset, last_t_id, total_tickets, summary, max_workers, max_rps,
+                         bulk_size, write_batch, progress, cancel_event, commit_every)
+
+    # ZMĚNA: Sloupcové snapshoty pro statistiky (mimo zapisovací zámek; chyba synchronizaci neshodí,
+    # zastaralý snapshot se jen nepoužije)
+    if SNAPSHOT_AFTER_SYNC:
+        try: snapshots.build_snapshots(progress)
+        except Exception as e: progress("snapshot_error", message=str(e))
+
+    summary["duration"] = time.time() - started
+    progress("done", **summary)
+    return summary
@@ -0,0 +1,107 @@
+"""
+Fulltextové vyhledávání v obsahu aktivit (FTS5 tabulka activities_fts, viz migrace 3 a 7).
+
+Index je bez obsahu (content=''), text je jen komprimovaný v activities.content_z.
+Udržuje ho SyncWriter.flush (index_activities / unindex_activities), schéma nemá
+žádné triggery ani pohledy závislé na funkcích aplikace. Po zásazích do activities mimo
+aplikaci zůstanou v indexu jen neplatné řádky (ID aktivit se neopakují), rebuild_index je odstraní.
+Výsledky se řadí podle relevance (bm25), úryvek se zvýrazněnými výrazy vzniká
+nad rozbaleným textem nalezených aktivit v dočasné FTS5 tabulce.
+"""
+import re
+import pandas as pd
+from utils.storage import writer
+
+FTS_TABLE = "activities_fts"
+SNIPPET_TABLE = "temp.activities_snippets"
+SNIPPET_TOKENS = 16
+TOKENIZE = "unicode61 remove_diacritics 2"
+
+def is_available(conn):
+    if conn is None: return False
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone() is not None
+
+def create_index(conn):
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(content, content='', tokenize='{TOKENIZE}')")
+
+def index_activities(conn, rows):
+    """Přidá do indexu řádky (activity_id, text)."""
+    conn.executemany(f"INSERT INTO {FTS_TABLE} (rowid, content) VALUES (?, ?)", rows)
+
+def unindex_activities(conn, rows):
+    """Odebere z indexu řádky (activity_id, text) – text musí být stejný, jaký se indexoval."""
+    conn.executemany(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, content) VALUES ('delete', ?, ?)", rows)
+
+def reindex(conn):
+    """Naplní index znovu z obsahu všech aktivit (conn = zapisovací spojení s content_text)."""
+    conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')")
+    last = 0
+    while True:
+        rows = conn.execute("SELECT activity_id, content_text(content_z) FROM activities WHERE activity_id > ? ORDER BY activity_id LIMIT 1000", (last,)).fetchall()
+        if not rows: return
+        index_activities(conn, rows)
+        last = rows[-1][0]
+
+def build_match_query(text, raw=False):
+    """
+    Převod zadaného textu na dotaz FTS5. Každé slovo (nebo "fráze v uvozovkách") musí
+    být v textu obsaženo; hvězdička na konci slova hledá začátek slova (doprav*).
+    raw=True předá text beze změny (plná syntaxe FTS5: OR, NOT, NEAR, závorky).
+    """
+    text = (text or "").strip()
+    if raw or not text: return text
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', text):
+        if phrase: terms.append('"' + phrase.replace('"', "") + '"')
+        else:
+            prefix = word.endswith("*")
+            word = word.rstrip("*").replace('"', "")
+            if word: terms.append('"' + word + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def search_activities(conn, text, date_from=None, date_to=None, category_ids=None, directions=None, limit=200, raw=False):
+    """
+    Nejrelevantnější aktivity pro hledaný text (DataFrame).
+    date_from/date_to = rozsah created_at (včetně obou dnů), category_ids/directions = omezení výsledků.
+    """
+    match = build_match_query(text, raw)
+    if not match: return pd.DataFrame()
+    where, params = [f"{FTS_TABLE} MATCH ?"], [match]
+    if date_from: where.append("a.created_at >= ?"); params.append(str(date_from))
+    if date_to: where.append("a.created_at < date(?, '+1 day')"); params.append(str(date_to))
+    if category_ids:
+        where.append(f"a.category_id IN ({','.join('?' * len(category_ids))})"); params.extend(category_ids)
+    if directions:
+        where.append(f"a.direction IN ({','.join('?' * len(directions))})"); params.extend(directions)
+    query = f'''
+        SELECT a.ticket_id, t.title AS ticket_title, a.created_at, a.direction, a.type, c.title AS category,
+               round(-bm25({FTS_TABLE}), 2) AS score, a.activity_id, content_text(a.content_z) AS content
+        FROM {FTS_TABLE}
+        JOIN activities a ON a.activity_id = {FTS_TABLE}.rowid
+        LEFT JOIN tickets t ON t.ticket_id = a.ticket_id
+        LEFT JOIN categories c ON c.category_id = a.category_id
+        WHERE {" AND ".join(where)}
+        ORDER BY rank
+        LIMIT {int(limit)}
+    '''
+    df = pd.read_sql_query(query, conn, params=params)
+    df.insert(6, "snippet", _snippets(conn, df, match))
+    return df.drop(columns="content")
+
+def _snippets(conn, df, match):
+    """Úryvky (snippet FTS5) pro nalezené aktivity – index sám text neobsahuje."""
+    if df.empty: return []
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {SNIPPET_TABLE} USING fts5(content, tokenize='{TOKENIZE}')")
+    try:
+        conn.executemany(f"INSERT INTO {SNIPPET_TABLE} (rowid, content) VALUES (?, ?)", zip(df["activity_id"].tolist(), df["content"].tolist()))
+        found = dict(conn.execute(f'''SELECT rowid, snippet(activities_snippets, 0, '**', '**', ' … ', {SNIPPET_TOKENS})
+                                     FROM {SNIPPET_TABLE} WHERE activities_snippets MATCH ?''', (match,)))
+    finally:
+        conn.execute(f"DELETE FROM {SNIPPET_TABLE}")
+        if conn.in_transaction: conn.commit()
+    return [found.get(a, "") for a in df["activity_id"]]
+
+def rebuild_index(timeout=None):
+    """Přestaví index z tabulky activities (např. po ručních zásazích přes SQL mimo aplikaci)."""
+    with writer(timeout=timeout) as conn:
+        reindex(conn)
@@ -0,0 +1,208 @@
+"""
+Verzované změny schématu lokální databáze (PRAGMA user_version).
+
+Základní tabulky vytváří db_sync.init_db (CREATE TABLE IF NOT EXISTS), vše další
+se přidává jako nová položka na konec MIGRATIONS – existující databázi tak není
+nutné mazat. Každá migrace běží ve vlastní transakci spolu se zvýšením user_version,
+takže se buď provede celá, nebo vůbec. Už vydané migrace se nemění.
+Krok migrace je SQL příkaz (str) nebo funkce f(conn) pro převod dat.
+"""
+from utils.rollups import create_rollup_tables, rebuild_rollups
+from utils.content_store import create_content_tables, store_dictionary, encode_rows, create_text_view
+from utils import fulltext
+
+# --- MIGRACE 2: časové údaje v jednom sloupci ---
+# Dvojice TEXT sloupců *_date / *_time se nahrazují jedním sloupcem *_at ve tvaru
+# 'YYYY-MM-DD HH:MM:SS' (stejný formát jako Daktela, řadí se správně i jako text,
+# takže rozsahy a MAX() jdou přes index). Původní tvar zůstává dostupný přes pohledy
+# tickets_split / activities_split.
+TICKET_TIMESTAMPS = ["created", "edited", "first_answer", "last_activity_op", "last_activity_cl", "reopen", "last_synced"]
+ACTIVITY_TIMESTAMPS = ["created"]
+
+def _split_columns_sql(prefixes):
+    return ", ".join(f"substr({p}_at, 1, 10) AS {p}_date, substr({p}_at, 12, 8) AS {p}_time" for p in prefixes)
+
+def _merge_timestamps(conn, table, prefixes):
+    for p in prefixes:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {p}_at TEXT")
+        conn.execute(f'''UPDATE {table} SET {p}_at = CASE WHEN COALESCE({p}_date, '') = '' THEN NULL
+                            ELSE {p}_date || ' ' || COALESCE(NULLIF({p}_time, ''), '00:00:00') END''')
+    for p in prefixes:
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN {p}_date")
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN {p}_time")
+
+def migrate_single_timestamps(conn):
+    # Indexy nad rušenými sloupci musí pryč dřív než sloupce (DROP COLUMN vyžaduje SQLite 3.35+)
+    for idx in ("idx_tickets_edited", "idx_tickets_created", "idx_activities_created"):
+        conn.execute(f"DROP INDEX IF EXISTS {idx}")
+    _merge_timestamps(conn, "tickets", TICKET_TIMESTAMPS)
+    _merge_timestamps(conn, "activities", ACTIVITY_TIMESTAMPS)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_edited_at ON tickets (edited_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON tickets (created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activities_created_at ON activities (created_at)")
+    conn.execute(f"CREATE VIEW IF NOT EXISTS tickets_split AS SELECT *, {_split_columns_sql(TICKET_TIMESTAMPS)} FROM tickets")
+    conn.execute(f"CREATE VIEW IF NOT EXISTS activities_split AS SELECT *, {_split_columns_sql(ACTIVITY_TIMESTAMPS)} FROM activities")
+    conn.execute("ANALYZE")
+
+# --- MIGRACE 3: fulltext nad obsahem aktivit ---
+# FTS5 s externím obsahem (text se neukládá podruhé, bere se z activities.content; od migrace 6 z activities_text),
+# index udržují triggery při každém zápisu/mazání aktivit. Tokenizér ignoruje diakritiku.
+def create_fulltext_index(conn):
+    if not any(row[0] == "ENABLE_FTS5" for row in conn.execute("PRAGMA compile_options")):
+        return  # SQLite bez FTS5: vyhledávání zůstane nedostupné (utils.fulltext.is_available)
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(
+        content, content='activities', content_rowid='activity_id', tokenize='unicode61 remove_diacritics 2')''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS activities_fts_ai AFTER INSERT ON activities BEGIN
+        INSERT INTO activities_fts (rowid, content) VALUES (new.activity_id, new.content); END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS activities_fts_ad AFTER DELETE ON activities BEGIN
+        INSERT INTO activities_fts (activities_fts, rowid, content) VALUES ('delete', old.activity_id, old.content); END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS activities_fts_au AFTER UPDATE OF content ON activities BEGIN
+        INSERT INTO activities_fts (activities_fts, rowid, content) VALUES ('delete', old.activity_id, old.content);
+        INSERT INTO activities_fts (rowid, content) VALUES (new.activity_id, new.content); END''')
+    conn.execute("INSERT INTO activities_fts (activities_fts) VALUES ('rebuild')")
+
+# --- MIGRACE 4: souhrnné tabulky pro statistiky (viz utils.rollups) ---
+def create_rollups(conn):
+    create_rollup_tables(conn)
+    rebuild_rollups(conn)
+
+# --- MIGRACE 5: seznam statusů přímo u ticketu ---
+# tickets.status_titles = názvy všech statusů ticketu ('A, B'), jen pro zobrazení; udržuje ho
+# SyncWriter.flush. Filtrování podle statusu jde přes ticket_statuses a krycí index (status_id, ticket_id).
+SQL_STATUS_TITLES = '''UPDATE tickets SET status_titles = (
+    SELECT GROUP_CONCAT(st.title, ', ') FROM ticket_statuses ts JOIN statuses st ON st.status_id = ts.status_id
+    WHERE ts.ticket_id = tickets.ticket_id)'''
+
+def add_status_titles(conn):
+    conn.execute("ALTER TABLE tickets ADD COLUMN status_titles TEXT")
+    conn.execute(SQL_STATUS_TITLES)
+    conn.execute("DROP INDEX IF EXISTS idx_ticket_statuses_status")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_statuses_status_ticket ON ticket_statuses (status_id, ticket_id)")
+    conn.execute("ANALYZE ticket_statuses")
+
+# --- MIGRACE 6: komprimovaný a deduplikovaný obsah aktivit (viz utils.content_store) ---
+# activities.content se nahrazuje blobem content_z, citovaná historie je sdílená v content_blocks.
+# Text čtou všichni přes pohled activities_text (sloupce activities, content = content_text(content_z)),
+# ze kterého bere obsah i fulltext. Migrace, které přidají sloupec do activities, musí pohled obnovit.
+FTS_TRIGGERS = ("activities_fts_ai", "activities_fts_ad", "activities_fts_au")
+
+def create_activities_text_view(conn, columns):
+    select = ", ".join("content_text(content_z) AS content" if c == "content" else c for c in columns)
+    conn.execute("DROP VIEW IF EXISTS activities_text")
+    conn.execute(f"CREATE VIEW activities_text AS SELECT {select} FROM activities")
+
+def compress_activity_content(conn):
+    create_content_tables(conn)
+    # Slovník ze vzorku stávajících textů (u prázdné DB vznikne po první synchronizaci, content_store.ensure_dictionary)
+    sample = [r[0] for r in conn.execute('''SELECT content FROM activities
+                                            WHERE activity_id IN (SELECT activity_id FROM activities ORDER BY random() LIMIT 2000)''')]
+    if len(sample) >= 100: store_dictionary(conn, sample)
+    conn.execute("ALTER TABLE activities ADD COLUMN content_z BLOB")
+    last = 0
+    while True:
+        rows = conn.execute("SELECT activity_id, content FROM activities WHERE activity_id > ? ORDER BY activity_id LIMIT 1000", (last,)).fetchall()
+        if not rows: break
+        blobs = encode_rows(conn, [r[1] for r in rows])
+        conn.executemany("UPDATE activities SET content_z = ? WHERE activity_id = ?", zip(blobs, (r[0] for r in rows)))
+        last = rows[-1][0]
+    # Pohledy, triggery a FTS nad sloupcem content musí pryč dřív než sloupec
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(activities)") if row[1] != "content_z"]
+    fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'activities_fts'").fetchone() is not None
+    for trigger in FTS_TRIGGERS: conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS activities_fts")
+    conn.execute("DROP VIEW IF EXISTS activities_split")
+    conn.execute("ALTER TABLE activities DROP COLUMN content")
+    create_activities_text_view(conn, columns)
+    conn.execute(f"CREATE VIEW activities_split AS SELECT *, {_split_columns_sql(ACTIVITY_TIMESTAMPS)} FROM activities_text")
+    if not fts: return
+    conn.execute('''CREATE VIRTUAL TABLE activities_fts USING fts5(
+        content, content='activities_text', content_rowid='activity_id', tokenize='unicode61 remove_diacritics 2')''')
+    conn.execute('''CREATE TRIGGER activities_fts_ai AFTER INSERT ON activities BEGIN
+        INSERT INTO activities_fts (rowid, content) VALUES (new.activity_id, content_text(new.content_z)); END''')
+    conn.execute('''CREATE TRIGGER activities_fts_ad AFTER DELETE ON activities BEGIN
+        INSERT INTO activities_fts (activities_fts, rowid, content) VALUES ('delete', old.activity_id, content_text(old.content_z)); END''')
+    conn.execute('''CREATE TRIGGER activities_fts_au AFTER UPDATE OF content_z ON activities BEGIN
+        INSERT INTO activities_fts (activities_fts, rowid, content) VALUES ('delete', old.activity_id, content_text(old.content_z));
+        INSERT INTO activities_fts (rowid, content) VALUES (new.activity_id, content_text(new.content_z)); END''')
+    conn.execute("INSERT INTO activities_fts (activities_fts) VALUES ('rebuild')")
+
+# --- MIGRACE 7: schéma bez funkcí aplikace ---
+# Pohledy a triggery z migrace 6 volaly content_text(), takže databázi nešlo ani mazat
+# spojením bez funkcí aplikace (sqlite3 CLI, zálohy, DuckDB). activities_text je nově dočasný
+# pohled každého spojení z utils.storage (content_store.create_text_view), activities_split
+# čte přímo activities (obsah jako content_z) a fulltext je index bez obsahu, který
+# udržuje SyncWriter.flush (viz utils.fulltext).
+def drop_function_dependent_schema(conn):
+    for trigger in FTS_TRIGGERS: conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP VIEW IF EXISTS main.activities_split")
+    conn.execute("DROP VIEW IF EXISTS main.activities_text")
+    conn.execute(f"CREATE VIEW activities_split AS SELECT *, {_split_columns_sql(ACTIVITY_TIMESTAMPS)} FROM activities")
+    if not fulltext.is_available(conn): return
+    conn.execute(f"DROP TABLE {fulltext.FTS_TABLE}")
+    fulltext.create_index(conn)
+    fulltext.reindex(conn)
+
+MIGRATIONS = [
+    (1, "Indexy pro mazání/čtení aktivit podle ticketu, rozsahy dat a spojení číselníků", [
+        "CREATE INDEX IF NOT EXISTS idx_activities_ticket ON activities (ticket_id, activity_order)",
+        "CREATE INDEX IF NOT EXISTS idx_activities_created ON activities (created_date, created_time)",
+        "CREATE INDEX IF NOT EXISTS idx_activities_queue ON activities (queue_id)",
+        "CREATE INDEX IF NOT EXISTS idx_activities_category ON activities (category_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_statuses_status ON ticket_statuses (status_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_edited ON tickets (edited_date, edited_time)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_created ON tickets (created_date, created_time)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_category ON tickets (category_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets (status_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_client ON tickets (client_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_contact ON tickets (contact_id)",
+        "CREATE INDEX IF NOT EXISTS idx_contacts_client ON contacts (client_id)",
+        "ANALYZE",
+    ]),
+    (2, "Časové údaje v jednom sloupci *_at místo dvojic *_date/*_time (+ pohledy pro zpětnou kompatibilitu)", [
+        migrate_single_timestamps,
+    ]),
+    (3, "Fulltextový index (FTS5) nad obsahem aktivit", [
+        create_fulltext_index,
+    ]),
+    (4, "Denní souhrny ticketů (den × hodina × kategorie × uživatel × status × priorita) pro statistiky", [
+        create_rollups,
+    ]),
+    (5, "Seznam statusů u ticketu (status_titles) a krycí index ticket_statuses (status_id, ticket_id)", [
+        add_status_titles,
+    ]),
+    (6, "Komprimovaný obsah aktivit se sdíleným slovníkem a deduplikovanou citovanou historií (pohled activities_text)", [
+        compress_activity_content,
+    ]),
+    (7, "Pohledy, triggery a fulltext bez funkcí aplikace (fulltext bez obsahu, activities_text jako dočasný pohled)", [
+        drop_function_dependent_schema,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn, progress=None):
+    """Provede chybějící migrace (conn = zapisovací spojení). Vrací seznam provedených verzí."""
+    current = get_schema_version(conn)
+    if conn.in_transaction: conn.commit()
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current: continue
+        if progress: progress("migration", version=version, description=description)
+        try:
+            conn.execute("BEGIN")
+            for step in steps:
+                if callable(step): step(conn)
+                else: conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise RuntimeError(f"Migrace databáze na verzi {version} selhala ({description}): {e}") from e
+        applied.append(version)
+    # Dočasný pohled activities_text podle aktuálních sloupců activities
+    if applied: create_text_view(conn)
+    return applied
@@ -0,0 +1,113 @@
+"""
+Souhrnné (rollup) tabulky ticketů pro rychlé statistiky.
+
+ticket_rollup         – počet ticketů a aktivit za den (created_at) × kategorii × uživatele × hlavní status × prioritu
+ticket_status_rollup  – počet ticketů za den × kategorii × uživatele × prioritu × každý status ticketu (ticket_statuses)
+ticket_hour_rollup    – počet ticketů za den × hodinu × kategorii (rozložení v týdnu; hodina v hlavním
+                        klíči by souhrn rozdrobila zhruba na počet ticketů)
+
+Synchronizace je udržuje průběžně (SyncWriter.flush): před zápisem dávky se odečte
+příspěvek starých řádků jejích ticketů, po zápisu se přičte nový. Chybějící hodnoty
+dimenzí se ukládají jako 0 / '' (NULL v primárním klíči by se nesčítal).
+Po zásazích do tickets mimo synchronizaci je potřeba rebuild_rollups().
+"""
+import pandas as pd
+
+ROLLUP_TABLES = ("ticket_rollup", "ticket_status_rollup", "ticket_hour_rollup")
+_CHUNK = 500
+
+SQL_TICKET_DELTA = '''
+    INSERT INTO ticket_rollup (day, category_id, user_id, status_id, priority, tickets, activities)
+    SELECT substr(created_at, 1, 10), IFNULL(category_id, 0), IFNULL(user_id, 0), IFNULL(status_id, 0), IFNULL(priority, ''),
+           ? * COUNT(*), ? * IFNULL(SUM(activity_count), 0)
+    FROM tickets WHERE created_at IS NOT NULL {where}
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (day, category_id, user_id, status_id, priority)
+    DO UPDATE SET tickets = tickets + excluded.tickets, activities = activities + excluded.activities'''
+
+SQL_HOUR_DELTA = '''
+    INSERT INTO ticket_hour_rollup (day, hour, category_id, tickets)
+    SELECT substr(created_at, 1, 10), CAST(substr(created_at, 12, 2) AS INTEGER), IFNULL(category_id, 0), ? * COUNT(*)
+    FROM tickets WHERE created_at IS NOT NULL {where}
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, hour, category_id) DO UPDATE SET tickets = tickets + excluded.tickets'''
+
+SQL_STATUS_DELTA = '''
+    INSERT INTO ticket_status_rollup (day, category_id, user_id, priority, status_id, tickets)
+    SELECT substr(t.created_at, 1, 10), IFNULL(t.category_id, 0), IFNULL(t.user_id, 0), IFNULL(t.priority, ''), ts.status_id, ? * COUNT(*)
+    FROM ticket_statuses ts JOIN tickets t ON t.ticket_id = ts.ticket_id
+    WHERE t.created_at IS NOT NULL {where}
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (day, category_id, user_id, priority, status_id)
+    DO UPDATE SET tickets = tickets + excluded.tickets'''
+
+def create_rollup_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS ticket_rollup (
+        day TEXT NOT NULL, category_id INTEGER NOT NULL, user_id INTEGER NOT NULL, status_id INTEGER NOT NULL,
+        priority TEXT NOT NULL, tickets INTEGER NOT NULL DEFAULT 0, activities INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category_id, user_id, status_id, priority)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS ticket_status_rollup (
+        day TEXT NOT NULL, category_id INTEGER NOT NULL, user_id INTEGER NOT NULL, priority TEXT NOT NULL,
+        status_id INTEGER NOT NULL, tickets INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category_id, user_id, priority, status_id)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS ticket_hour_rollup (
+        day TEXT NOT NULL, hour INTEGER NOT NULL, category_id INTEGER NOT NULL, tickets INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, category_id)) WITHOUT ROWID''')
+
+def apply_ticket_delta(conn, ticket_ids, sign):
+    """Přičte (sign=1) / odečte (sign=-1) aktuální řádky daných ticketů v DB; ticket_ids=None = všechny tickety."""
+    if ticket_ids is None:
+        conn.execute(SQL_TICKET_DELTA.format(where=""), (sign, sign))
+        conn.execute(SQL_STATUS_DELTA.format(where=""), (sign,))
+        conn.execute(SQL_HOUR_DELTA.format(where=""), (sign,))
+        return
+    ticket_ids = list(ticket_ids)
+    for i in range(0, len(ticket_ids), _CHUNK):
+        part = ticket_ids[i:i + _CHUNK]
+        marks = ",".join("?" * len(part))
+        conn.execute(SQL_TICKET_DELTA.format(where=f"AND ticket_id IN ({marks})"), (sign, sign, *part))
+        conn.execute(SQL_STATUS_DELTA.format(where=f"AND t.ticket_id IN ({marks})"), (sign, *part))
+        conn.execute(SQL_HOUR_DELTA.format(where=f"AND ticket_id IN ({marks})"), (sign, *part))
+
+def prune_rollups(conn):
+    """Odstraní vynulované řádky (po změně dimenzí ticketu zůstávají s počtem 0)."""
+    for table in ROLLUP_TABLES: conn.execute(f"DELETE FROM {table} WHERE tickets = 0")
+
+def rebuild_rollups(conn):
+    for table in ROLLUP_TABLES: conn.execute(f"DELETE FROM {table}")
+    apply_ticket_delta(conn, None, 1)
+
+def rollups_available(conn):
+    """Souhrny existují a sedí s počtem ticketů (jinak je bezpečnější číst detailní data)."""
+    if conn is None: return False
+    try:
+        summed = conn.execute("SELECT IFNULL(SUM(tickets), 0) FROM ticket_rollup").fetchone()[0]
+        actual = conn.execute("SELECT COUNT(*) FROM tickets WHERE created_at IS NOT NULL").fetchone()[0]
+        return actual > 0 and summed == actual
+    except Exception:
+        return False
+
+def _with_titles(df, conn):
+    # Stejné pojmenování a hodnoty jako detailní data ve statistikách (název, jinak ID)
+    for col, table, key in (("category_id", "categories", "category_id"), ("user_id", "users", "user_id"), ("status_id", "statuses", "status_id")):
+        if col not in df.columns: continue
+        titles = dict(conn.execute(f"SELECT {key}, title FROM {table}").fetchall())
+        df[col] = [None if v == 0 else (titles.get(v) or v) for v in df[col]]
+    if "priority" in df.columns: df["priority"] = df["priority"].where(df["priority"] != "", None)
+    df["day"] = pd.to_datetime(df["day"], errors="coerce").dt.date
+    return df
+
+def load_ticket_rollup(conn):
+    """Řádky ticket_rollup s názvy číselníků; počet ticketů je ve sloupci _n, aktivit v _activities."""
+    df = pd.read_sql_query('''SELECT day, category_id, user_id, status_id, priority, tickets AS _n, activities AS _activities
+                              FROM ticket_rollup WHERE tickets > 0''', conn)
+    return _with_titles(df, conn)
+
+def load_status_rollup(conn):
+    df = pd.read_sql_query('''SELECT day, category_id, user_id, priority, status_id, tickets AS _n
+                              FROM ticket_status_rollup WHERE tickets > 0''', conn)
+    return _with_titles(df, conn)
+
+def load_hour_rollup(conn):
+    df = pd.read_sql_query("SELECT day, hour, category_id, tickets AS _n FROM ticket_hour_rollup WHERE tickets > 0", conn)
+    return _with_titles(df, conn)
@@ -0,0 +1,132 @@
+"""
+Sloupcové snapshoty ticketů a aktivit pro analytiku (data/snapshots/*.arrow).
+
+Soubory jsou ve formátu Arrow IPC bez komprese – čtou se přes memory map, bez převodu
+řádků na Python objekty a jen ty sloupce, o které se žádá. Obsahují řádky tabulky
+obohacené o názvy z číselníků (_cat_title, _user_title, ...) se správnými typy
+(*_at = datetime, sloupce INTEGER = Int64). Aktivity se čtou z pohledu activities_text
+(obsah rozbalený z content_z, viz utils.content_store).
+
+Snapshot nese podpis stavu databáze (data_signature); pokud nesedí, čte se z SQLite
+stejným dotazem a se stejnými typy, takže volající rozdíl nepozná. Po synchronizaci
+snapshoty přestaví run_sync (SNAPSHOT_AFTER_SYNC), ručně build_snapshots().
+Bez pyarrow se vždy čte z SQLite.
+"""
+import os
+import pandas as pd
+from utils.storage import DATA_DIR, get_read_connection, get_generation
+
+try:
+    import pyarrow as pa
+    from pyarrow import ipc
+except ImportError:
+    pa = None
+
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
+SIGNATURE_KEY = b"db_signature"
+
+SNAPSHOT_QUERIES = {
+    "tickets": '''SELECT t.*, c.title AS _cat_title, u.title AS _user_title, st.title AS _status_title,
+                         cl.title AS _client_title, co.title AS _contact_title
+                  FROM tickets t
+                  LEFT JOIN categories c ON t.category_id = c.category_id
+                  LEFT JOIN users u ON t.user_id = u.user_id
+                  LEFT JOIN statuses st ON t.status_id = st.status_id
+                  LEFT JOIN clients cl ON t.client_id = cl.client_id
+                  LEFT JOIN contacts co ON t.contact_id = co.contact_id''',
+    "activities": '''SELECT a.*, q.title AS _queue_title, c.title AS _cat_title
+                     FROM activities_text a
+                     LEFT JOIN queues q ON a.queue_id = q.queue_id
+                     LEFT JOIN categories c ON a.category_id = c.category_id''',
+}
+
+# Sloupec s ID -> sloupec s názvem ze snapshotu
+TITLE_COLUMNS = {
+    "tickets": {"category_id": "_cat_title", "user_id": "_user_title", "status_id": "_status_title",
+                "client_id": "_client_title", "contact_id": "_contact_title"},
+    "activities": {"queue_id": "_queue_title", "category_id": "_cat_title"},
+}
+
+def is_available():
+    return pa is not None
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, f"{name}.arrow")
+
+def data_signature(conn):
+    """
+    Levný otisk obsahu databáze (indexované agregace tickets/activities a čítač zápisů
+    storage.get_generation); změní se po každé synchronizaci, mazání i ruční úpravě dat.
+    """
+    row = conn.execute('''SELECT (SELECT COUNT(*) FROM tickets), (SELECT MAX(edited_at) FROM tickets),
+                                 (SELECT COUNT(*) FROM activities), (SELECT MAX(activity_id) FROM activities)''').fetchone()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    return "|".join(str(v) for v in (version, get_generation(conn), *row))
+
+def _with_dtypes(df, name, conn):
+    integers = {row[1] for row in conn.execute(f"PRAGMA table_info({name})") if row[2].upper() == "INTEGER"}
+    for col in df.columns:
+        if col.endswith("_at"): df[col] = pd.to_datetime(df[col], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+        elif col in integers: df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+    return df
+
+def _read_sqlite(name, conn, columns=None):
+    query = SNAPSHOT_QUERIES[name]
+    if columns: query = "SELECT " + ", ".join(f'"{c}"' for c in columns) + f" FROM ({query})"
+    return _with_dtypes(pd.read_sql_query(query, conn), name, conn)
+
+def _open_fresh(name, conn):
+    """Reader snapshotu, pokud existuje a odpovídá aktuálním datům, jinak None."""
+    if pa is None or not os.path.exists(snapshot_path(name)): return None
+    try:
+        reader = ipc.open_file(pa.memory_map(snapshot_path(name), "r"))
+        if (reader.schema.metadata or {}).get(SIGNATURE_KEY, b"").decode() == data_signature(conn): return reader
+    except Exception:
+        pass
+    return None
+
+def table_columns(name, conn):
+    """Názvy sloupců (bez načítání dat) – ze snapshotu, jinak z SQLite."""
+    reader = _open_fresh(name, conn)
+    if reader is not None: return reader.schema.names
+    cur = conn.execute(f"SELECT * FROM ({SNAPSHOT_QUERIES[name]}) LIMIT 0")
+    return [d[0] for d in cur.description]
+
+def load_table(name, conn, columns=None):
+    """Obohacená tabulka jako DataFrame; columns = jen vybrané sloupce (None = všechny)."""
+    reader = _open_fresh(name, conn)
+    if reader is None: return _read_sqlite(name, conn, columns)
+    columns = [c for c in columns if c in reader.schema.names] if columns else None
+    batches = [reader.get_batch(i).select(columns) if columns else reader.get_batch(i) for i in range(reader.num_record_batches)]
+    table = pa.Table.from_batches(batches, schema=batches[0].schema if batches else reader.schema)
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get, split_blocks=True)
+
+def build_snapshots(progress=None):
+    """Zapíše snapshoty všech tabulek (čte přes čtecí spojení, zápis nečeká). Vrací {tabulka: počet řádků}."""
+    if pa is None: return {}
+    conn = get_read_connection()
+    if conn is None: return {}
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    # Podpis i data z jedné čtecí transakce (WAL) – souběžný zápis snapshot nerozbije, jen ho zneplatní
+    conn.execute("BEGIN")
+    rows = {}
+    try:
+        signature = data_signature(conn)
+        for name in SNAPSHOT_QUERIES:
+            if progress: progress("snapshot", table=name)
+            table = pa.Table.from_pandas(_read_sqlite(name, conn), preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), SIGNATURE_KEY: signature.encode()})
+            tmp = snapshot_path(name) + ".tmp"
+            with pa.OSFile(tmp, "wb") as sink, ipc.new_file(sink, table.schema) as out:
+                out.write_table(table, max_chunksize=64 * 1024)
+            os.replace(tmp, snapshot_path(name))
+            rows[name] = table.num_rows
+    finally:
+        conn.rollback()
+    return rows
+
+def invalidate():
+    """Smaže snapshoty (např. po ručních úpravách dat, které podpis nemusí zachytit)."""
+    for name in SNAPSHOT_QUERIES:
+        try: os.remove(snapshot_path(name))
+        except FileNotFoundError: pass
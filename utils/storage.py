@@ -0,0 +1,126 @@
+"""
+Správa spojení na lokální SQLite databázi (data/daktela_data.db).
+
+- WAL žurnál: čtení (statistiky, prohlížeč) neblokuje zápis synchronizace a naopak.
+- Jedno zapisovací spojení na proces (writer), sdílené přes zámek. Zámek je reentrantní,
+  takže pomocné funkce mohou writer() volat i uvnitř jiného bloku writer().
+- Čtecí spojení jen pro čtení, jedno na vlákno a znovu používané (get_read_connection).
+  Spojení vláken, která už skončila (rerun Streamlitu běží v novém vlákně), se průběžně zavírají.
+Spojení z tohoto modulu se nezavírají ručně (conn.close()).
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import DB_MMAP_SIZE, DB_CACHE_SIZE_KB, DB_BUSY_TIMEOUT
+from utils.content_store import register_functions
+
+DATA_DIR = "data"
+DB_FILE = os.path.join(DATA_DIR, "daktela_data.db")
+
+class DatabaseBusy(Exception):
+    """Zapisovací spojení drží jiná operace (typicky běžící synchronizace)."""
+
+def db_exists():
+    return os.path.exists(DB_FILE)
+
+def _apply_pragmas(conn, readonly=False):
+    if not readonly: conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    # ZMĚNA: content_text() a dočasný pohled activities_text pro čtení komprimovaného obsahu aktivit
+    return register_functions(conn)
+
+def _connect(readonly=False):
+    if readonly:
+        # Spojení se uvolňují i z jiného vlákna (po skončení vlastníka), proto check_same_thread=False
+        conn = sqlite3.connect(f"file:{os.path.abspath(DB_FILE)}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    else:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+    return _apply_pragmas(conn, readonly)
+
+# --- ČÍTAČ ZÁPISŮ ---
+# sync_metadata['write_generation'] roste s každým commitem, který změnil data (writer(), SyncWriter.commit).
+# Je součástí snapshots.data_signature – kopie dat (snapshoty, DuckDB) tak poznají i změny,
+# které počty řádků ani edited_at neovlivní (přejmenování v číselnících, ruční SQL, ...).
+SQL_BUMP_GENERATION = '''INSERT INTO sync_metadata (key, value, updated_at) VALUES ('write_generation', '1', datetime('now', 'localtime'))
+                         ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = excluded.updated_at'''
+
+def bump_generation(conn):
+    try: conn.execute(SQL_BUMP_GENERATION)
+    except sqlite3.OperationalError: pass  # databáze před init_db (bez sync_metadata)
+
+def get_generation(conn):
+    try: row = conn.execute("SELECT value FROM sync_metadata WHERE key = 'write_generation'").fetchone()
+    except sqlite3.OperationalError: return 0
+    return int(row[0]) if row else 0
+
+# --- ZÁPIS ---
+_writer_lock = threading.RLock()
+_writer_conn = None
+_writer_depth = 0
+
+@contextmanager
+def writer(timeout=None):
+    """
+    Zapisovací spojení procesu. Po dobu bloku je výhradně naše (transakce se nemíchají);
+    při výjimce se neuložené změny vrátí, na konci vnějšího bloku se provede commit.
+    timeout = max. čekání na zámek v sekundách (None = čekat), jinak DatabaseBusy.
+    """
+    global _writer_conn, _writer_depth
+    if not _writer_lock.acquire(timeout=-1 if timeout is None else timeout):
+        raise DatabaseBusy("Databázi právě zapisuje jiná operace (např. synchronizace). Zkuste to později.")
+    try:
+        if _writer_conn is None: _writer_conn = _connect()
+        _writer_depth += 1
+        if _writer_depth == 1: changes = _writer_conn.total_changes
+        try:
+            yield _writer_conn
+            if _writer_depth == 1:
+                # ZMĚNA: Každá změna dat zvýší čítač zápisů (podpis pro snapshoty a DuckDB)
+                if _writer_conn.total_changes != changes: bump_generation(_writer_conn)
+                if _writer_conn.in_transaction: _writer_conn.commit()
+        except BaseException:
+            if _writer_conn.in_transaction: _writer_conn.rollback()
+            raise
+        finally:
+            _writer_depth -= 1
+    finally:
+        _writer_lock.release()
+
+# --- ČTENÍ ---
+_readers = {}       # {ident vlákna: (vlákno, spojení)}
+_readers_lock = threading.Lock()
+
+def get_read_connection():
+    """Čtecí spojení aktuálního vlákna (znovu používané), None pokud databáze ještě neexistuje."""
+    if not db_exists(): return None
+    me = threading.current_thread()
+    with _readers_lock:
+        entry = _readers.get(me.ident)
+        if entry and entry[0] is me: return entry[1]
+        # Úklid spojení po skončených vláknech
+        for ident, (thread, conn) in list(_readers.items()):
+            if not thread.is_alive():
+                try: conn.close()
+                except Exception: pass
+                del _readers[ident]
+        conn = _connect(readonly=True)
+        _readers[me.ident] = (me, conn)
+        return conn
+
+def close_all():
+    """Zavře všechna spojení (např. před smazáním / nahrazením souboru databáze)."""
+    global _writer_conn
+    with _writer_lock:
+        if _writer_conn is not None:
+            _writer_conn.close(); _writer_conn = None
+    with _readers_lock:
+        for _, conn in _readers.values():
+            try: conn.close()
+            except Exception: pass
+        _readers.clear()
@@ -0,0 +1,125 @@
+"""
+Registr synchronizačních úloh běžících na pozadí.
+
+Úloha běží ve vlastním vlákně procesu Streamlitu, takže přežije rerun stránky
+i zavření záložky. Stránka jen čte snapshot() a ruší přes cancel().
+Registr je společný pro všechny relace – současně běží nejvýše jedna synchronizace.
+"""
+import threading
+import time
+import traceback
+from datetime import datetime
+from utils.db_sync import run_sync, SyncCancelled
+
+ACTIVE_STATES = ("queued", "running", "cancelling")
+MAX_FINISHED_JOBS = 20
+
+class SyncJob:
+    def __init__(self, job_id, client, params):
+        self.job_id = job_id
+        self.client = client
+        self.params = params
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self._lock = threading.Lock()
+        self.state = "queued"
+        self.phase = "queued"
+        self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.started = None
+        self.finished = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.start_stats = client.stats_snapshot()
+
+    def update(self, phase, **data):
+        with self._lock:
+            self.phase = phase
+            self.progress.update(data)
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self._lock:
+            if self.state in ACTIVE_STATES: self.state = "cancelling"
+
+    def is_active(self):
+        with self._lock: return self.state in ACTIVE_STATES
+
+    def snapshot(self):
+        """Kopie stavu pro vykreslení (včetně propustnosti a přenesených dat)."""
+        with self._lock:
+            snap = {"job_id": self.job_id, "state": self.state, "phase": self.phase, "params": dict(self.params),
+                    "created_at": self.created_at, "progress": dict(self.progress), "result": self.result, "error": self.error}
+            started, finished = self.started, self.finished
+        elapsed = ((finished or time.time()) - started) if started else 0.0
+        stats = self.client.stats_snapshot()
+        done = max(0, snap["progress"].get("processed", 0) - snap["progress"].get("start_offset", 0))
+        snap.update({
+            "elapsed": elapsed,
+            "tickets_per_sec": done / elapsed if elapsed > 0 else 0.0,
+            "requests": stats["requests"] - self.start_stats["requests"],
+            "wire_bytes": stats["wire_bytes"] - self.start_stats["wire_bytes"],
+            "json_bytes": stats["json_bytes"] - self.start_stats["json_bytes"],
+        })
+        return snap
+
+    def _run(self):
+        with self._lock:
+            if self.state == "queued": self.state = "running"
+            self.started = time.time()
+        first_processing = True
+
+        def on_progress(phase, **data):
+            nonlocal first_processing
+            # Výchozí pozice u navázaného běhu (pro výpočet propustnosti)
+            if phase == "processing" and first_processing:
+                first_processing = False
+                data = {**data, "start_offset": data.get("processed", 0)}
+            self.update(phase, **data)
+
+        try:
+            result = run_sync(self.client, progress=on_progress, cancel_event=self.cancel_event, **self.params)
+            final_state, error = "done", None
+        except SyncCancelled:
+            result, final_state, error = None, "cancelled", None
+        except Exception as e:
+            result, final_state, error = None, "failed", f"{e}\n{traceback.format_exc(limit=3)}"
+        with self._lock:
+            self.result, self.error, self.state = result, error, final_state
+            self.finished = time.time()
+
+# --- REGISTR (sdílený celým procesem) ---
+_jobs = {}
+_jobs_lock = threading.Lock()
+_next_id = 1
+
+def start_sync_job(client, **params):
+    """
+    Spustí synchronizaci na pozadí. Pokud už nějaká běží, nová se nezakládá
+    a vrátí se běžící úloha. Vrací (úloha, nově_založena).
+    """
+    global _next_id
+    with _jobs_lock:
+        active = next((j for j in _jobs.values() if j.is_active()), None)
+        if active: return active, False
+        job = SyncJob(_next_id, client, params)
+        _jobs[_next_id] = job
+        _next_id += 1
+        # Starší dokončené úlohy se z registru průběžně mažou
+        finished = [jid for jid, j in sorted(_jobs.items()) if not j.is_active()]
+        for jid in finished[:-MAX_FINISHED_JOBS]: _jobs.pop(jid, None)
+    job.thread = threading.Thread(target=job._run, name=f"daktela-sync-{job.job_id}", daemon=True)
+    job.thread.start()
+    return job, True
+
+def get_active_job():
+    with _jobs_lock:
+        return next((j for j in _jobs.values() if j.is_active()), None)
+
+def get_last_job():
+    with _jobs_lock:
+        return _jobs[max(_jobs)] if _jobs else None
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)